@@ -0,0 +1,579 @@
+import json
+import logging
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from sqlalchemy import bindparam, text, delete, insert, select, update
+
+import metrics
+from dedup import SeenQuestions, delete_signatures, find_stored_duplicates, signature, store_signatures
+from model_client import chat_completion, MAX_CONCURRENT_REQUESTS
+from models import Schema, Question, QuestionSignature, QuestionUsage
+from practice_db import split_sql_statements
+from prompt_builder import PROMPT_TOKEN_BUDGET, compact_schema, completion_token_budget, count_tokens, fit_sample_data
+from schema_catalog import pack_sample_data, parsed_schemas, unpack_sample_data
+from sql_complexity import fits_request, rate_solutions
+from sql_validation import SQLValidationError, check_allowed_clauses, statements_key
+from storage import session_scope
+
+# The agents don't import Streamlit, so background workers and scripts can use
+# them too; SQL.py wires them into the UI
+
+logger = logging.getLogger(__name__)
+
+# Questions requested per completion in batched generation
+BATCH_SIZE = 10
+# Stand-ins saved for questions that couldn't be generated
+PLACEHOLDER_QUESTION = "Error generating question. Please try again."
+PLACEHOLDER_SOLUTION = "Error generating solution."
+
+# Agents; every public method is timed as a metrics span
+@metrics.instrument
+class SchemaAgent:
+    def __init__(self, Session, compress_sample_data=True):
+        # Each operation opens its own short-lived session from the pooled factory
+        self.Session = Session
+        # Large sample data is stored zlib-compressed
+        self.compress_sample_data = compress_sample_data
+    
+    def initialize_database(self, schemas):
+        for schema_name, schema_info in schemas.items():
+            try:
+                # Save schema and sample data
+                schema_sql = schema_info["schema"]
+                sample_data = json.dumps(schema_info["sample_data"])
+                self.save_schema(schema_name, schema_sql, sample_data)
+                # Initialize the database
+                with session_scope(self.Session) as session:
+                    for command in split_sql_statements(schema_sql):
+                        session.execute(text(command))
+            except Exception as e:
+                logger.error("Error initializing %s schema: %s", schema_name, e)
+
+    def save_schema(self, name, schema_sql, sample_data):
+        stored_data = pack_sample_data(sample_data, self.compress_sample_data)
+        with session_scope(self.Session) as session:
+            session.add(Schema(name=name, schema_sql=schema_sql, sample_data=stored_data))
+        parsed_schemas.invalidate(name)
+
+    def update_sample_data(self, name, sample_data):
+        stored_data = pack_sample_data(sample_data, self.compress_sample_data)
+        with session_scope(self.Session) as session:
+            session.execute(update(Schema).where(Schema.name == name).values(sample_data=stored_data))
+        parsed_schemas.invalidate(name)
+
+    def get_saved_schemas(self):
+        # Only ids and names; schema_sql and sample data are loaded on demand
+        with session_scope(self.Session) as session:
+            return session.query(Schema.id, Schema.name).order_by(Schema.id).all()
+
+    def get_schema_and_data(self, name):
+        entry = parsed_schemas.get(name, self.load_schema_and_data)
+        if entry:
+            return entry
+        return None, None
+
+    def load_schema_and_data(self, name):
+        with session_scope(self.Session) as session:
+            row = session.query(Schema.schema_sql, Schema.sample_data).filter_by(name=name).first()
+        if row:
+            return row.schema_sql, unpack_sample_data(row.sample_data)
+        return None
+
+@metrics.instrument
+class QuestionBankAgent:
+    def __init__(self, Session):
+        self.Session = Session
+
+    def save_questions(self, questions, solutions, schema_name=None, difficulty=None, job_id=None, statements=None):
+        # One multi-row INSERT for the whole batch instead of an add() per question;
+        # returns the new ids. With statements, the questions join their pool.
+        key = statements_key(statements) if statements is not None else None
+        rows = [
+            {"text": question_text, "solution": solution_text, "schema_name": schema_name, "difficulty": difficulty, "job_id": job_id,
+             "complexity_score": points, "complexity_level": level, "statements": key, "served": 0}
+            for question_text, solution_text, (points, level) in zip(questions, solutions, rate_solutions(solutions, [statements] * len(solutions)))
+        ]
+        question_ids = []
+        if rows:
+            with session_scope(self.Session) as session:
+                question_ids = session.execute(
+                    insert(Question).returning(Question.id, sort_by_parameter_order=True), rows
+                ).scalars().all()
+                # Near-duplicate signatures are stored next to the questions, in the same transaction
+                store_signatures(session, question_ids, [signature(*pair) for pair in zip(questions, solutions)], schema_name)
+        return question_ids
+
+    def find_duplicates(self, signatures, schema_name=None):
+        with session_scope(self.Session) as session:
+            return find_stored_duplicates(session, signatures, schema_name)
+
+    def index_signatures(self, batch_size=1000):
+        # Adds signatures for questions stored before the duplicate index existed
+        indexed = 0
+        while True:
+            with session_scope(self.Session) as session:
+                rows = session.execute(
+                    select(Question.id, Question.text, Question.solution, Question.schema_name)
+                    .outerjoin(QuestionSignature, QuestionSignature.question_id == Question.id)
+                    .where(QuestionSignature.question_id.is_(None))
+                    .order_by(Question.id)
+                    .limit(batch_size)
+                ).all()
+                if not rows:
+                    break
+                by_schema = {}
+                for row in rows:
+                    by_schema.setdefault(row.schema_name, []).append(row)
+                for schema_name, schema_rows in by_schema.items():
+                    store_signatures(session, [row.id for row in schema_rows], [signature(row.text, row.solution) for row in schema_rows], schema_name)
+            indexed += len(rows)
+        if indexed:
+            logger.info("Indexed %d stored question(s) for duplicate detection", indexed)
+        return indexed
+
+    def rescore_complexity(self, batch_size=2000, only_missing=False):
+        # Scores stored solutions in id order, one bulk UPDATE per batch; by default
+        # every question is re-scored, e.g. after the weights changed
+        scored = 0
+        last_id = 0
+        statement = (
+            update(Question.__table__)
+            .where(Question.__table__.c.id == bindparam("question_id"))
+            .values(complexity_score=bindparam("points"), complexity_level=bindparam("level"))
+        )
+        while True:
+            with session_scope(self.Session) as session:
+                query = select(Question.id, Question.solution, Question.statements).where(Question.id > last_id)
+                if only_missing:
+                    query = query.where(Question.complexity_score.is_(None))
+                rows = session.execute(query.order_by(Question.id).limit(batch_size)).all()
+                if not rows:
+                    break
+                ratings = rate_solutions([row.solution for row in rows], [row.statements and row.statements.split(",") for row in rows])
+                session.connection().execute(statement, [
+                    {"question_id": row.id, "points": points, "level": level} for row, (points, level) in zip(rows, ratings)
+                ])
+            last_id = rows[-1].id
+            scored += len(rows)
+        if scored:
+            logger.info("Scored the complexity of %d stored question(s)", scored)
+        return scored
+
+    def complexity_levels(self):
+        # (requested difficulty, estimated level) of every stored question
+        with session_scope(self.Session) as session:
+            return session.execute(select(Question.difficulty, Question.complexity_level)).all()
+
+    def search(self, search="", schema_name=None, difficulty=None, before_id=None, limit=20):
+        # Keyset pagination: newest first, each page starts below the last id shown
+        with session_scope(self.Session) as session:
+            query = session.query(Question.id, Question.text, Question.solution)
+            if search.strip():
+                query = query.filter(self.search_filter(session, search))
+            if schema_name:
+                query = query.filter(Question.schema_name == schema_name)
+            if difficulty:
+                query = query.filter(Question.difficulty == difficulty)
+            if before_id is not None:
+                query = query.filter(Question.id < before_id)
+            return query.order_by(Question.id.desc()).limit(limit).all()
+
+    def search_filter(self, session, search):
+        if session.get_bind().dialect.name == 'sqlite':
+            # Each word is matched as a quoted prefix, so user input can't break the FTS syntax
+            terms = ' '.join('"' + word.replace('"', '""') + '"*' for word in search.split())
+            return text(
+                "questions.id IN (SELECT rowid FROM questions_fts WHERE questions_fts MATCH :search)"
+            ).bindparams(search=terms)
+        pattern = f"%{search.strip()}%"
+        return Question.text.ilike(pattern) | Question.solution.ilike(pattern)
+
+    def job_questions(self, job_id):
+        with session_scope(self.Session) as session:
+            return session.query(Question.text, Question.solution).filter(Question.job_id == job_id).order_by(Question.id).all()
+
+    def filter_options(self):
+        with session_scope(self.Session) as session:
+            schema_names = session.execute(
+                select(Question.schema_name).where(Question.schema_name.isnot(None)).distinct().order_by(Question.schema_name)
+            ).scalars().all()
+            difficulties = session.execute(
+                select(Question.difficulty).where(Question.difficulty.isnot(None)).distinct().order_by(Question.difficulty)
+            ).scalars().all()
+        return schema_names, difficulties
+
+    def delete_questions(self, question_ids):
+        if question_ids:
+            with session_scope(self.Session) as session:
+                session.execute(delete(Question).where(Question.id.in_(question_ids)))
+                session.execute(delete(QuestionUsage).where(QuestionUsage.question_id.in_(question_ids)))
+                delete_signatures(session, question_ids)
+
+@metrics.instrument
+class QuestionGenerationAgent:
+    def __init__(self):
+        self.model = "gpt-4"
+        self.prompt_token_budget = PROMPT_TOKEN_BUDGET
+        # Turned off when the user wants fresh questions instead of cached ones
+        self.use_cache = True
+        # Who the requests are made for; the model scheduler takes turns between clients
+        self.client = None
+
+    def generate_sql_prompt(self, schema, sample_data, difficulty, statements, num_questions=1):
+        allowed_statements = ', '.join(statements)
+
+        # Customize the prompt based on the difficulty level and selected statements
+        if "WHERE" in statements:
+            if difficulty in ["Level 1", "Level 2"]:
+                complexity_instruction = "Generate a basic SQL question using SELECT, FROM, and WHERE clauses with simple conditions."
+            elif difficulty == "Level 3":
+                complexity_instruction = """Generate a basic SQL question using SELECT, FROM, WHERE clauses with multiple conditions,
+                                                including basic logical operators (AND, OR)."""
+            elif difficulty in ["Level 4", "Level 5"]:
+                complexity_instruction = "Generate an SQL question using SELECT, FROM, WHERE, and advanced conditions like LIKE, IN, or BETWEEN."
+
+        elif "JOIN" in statements:
+            if difficulty in ["Level 1", "Level 2"]:
+                complexity_instruction = "Generate a basic SQL question using SELECT, FROM, and JOIN to combine data from two tables."
+            elif difficulty in ["Level 3", "Level 4"]:
+                complexity_instruction = "Generate an SQL question using SELECT, FROM, JOIN with multiple tables and complex conditions."
+            elif difficulty == "Level 5":
+                complexity_instruction = "Generate a SQL question involving complex JOIN operations, and advanced filtering techniques using LIKE, BETWEEN or IN."
+
+        elif "GROUP BY" in statements:
+            if "HAVING" in statements:
+                if difficulty in ["Level 1", "Level 2"]:
+                    complexity_instruction = "Generate a basic SQL question using SELECT, FROM, GROUP BY with a simple HAVING clause."
+                elif difficulty in ["Level 3", "Level 4"]:
+                    complexity_instruction = "Generate an SQL question using SELECT, FROM, GROUP BY, and HAVING with more complex conditions."
+                elif difficulty == "Level 5":
+                    complexity_instruction = "Generate an advanced SQL question using SELECT, FROM, GROUP BY, and HAVING with multiple filtering conditions but without subqueries."
+            else:
+                if difficulty in ["Level 1", "Level 2"]:
+                    complexity_instruction = "Generate a basic SQL question using SELECT, FROM, and GROUP BY with simple aggregation."
+                elif difficulty in ["Level 3", "Level 4"]:
+                    complexity_instruction = "Generate an SQL question using SELECT, FROM, and GROUP BY with more complex aggregation and filtering."
+                elif difficulty == "Level 5":
+                    complexity_instruction = "Generate an advanced SQL question using SELECT, FROM, and GROUP BY with complex conditions, possibly involving advanced filtering techniques."
+
+        elif "ORDER BY" in statements:
+            if difficulty in ["Level 1", "Level 2"]:
+                complexity_instruction = "Generate a basic SQL question using SELECT, FROM, and ORDER BY with simple sorting."
+            elif difficulty in ["Level 3", "Level 4"]:
+                complexity_instruction = "Generate an SQL question using SELECT, FROM, and ORDER BY with multiple sorting criteria."
+            elif difficulty == "Level 5":
+                complexity_instruction = "Generate an advanced SQL question using SELECT, FROM, and ORDER BY with complex sorting criteria and advanced filtering techniques."
+
+        # Sample data gets whatever the rest of the prompt leaves of the token budget:
+        # column statistics plus a few representative rows instead of every row
+        prompt_parts = [
+            f"{complexity_instruction}\n\n",
+            f"Here is the database schema:\n\n{compact_schema(schema)}\n\n",
+            "Sample data for context (column statistics and representative rows):\n\n",
+            "\n\n",
+            f"The SQL should only include the following statements: {allowed_statements}.\n\n",
+            "Respond with a JSON object with fields 'question' and 'solution'." if num_questions == 1 else
+            f"Generate {num_questions} distinct questions. Respond with only a JSON array of {num_questions} "
+            "objects, each with fields 'question' and 'solution'."
+        ]
+        data_budget = self.prompt_token_budget - count_tokens("".join(prompt_parts), self.model)
+        prompt_parts[3] = fit_sample_data(sample_data, data_budget, self.model) + prompt_parts[3]
+        prompt = "".join(prompt_parts)
+        
+        return prompt
+
+    def completion_tokens(self, difficulty, num_questions=1):
+        return completion_token_budget(difficulty, num_questions)
+
+    def get_batch(self, prompt, slot=0, max_tokens=3000, use_cache=None):
+        # One completion holding a JSON array of questions; errors are raised to the
+        # caller. use_cache=False asks the model even when this agent uses the cache.
+        return chat_completion(
+            self.model,
+            [
+                {"role": "system", "content": "You are an assistant skilled in SQL."},
+                {"role": "user", "content": prompt}
+            ],
+            max_tokens=max_tokens,
+            variant=f"batch-{slot}",
+            use_cache=self.use_cache if use_cache is None else use_cache,
+            client=self.client
+        )
+
+# Parsing single items is too cheap and frequent to be worth a span
+@metrics.instrument(exclude=("parse_item", "parse_response"))
+class ValidationAgent:
+    def __init__(self, api_fallback=True):
+        self.model = "gpt-4"
+        # Only ask the model when there is no practice database to run the query against
+        self.api_fallback = api_fallback
+        self.client = None
+
+    def validate_sql(self, sql, allowed_statements, sandbox=None):
+        try:
+            check_allowed_clauses(sql, allowed_statements)
+        except SQLValidationError:
+            return False
+
+        if sandbox is not None:
+            return self.validate_with_database(sql, sandbox)
+        if self.api_fallback:
+            return self.validate_with_api(sql)
+        return False
+
+    def validate_with_database(self, sql, sandbox):
+        try:
+            sandbox.run(sql)
+            return True
+        except SQLValidationError as e:
+            logger.info("Rejected solution: %s", e)
+            return False
+
+    def validate_with_api(self, sql):
+        prompt = (
+            f"Validate the following SQL query. Respond with 'Valid' if the query is valid, "
+            f"otherwise respond with 'Invalid'. Query:\n\n{sql}"
+        )
+        try:
+            validation_result = chat_completion(
+                self.model,
+                [
+                    {"role": "system", "content": "You are an assistant skilled in SQL validation."},
+                    {"role": "user", "content": prompt}
+                ],
+                max_tokens=50,
+                client=self.client
+            ).lower()
+            return validation_result == 'valid'
+        except Exception as e:
+            # Runs on worker threads, where st.error has no page to write to
+            logger.warning("Error during validation: %s", e)
+            return False
+
+    def validate_sample_data(self, schema, sample_data):
+        return True
+
+    def parse_response(self, response):
+        if not response:
+            return "No response received", "No response received"
+
+        try:
+            return self.parse_item(json.loads(response))
+
+        except json.JSONDecodeError:
+            parts = response.split('Solution:')
+            if len(parts) == 2:
+                question = parts[0].strip()
+                solution = parts[1].strip()
+                return question, solution
+            return "Invalid response format", "Invalid response format"
+
+    def parse_item(self, response_json):
+        question = str(response_json.get('question', '')).strip()
+        solution = response_json.get('solution', '')
+
+        if isinstance(solution, list):
+            solution = solution[0].get('sql', '').strip() if solution and isinstance(solution[0], dict) else "Invalid solution format"
+        elif isinstance(solution, str):
+            solution = solution.strip()
+        else:
+            solution = "Invalid solution format"
+
+        return question, solution
+
+    def parse_batch_response(self, response):
+        # Items are decoded one at a time, so a response cut off by max_tokens
+        # still yields every item that was completed before the cut
+        if not response:
+            return []
+        array_start = response.find('[')
+        object_start = response.find('{')
+        if array_start == -1 or (object_start != -1 and object_start < array_start):
+            return [self.parse_response(response)]
+
+        decoder = json.JSONDecoder()
+        items = []
+        position = array_start + 1
+        while position < len(response):
+            while position < len(response) and response[position] in " \t\r\n,":
+                position += 1
+            if position >= len(response) or response[position] == ']':
+                break
+            try:
+                item, position = decoder.raw_decode(response, position)
+            except json.JSONDecodeError:
+                break
+            if isinstance(item, dict):
+                items.append(self.parse_item(item))
+        return items
+
+@metrics.instrument(exclude=("fill_missing",))
+class GenerationAgent:
+    def __init__(self, question_agent, validation_agent, question_bank, max_concurrency=MAX_CONCURRENT_REQUESTS):
+        # Generation rounds: candidates from the question agent, checks from the
+        # validation agent, storage in the question bank
+        self.question_agent = question_agent
+        self.validation_agent = validation_agent
+        self.question_bank = question_bank
+        self.max_concurrency = max_concurrency
+        # Reject candidates that duplicate a question already in the bank
+        self.check_history = True
+        # Reject candidates whose estimated complexity is off the requested level
+        self.check_level = True
+
+    def fill_missing(self, questions, solutions, num):
+        if len(questions) < num:
+            questions.extend([PLACEHOLDER_QUESTION] * (num - len(questions)))
+            solutions.extend([PLACEHOLDER_SOLUTION] * (num - len(solutions)))
+
+    def generate_questions_with_retries(self, schema, sample_data, difficulty, statements, num, max_retries=3, sandbox=None, schema_name=None):
+        # Arrival order depends on response timing; slot order doesn't
+        generated = sorted(self.stream_questions(schema, sample_data, difficulty, statements, num, max_retries, sandbox, schema_name=schema_name))
+        questions = [question for _, question, _ in generated]
+        solutions = [solution for _, _, solution in generated]
+
+        self.fill_missing(questions, solutions, num)
+        self.question_bank.save_questions(questions, solutions, schema_name=schema_name, difficulty=difficulty, statements=statements)
+
+        return questions, solutions
+
+    def stream_questions(self, schema, sample_data, difficulty, statements, num, max_retries=3, sandbox=None, seen=None, schema_name=None, stop=None):
+        # Yields up to num validated (slot, question, solution) triples as soon as each
+        # one is ready. Slots number the requested questions, with retries after the
+        # first round, so sorting by slot gives the same order whatever finished first.
+        # Setting the stop event ends generation even while nothing new is coming in.
+        produced = 0
+        retries = 0
+        # Retries move on to new cache slots instead of replaying the failed responses
+        next_slot = 0
+        # Candidates already seen in this run, so top-up rounds don't repeat them
+        seen = SeenQuestions() if seen is None else seen
+
+        # Top-up loop: each round only asks for the slots that are still missing
+        while produced < num and retries < max_retries and not (stop and stop.is_set()):
+            requested = num - produced
+            generated = 0
+            for generated_question in self.iter_validated_questions(schema, sample_data, difficulty, statements, requested, sandbox, next_slot, seen, schema_name, stop):
+                generated += 1
+                yield generated_question
+            produced += generated
+            next_slot += requested
+            if generated < requested:
+                retries += 1
+                metrics.increment("generation_retries")
+
+    def generate_and_validate_questions(self, schema, sample_data, difficulty, statements, num, sandbox=None, first_slot=0, schema_name=None):
+        # One round of generation; only valid questions are returned, so there may be fewer than num
+        generated = sorted(self.iter_validated_questions(schema, sample_data, difficulty, statements, num, sandbox, first_slot, schema_name=schema_name))
+        return [question for _, question, _ in generated], [solution for _, _, solution in generated]
+
+    def iter_validated_questions(self, schema, sample_data, difficulty, statements, num, sandbox=None, first_slot=0, seen=None, schema_name=None, stop=None):
+        # Questions are requested BATCH_SIZE at a time as one JSON array per call. Each
+        # candidate is validated as soon as its batch arrives and yielded once it passes,
+        # in completion order, as (slot, question, solution): the slot is the candidate's
+        # position in the requested batches. Closing the generator cancels work that
+        # hasn't started.
+        # Off-level candidates and duplicates of this run's candidates or of the bank are
+        # dropped before validation. A cached batch holding questions that are in the
+        # bank already was most likely banked by an earlier run of the same request, so
+        # its slot is asked again, past the cache, instead of using up a retry round;
+        # the answer only fills the batch's positions whose candidates were dropped.
+        seen = SeenQuestions() if seen is None else seen
+        batches = [(first_slot + start, min(BATCH_SIZE, num - start)) for start in range(0, num, BATCH_SIZE)]
+        prompts = {
+            size: self.question_agent.generate_sql_prompt(schema, sample_data, difficulty, statements, num_questions=size)
+            for size in {size for _, size in batches}
+        }
+
+        def generate_batch(batch, use_cache=None):
+            slot, size = batch
+            try:
+                response = self.question_agent.get_batch(
+                    prompts[size], slot, self.question_agent.completion_tokens(difficulty, size), use_cache=use_cache
+                )
+            except Exception as e:
+                logger.warning("Question generation request failed: %s", e)
+                return batch, [], use_cache
+            return batch, self.validation_agent.parse_batch_response(response)[:size], use_cache
+
+        def validate(candidate):
+            try:
+                return self.validation_agent.validate_sql(candidate[1], statements, sandbox)
+            except Exception as e:
+                logger.warning("Validation failed: %s", e)
+                return False
+
+        pool = ThreadPoolExecutor(max_workers=self.max_concurrency, thread_name_prefix="question")
+        # Batch futures map to None, validation futures to their (slot, candidate)
+        pending = {pool.submit(generate_batch, batch): None for batch in batches}
+        # Per batch asked again: the slots none of its first candidates went to
+        free_slots = {}
+        produced = 0
+        try:
+            while pending and produced < num and not (stop and stop.is_set()):
+                # With a stop event, wake up now and then to check it
+                done, _ = wait(pending, timeout=0.5 if stop else None, return_when=FIRST_COMPLETED)
+                for future in done:
+                    candidate = pending.pop(future)
+                    if candidate is None:
+                        batch, items, use_cache = future.result()
+                        positions = {}
+                        for position, item in enumerate(items):
+                            positions.setdefault(item, batch[0] + position)
+                        if self.check_level:
+                            items = self.on_level_candidates(items, difficulty, statements)
+                        candidates, banked = self.new_candidates(items, seen, schema_name)
+                        if use_cache is False:
+                            # Asked again: only the slots left free by the first answer
+                            slots = free_slots.pop(batch[0])
+                            candidates = candidates[:len(slots)]
+                        else:
+                            slots = [positions[item] for item in candidates]
+                        for slot, item in zip(slots, candidates):
+                            pending[pool.submit(validate, item)] = (slot, item)
+                        if banked and use_cache is None and self.question_agent.use_cache:
+                            free_slots[batch[0]] = sorted(set(range(batch[0], batch[0] + batch[1])) - set(slots))
+                            pending[pool.submit(generate_batch, batch, False)] = None
+                        continue
+                    if future.result() and produced < num:
+                        produced += 1
+                        slot, (question, solution) = candidate
+                        yield slot, question, solution
+        finally:
+            pool.shutdown(wait=False, cancel_futures=True)
+
+    def on_level_candidates(self, items, difficulty, statements):
+        # A local estimate, so candidates that are clearly too easy or too hard, or use
+        # statements that weren't selected, never cost a validation call
+        candidates = [item for item in items if fits_request(item[1], difficulty, statements)[0]]
+        metrics.annotate(candidates=len(items), off_level=len(items) - len(candidates))
+        if len(candidates) < len(items):
+            logger.info("Rejected %d off-level candidate(s) before validation", len(items) - len(candidates))
+        return candidates
+
+    def new_candidates(self, items, seen, schema_name=None):
+        # The model often repeats itself within an array, across rounds and across runs.
+        # Returns the new candidates and how many were in the bank already.
+        fresh = []
+        for item in items:
+            sig = signature(*item)
+            if not seen.is_duplicate(sig):
+                seen.add(sig)
+                fresh.append((item, sig))
+        stored = [False] * len(fresh)
+        if fresh and self.check_history:
+            stored = self.question_bank.find_duplicates([sig for _, sig in fresh], schema_name)
+        candidates = [item for (item, _), duplicate in zip(fresh, stored) if not duplicate]
+        metrics.annotate(candidates=len(items), duplicates=len(items) - len(candidates))
+        if len(candidates) < len(items):
+            logger.info("Rejected %d duplicate candidate(s) before validation", len(items) - len(candidates))
+        return candidates, sum(stored)
+
+
+def build_generation_agent(Session, use_cache=True, client=None):
+    # A GenerationAgent of its own, for callers outside the Streamlit app
+    question_agent = QuestionGenerationAgent()
+    question_agent.use_cache = use_cache
+    validation_agent = ValidationAgent()
+    question_agent.client = validation_agent.client = client
+    return GenerationAgent(question_agent, validation_agent, QuestionBankAgent(Session))
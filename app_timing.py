@@ -0,0 +1,45 @@
+import logging
+import statistics
+import threading
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+
+class RerunTimings:
+    # Startup and per-rerun timings for the Streamlit script, kept for the
+    # life of the process so regressions show up in the logs and the sidebar
+
+    def __init__(self, window=200):
+        self.time_to_interactive = None
+        self.reruns = 0
+        self.overheads = deque(maxlen=window)
+        self.durations = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def record(self, started, ready, finished):
+        # started: script start, ready: setup done and the page starts rendering, finished: script end
+        overhead = ready - started
+        duration = finished - started
+        with self._lock:
+            self.reruns += 1
+            if self.time_to_interactive is None:
+                # The first run pays for imports, migrations and cached resources,
+                # so it is reported on its own rather than as a rerun
+                self.time_to_interactive = finished - started
+                logger.info("Time to interactive: %.3fs", self.time_to_interactive)
+                return
+            self.overheads.append(overhead)
+            self.durations.append(duration)
+        logger.info("Rerun %d: %.1f ms setup, %.1f ms total", self.reruns, overhead * 1000, duration * 1000)
+
+    def summary(self):
+        with self._lock:
+            overheads = list(self.overheads)
+            durations = list(self.durations)
+            return {
+                "time_to_interactive": self.time_to_interactive,
+                "reruns": self.reruns,
+                "median_overhead": statistics.median(overheads) if overheads else None,
+                "median_duration": statistics.median(durations) if durations else None,
+            }
@@ -0,0 +1,260 @@
+import argparse
+import itertools
+import json
+import logging
+import multiprocessing
+import os
+import re
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+from sqlalchemy import insert
+
+from models import GenerationJob
+
+logger = logging.getLogger(__name__)
+
+# Bulk generation without the Streamlit app: a job matrix of schemas, difficulties
+# and statement sets is expanded into generation jobs, which run on a pool of
+# worker processes. Each finished job is exported as Moodle XML and Markdown.
+#
+# Matrix file (JSON); every combination of the lists becomes a job, plus any
+# jobs listed explicitly:
+#   {
+#     "schemas": ["Movies", "Shop"],          omitted or "*": every saved schema
+#     "difficulties": ["Level 1", "Level 3"],
+#     "statements": [["SELECT", "FROM", "WHERE"], ["SELECT", "FROM", "JOIN"]],
+#     "questions": 50,
+#     "jobs": [{"schema": "Shop", "difficulty": "Level 5", "statements": [...], "questions": 20}]
+#   }
+#
+# Progress is checkpointed in the output directory. Questions are saved in
+# batches under a generation_jobs row per job, so running the same command again
+# skips exported jobs and lets the others make up only what they are missing.
+
+# Worker processes
+BATCH_PROCESSES = int(os.environ.get("BATCH_PROCESSES", str(min(4, os.cpu_count() or 1))))
+# Questions saved per INSERT, which is also how much an interrupted job can lose
+BATCH_FLUSH_SIZE = 50
+BATCH_FLUSH_INTERVAL = 10.0
+CHECKPOINT_FILE = "checkpoint.json"
+# Status of generation_jobs rows owned by a batch run; the app's job workers
+# only pick up queued jobs, so they leave these alone
+BATCH_STATUS = "batch"
+
+_worker = None
+
+
+def expand_matrix(matrix, saved_schemas):
+    # [(schema, difficulty, statements, questions)] without repeats, in matrix order
+    schemas = matrix.get("schemas", "*")
+    if schemas == "*":
+        schemas = saved_schemas
+    missing = [name for name in schemas if name not in saved_schemas]
+    jobs = [
+        (schema, difficulty, list(statements), int(matrix.get("questions", 10)))
+        for schema, difficulty, statements in itertools.product(schemas, matrix.get("difficulties", []), matrix.get("statements", []))
+    ]
+    for job in matrix.get("jobs", []):
+        if job["schema"] not in saved_schemas:
+            missing.append(job["schema"])
+        jobs.append((job["schema"], job["difficulty"], list(job["statements"]), int(job.get("questions", matrix.get("questions", 10)))))
+    if missing:
+        raise ValueError(f"Schemas not saved: {', '.join(sorted(set(missing)))}")
+    unique = {}
+    for job in jobs:
+        unique.setdefault(job_key(*job[:3]), job)
+    return unique
+
+
+def job_key(schema, difficulty, statements):
+    return f"{schema} | {difficulty} | {' '.join(statements)}"
+
+
+def file_stem(key):
+    return re.sub(r"[^A-Za-z0-9]+", "-", key).strip("-").lower()
+
+
+class Checkpoint:
+    # Per job key: its generation_jobs id, questions saved so far, and whether it
+    # was exported. Only the parent process writes it, replacing the file whole.
+
+    def __init__(self, path):
+        self.path = path
+        self.jobs = {}
+        if os.path.exists(path):
+            with open(path) as f:
+                self.jobs = json.load(f)["jobs"]
+
+    def save(self):
+        temporary = f"{self.path}.tmp"
+        with open(temporary, "w") as f:
+            json.dump({"updated_at": time.time(), "jobs": self.jobs}, f, indent=2)
+        os.replace(temporary, self.path)
+
+
+def create_jobs(Session, owner, jobs):
+    # One multi-row INSERT for all new jobs; returns their ids in order
+    from storage import session_scope
+
+    now = time.time()
+    rows = [
+        {"status": BATCH_STATUS, "owner": owner, "schema_name": schema, "difficulty": difficulty,
+         "statements": json.dumps(statements), "num_questions": questions, "fresh": False, "completed": 0,
+         "attempts": 0, "cancel_requested": False, "created_at": now}
+        for schema, difficulty, statements, questions in jobs
+    ]
+    if not rows:
+        return []
+    with session_scope(Session) as session:
+        return session.execute(insert(GenerationJob).returning(GenerationJob.id, sort_by_parameter_order=True), rows).scalars().all()
+
+
+def _init_worker(stub, processes, flush_size):
+    # Each process gets its own database engine, and a share of the API budgets
+    global _worker
+    from sqlalchemy.orm import sessionmaker
+
+    import model_client
+    from jobs import JobQueue
+    from rate_limiter import REQUESTS_PER_MINUTE, TOKENS_PER_MINUTE, RequestScheduler
+    from response_cache import ResponseCache
+    from storage import create_storage_engine
+
+    requests_per_minute, tokens_per_minute = REQUESTS_PER_MINUTE // processes, TOKENS_PER_MINUTE // processes
+    if stub:
+        import model_stub
+        model_stub.install()
+        # The stub has no budgets to keep to
+        requests_per_minute = tokens_per_minute = 0
+    engine = create_storage_engine()
+    model_client.set_response_cache(ResponseCache(engine))
+    model_client.set_scheduler(RequestScheduler(model_client.MAX_CONCURRENT_REQUESTS, requests_per_minute, tokens_per_minute))
+    _worker = JobQueue(sessionmaker(bind=engine), workers=0, name=f"batch:{os.getpid()}",
+                       flush_size=flush_size, flush_interval=BATCH_FLUSH_INTERVAL)
+
+
+def run_job(job_id, key, out_dir):
+    # Runs in a worker process: generates what the job is missing, then exports it
+    from agents import QuestionBankAgent
+    from practice_db import get_database_image
+    from xml_export import compute_expected_outputs, export_to_markdown, export_to_xml
+
+    started = time.monotonic()
+    queue = _worker
+    job = queue.get_job(job_id)
+    queue.update_job(job_id, worker=queue.name, started_at=time.time(), attempts=job["attempts"] + 1)
+    completed = queue.generate(job, threading.Event())
+    error = None if completed >= job["num_questions"] else f"Generated {completed} of {job['num_questions']} questions"
+    queue.update_job(job_id, status="done", error=error, finished_at=time.time())
+
+    rows = QuestionBankAgent(queue.Session).job_questions(job_id)
+    questions = [row.text for row in rows]
+    solutions = [row.solution for row in rows]
+    schema, sample_data = queue.get_schema(job)
+    # This process is a pool worker already, so the solutions run right here
+    expected = list(compute_expected_outputs(get_database_image(schema, sample_data), solutions, max_workers=0))
+    stem = os.path.join(out_dir, file_stem(key))
+    with open(f"{stem}.xml", "w", encoding="utf-8") as f:
+        export_to_xml(f, questions, solutions, expected_outputs=expected)
+    with open(f"{stem}.md", "w") as f:
+        f.write(export_to_markdown(questions, solutions, expected, title=key))
+    return {"completed": completed, "error": error, "files": [f"{stem}.xml", f"{stem}.md"], "seconds": time.monotonic() - started}
+
+
+def run_batch(Session, matrix, out_dir, processes=BATCH_PROCESSES, stub=False, flush_size=BATCH_FLUSH_SIZE, owner="batch"):
+    from agents import SchemaAgent
+
+    os.makedirs(out_dir, exist_ok=True)
+    checkpoint = Checkpoint(os.path.join(out_dir, CHECKPOINT_FILE))
+    jobs = expand_matrix(matrix, [row.name for row in SchemaAgent(Session).get_saved_schemas()])
+
+    # Jobs without a row yet get one, and the checkpoint is saved before any work
+    # starts, so an interrupted run resumes the same rows
+    new = [key for key in jobs if key not in checkpoint.jobs]
+    for key, job_id in zip(new, create_jobs(Session, owner, [jobs[key] for key in new])):
+        checkpoint.jobs[key] = {"job_id": job_id, "completed": 0, "exported": False, "error": None}
+    checkpoint.save()
+
+    pending = [key for key in jobs if not checkpoint.jobs[key]["exported"]]
+    logger.info("%d job(s) in the matrix, %d exported earlier, %d to run", len(jobs), len(jobs) - len(pending), len(pending))
+    if not pending:
+        return checkpoint.jobs
+
+    pool = ProcessPoolExecutor(max_workers=min(processes, len(pending)), initializer=_init_worker,
+                               initargs=(stub, processes, flush_size))
+    futures = {pool.submit(run_job, checkpoint.jobs[key]["job_id"], key, out_dir): key for key in pending}
+    started = time.monotonic()
+    finished = 0
+    try:
+        while futures:
+            done, _ = wait(futures, return_when=FIRST_COMPLETED)
+            for future in done:
+                key = futures.pop(future)
+                entry = checkpoint.jobs[key]
+                try:
+                    result = future.result()
+                except Exception as e:
+                    # Left unexported, so the next run tries it again
+                    logger.error("Job %s failed: %s", key, e)
+                    entry["error"] = str(e)
+                else:
+                    entry.update(completed=result["completed"], exported=True, error=result["error"], files=result["files"])
+                    logger.info("%s: %d question(s) in %.1fs", key, result["completed"], result["seconds"])
+                finished += 1
+                checkpoint.save()
+            logger.info("%d of %d job(s) finished after %.1fs", finished, len(pending), time.monotonic() - started)
+    except KeyboardInterrupt:
+        # Running jobs keep the questions they saved and make up the rest next time
+        for process in multiprocessing.active_children():
+            process.terminate()
+        raise
+    finally:
+        pool.shutdown(wait=not futures, cancel_futures=True)
+    return checkpoint.jobs
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generate questions for a matrix of schemas, difficulties and statements.")
+    parser.add_argument("matrix", help="JSON job matrix")
+    parser.add_argument("--out", default="batch_output", help="directory for the exports and the checkpoint")
+    parser.add_argument("--processes", type=int, default=BATCH_PROCESSES)
+    parser.add_argument("--flush-size", type=int, default=BATCH_FLUSH_SIZE, help="questions saved per INSERT")
+    parser.add_argument("--owner", default="batch", help="owner recorded on the jobs; model requests are scheduled under it")
+    parser.add_argument("--stub", action="store_true", help="answer model requests locally instead of calling the API")
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(processName)s %(message)s")
+
+    from sqlalchemy.orm import sessionmaker
+
+    from agents import QuestionBankAgent
+    from models import migrate_database
+    from response_cache import ResponseCache
+    from storage import create_storage_engine
+
+    with open(args.matrix) as f:
+        matrix = json.load(f)
+    engine = create_storage_engine()
+    migrate_database(engine)
+    # Creates the cache table once, before workers race to create it
+    ResponseCache(engine)
+    Session = sessionmaker(bind=engine)
+    QuestionBankAgent(Session).index_signatures()
+    # Workers open their own connections
+    engine.dispose()
+
+    try:
+        jobs = run_batch(Session, matrix, args.out, args.processes, args.stub, args.flush_size, args.owner)
+    except KeyboardInterrupt:
+        print(f"Interrupted; run the same command again to resume from {os.path.join(args.out, CHECKPOINT_FILE)}")
+        return
+    exported = [entry for entry in jobs.values() if entry["exported"]]
+    print(f"{len(exported)} of {len(jobs)} job(s) exported to {args.out}, {sum(entry['completed'] for entry in exported)} question(s)")
+    for key, entry in jobs.items():
+        if entry["error"]:
+            print(f"  {key}: {entry['error']}")
+
+
+if __name__ == "__main__":
+    main()
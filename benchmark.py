@@ -0,0 +1,277 @@
+import argparse
+import json
+import logging
+import os
+import platform
+import subprocess
+import tempfile
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+from sqlalchemy import event
+from sqlalchemy.orm import sessionmaker
+
+import model_client
+import model_stub
+from agents import SchemaAgent, QuestionBankAgent, build_generation_agent
+from models import migrate_database
+from practice_db import get_database_image
+from schema_catalog import parsed_schemas
+from sql_validation import SQLSandbox
+from storage import create_storage_engine
+from xml_export import compute_expected_outputs, iter_quiz_xml
+
+# Offline benchmark of the generation pipeline. Model requests go to
+# model_stub, so it runs without network access or API costs:
+#
+#   python benchmark.py --latency 0.2 --error-rate 0.05 --output before.json
+#   python benchmark.py --latency 0.2 --error-rate 0.05 --compare before.json
+#
+# The app's UI methods are thin wrappers, so the benchmark drives what they call:
+# GenerationAgent.generate_questions_with_retries, the practice database image
+# behind generate_database_file, the XML export pipeline behind export_to_xml,
+# and the agent queries behind the Questions History and Saved Schemas pages.
+
+BENCH_SCHEMA = """CREATE TABLE customers (
+    id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL,
+    city TEXT,
+    signup_year INTEGER
+);
+CREATE TABLE orders (
+    id INTEGER PRIMARY KEY,
+    customer_id INTEGER NOT NULL,
+    amount REAL,
+    status TEXT,
+    FOREIGN KEY (customer_id) REFERENCES customers(id)
+);"""
+
+CITIES = ["Berlin", "Lagos", "Lima", "Osaka", "Perth", "Quebec", "Tunis", "Utrecht"]
+STATUSES = ["new", "paid", "shipped", "returned"]
+
+DEFAULT_SIZES = [1, 10, 50, 100]
+# Customers in each sample data size; every customer has three orders
+DATA_SIZES = {"small": 20, "large": 5000}
+HISTORY_ROWS = 5000
+# Repetitions of each page query, reported as a mean
+PAGE_REPEATS = 20
+
+
+def bench_sample_data(customers):
+    return {
+        "customers": [
+            {"id": i, "name": f"Customer {i}", "city": CITIES[i % len(CITIES)], "signup_year": 2015 + i % 9}
+            for i in range(1, customers + 1)
+        ],
+        "orders": [
+            {"id": i, "customer_id": i % customers + 1, "amount": round(5 + (i * 37 % 500) / 3, 2), "status": STATUSES[i % len(STATUSES)]}
+            for i in range(1, 3 * customers + 1)
+        ],
+    }
+
+
+class WriteTimer:
+    # Time spent executing INSERT, UPDATE and DELETE statements on an engine
+
+    def __init__(self, engine):
+        self.seconds = 0.0
+        self.statements = 0
+        self._lock = threading.Lock()
+        event.listen(engine, "before_cursor_execute", self._before)
+        event.listen(engine, "after_cursor_execute", self._after)
+
+    def _before(self, conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("benchmark_started", []).append(time.perf_counter())
+
+    def _after(self, conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info["benchmark_started"].pop()
+        if statement.lstrip()[:6].upper() in ("INSERT", "UPDATE", "DELETE"):
+            with self._lock:
+                self.seconds += elapsed
+                self.statements += 1
+
+    def snapshot(self):
+        with self._lock:
+            return self.seconds, self.statements
+
+
+class Benchmark:
+    def __init__(self, engine, stub, repeats=PAGE_REPEATS):
+        self.engine = engine
+        self.Session = sessionmaker(bind=engine)
+        self.stub = stub
+        self.writes = WriteTimer(engine)
+        self.repeats = repeats
+        self.results = []
+
+    @contextmanager
+    def measure(self, scenario, **details):
+        # Peak memory is what tracemalloc sees in this process; export workers are not included
+        result = {"scenario": scenario, **details}
+        calls = self.stub.calls
+        errors = self.stub.errors
+        write_seconds, write_statements = self.writes.snapshot()
+        tracemalloc.reset_peak()
+        started = time.perf_counter()
+        yield result
+        result["wall_time"] = round(time.perf_counter() - started, 4)
+        result["calls"] = self.stub.calls - calls
+        result["errors"] = self.stub.errors - errors
+        result["peak_memory_mb"] = round(tracemalloc.get_traced_memory()[1] / 1e6, 2)
+        seconds, statements = self.writes.snapshot()
+        result["db_write_time"] = round(seconds - write_seconds, 4)
+        result["db_writes"] = statements - write_statements
+        self.results.append(result)
+        logging.info("%s", result)
+
+    def run(self, sizes, data_sizes, history_rows):
+        schema_agent = SchemaAgent(self.Session)
+        for data_name, customers in data_sizes.items():
+            sample_data = bench_sample_data(customers)
+            schema_agent.save_schema(f"bench-{data_name}", BENCH_SCHEMA, json.dumps(sample_data))
+
+            # The first call builds the image, the second one comes from the image cache
+            with self.measure("generate_database_file", sample_data=data_name, cached=False) as result:
+                db_image = get_database_image(BENCH_SCHEMA, sample_data)
+                result["image_bytes"] = len(db_image)
+            with self.measure("generate_database_file", sample_data=data_name, cached=True):
+                get_database_image(BENCH_SCHEMA, sample_data)
+
+            for size in sizes:
+                agent = build_generation_agent(self.Session, use_cache=False)
+                with self.measure("generate_questions_with_retries", questions=size, sample_data=data_name) as result:
+                    questions, solutions = agent.generate_questions_with_retries(
+                        BENCH_SCHEMA, sample_data, "Level 3", ["SELECT", "FROM", "WHERE"], size,
+                        sandbox=SQLSandbox(db_image), schema_name=f"bench-{data_name}"
+                    )
+                    generated = sum(1 for solution in solutions if solution != "Error generating solution.")
+                    result["generated"] = generated
+                result["calls_per_question"] = round(result["calls"] / max(generated, 1), 2)
+
+                with self.measure("export_to_xml", questions=size, sample_data=data_name) as result:
+                    xml = "".join(iter_quiz_xml(questions, solutions, compute_expected_outputs(db_image, solutions)))
+                    result["xml_bytes"] = len(xml)
+
+        self.run_pages(schema_agent, history_rows)
+        return self.results
+
+    def run_pages(self, schema_agent, history_rows):
+        bank = QuestionBankAgent(self.Session)
+        with self.measure("history_seed", history_rows=history_rows):
+            for start in range(0, history_rows, 500):
+                count = min(500, history_rows - start)
+                bank.save_questions(
+                    [f"Which customers from city {i} placed orders worth more than {i % 97} in total?" for i in range(start, start + count)],
+                    [f"SELECT c{i}.name FROM customers c{i} WHERE c{i}.id > {i}" for i in range(start, start + count)],
+                    schema_name="bench-history", difficulty="Level 2"
+                )
+
+        def page_query(scenario, query):
+            with self.measure(scenario, repeats=self.repeats) as result:
+                for _ in range(self.repeats):
+                    rows = query()
+                result["rows"] = len(rows)
+            result["mean_time"] = round(result["wall_time"] / self.repeats, 5)
+
+        first_page = bank.search(limit=20)
+        page_query("history_first_page", lambda: bank.search(limit=20))
+        page_query("history_next_page", lambda: bank.search(before_id=first_page[-1].id, limit=20))
+        page_query("history_search", lambda: bank.search("customers city", limit=20))
+        page_query("history_filtered", lambda: bank.search(schema_name="bench-history", difficulty="Level 2", limit=20))
+        page_query("history_filter_options", lambda: bank.filter_options()[0])
+        page_query("schemas_list", schema_agent.get_saved_schemas)
+
+        def load_schemas():
+            # Cold loads: the parsed schema cache is emptied first
+            parsed_schemas.invalidate()
+            return [schema_agent.get_schema_and_data(name) for name in schema_names]
+
+        schema_names = [row.name for row in schema_agent.get_saved_schemas()]
+        page_query("schema_load", load_schemas)
+
+
+def git_revision():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__))
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+# Fields that identify a result, as opposed to measurements
+_KEY_FIELDS = ("scenario", "questions", "sample_data", "cached", "history_rows", "repeats")
+
+
+def result_key(result):
+    return tuple((name, result[name]) for name in _KEY_FIELDS if name in result)
+
+
+def compare(results, previous_path):
+    with open(previous_path) as f:
+        previous = {result_key(result): result for result in json.load(f)["results"]}
+    print(f"{'scenario':64} {'before':>9} {'after':>9} {'change':>8}")
+    for result in results:
+        before = previous.get(result_key(result))
+        if before is None:
+            continue
+        label = " ".join([result["scenario"]] + [f"{name}={value}" for name, value in result_key(result)[1:]])
+        change = (result["wall_time"] - before["wall_time"]) / before["wall_time"] * 100 if before["wall_time"] else 0.0
+        print(f"{label:64} {before['wall_time']:9.3f} {result['wall_time']:9.3f} {change:+7.1f}%")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark question generation against a local model stub.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES, help="questions per generation run")
+    parser.add_argument("--data", nargs="+", choices=list(DATA_SIZES), default=list(DATA_SIZES), help="sample data sizes")
+    parser.add_argument("--history-rows", type=int, default=HISTORY_ROWS, help="questions stored for the history page queries")
+    parser.add_argument("--latency", type=float, default=0.2, help="seconds per model call")
+    parser.add_argument("--jitter", type=float, default=0.1, help="extra random seconds per model call")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of model calls that fail")
+    parser.add_argument("--shape", choices=model_stub.SHAPES, default="array", help="shape of the stub's responses")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", default="benchmark_results.json")
+    parser.add_argument("--compare", help="earlier results file to compare wall times with")
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.WARNING, format="%(asctime)s %(message)s")
+    logging.getLogger().setLevel(logging.WARNING)
+    logging.getLogger(__name__).setLevel(logging.INFO)
+
+    stub = model_stub.install(model_stub.StubChatCompletion(args.latency, args.jitter, args.error_rate, args.shape, args.seed))
+    # Every call should reach the stub, so cached responses don't hide the pipeline's cost
+    model_client.set_response_cache(None)
+
+    tracemalloc.start()
+    with tempfile.TemporaryDirectory() as directory:
+        engine = create_storage_engine(f"sqlite:///{os.path.join(directory, 'benchmark.db')}")
+        migrate_database(engine)
+        started = time.perf_counter()
+        results = Benchmark(engine, stub).run(args.sizes, {name: DATA_SIZES[name] for name in args.data}, args.history_rows)
+        total = time.perf_counter() - started
+        engine.dispose()
+    tracemalloc.stop()
+
+    report = {
+        "revision": git_revision(),
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "config": {
+            "latency": args.latency, "jitter": args.jitter, "error_rate": args.error_rate, "shape": args.shape,
+            "seed": args.seed, "max_concurrent_requests": model_client.MAX_CONCURRENT_REQUESTS,
+        },
+        "total_time": round(total, 3),
+        "results": results,
+    }
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"{len(results)} results in {total:.1f}s written to {args.output}")
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,226 @@
+import hashlib
+import re
+import struct
+from collections import defaultdict, namedtuple
+
+import numpy as np
+from sqlalchemy import delete, select
+
+from models import QuestionBand, QuestionSignature
+from sql_validation import SQLValidationError, clean_sql, tokenize_sql
+
+# Near-duplicate detection for generated questions. A question is a duplicate of
+# another when its solution has the same fingerprint (the SQL with literals,
+# aliases and table qualifiers normalized away), or when the MinHash estimate of
+# the Jaccard similarity of their question texts reaches TEXT_SIMILARITY.
+
+# Word pairs as shingles. The threshold is high because changing one word, e.g.
+# "before" to "after", can make a different question; same-SQL rewordings are
+# caught by the fingerprint instead.
+TEXT_SIMILARITY = 0.85
+SHINGLE_SIZE = 2
+# 16 bands of 4 rows: pairs at 0.85 similarity share a band almost always and
+# pairs at 0.3 only ~12% of the time, so few candidates need a closer look
+NUM_PERMUTATIONS = 64
+BANDS = 16
+ROWS_PER_BAND = NUM_PERMUTATIONS // BANDS
+
+# Permutations are (a * x + b) mod p over 32-bit shingle hashes; with p < 2**31
+# every product fits in uint64, so all of them are computed in one NumPy step
+_PRIME = np.uint64((1 << 31) - 1)
+_random = np.random.default_rng(20240601)
+_A = _random.integers(1, (1 << 31) - 1, NUM_PERMUTATIONS, dtype=np.uint64)[:, None]
+_B = _random.integers(0, (1 << 31) - 1, NUM_PERMUTATIONS, dtype=np.uint64)[:, None]
+_MINHASH_FORMAT = f"<{NUM_PERMUTATIONS}I"
+
+_WORD_RE = re.compile(r"[a-z0-9]+")
+
+# Words after a table name that start the next clause rather than name an alias
+_CLAUSE_WORDS = {
+    "WHERE", "JOIN", "INNER", "LEFT", "RIGHT", "FULL", "CROSS", "OUTER", "NATURAL", "ON", "USING",
+    "GROUP", "ORDER", "HAVING", "LIMIT", "OFFSET", "UNION", "INTERSECT", "EXCEPT", "WINDOW", "AS",
+}
+_OPERATOR_ALIASES = {"!=": "<>", "==": "="}
+
+Signature = namedtuple("Signature", ["fingerprint", "minhash"])
+
+
+def _hash32(text):
+    return int.from_bytes(hashlib.blake2b(text.encode("utf-8"), digest_size=4).digest(), "little")
+
+
+def _identifier(token):
+    if token.kind == "quoted":
+        return token.value[1:-1].lower()
+    return token.value.lower()
+
+
+def normalize_sql(solution):
+    # Token string that ignores case, whitespace, literal values, table qualifiers
+    # and alias names, e.g. "SELECT m.title FROM movies m WHERE m.year > 2000" and
+    # "select title from movies as x where year > 1990" normalize the same
+    try:
+        tokens = tokenize_sql(clean_sql(solution))
+    except SQLValidationError:
+        return " ".join(clean_sql(solution).lower().split())
+
+    aliases = {}
+    for i, token in enumerate(tokens):
+        previous = tokens[i - 1] if i > 0 else None
+        before_previous = tokens[i - 2] if i > 1 else None
+        if token.kind not in ("word", "quoted") or previous is None:
+            continue
+        explicit = previous.value == "AS" and (i + 1 == len(tokens) or tokens[i + 1].value != "(")
+        implicit = (
+            token.kind == "word" and token.value not in _CLAUSE_WORDS
+            and previous.kind in ("word", "quoted") and before_previous is not None
+            and before_previous.value in ("FROM", "JOIN")
+        )
+        if explicit or implicit:
+            aliases.setdefault(_identifier(token), f"a{len(aliases) + 1}")
+
+    parts = []
+    for i, token in enumerate(tokens):
+        following = tokens[i + 1] if i + 1 < len(tokens) else None
+        if token.value in (";", "AS"):
+            continue
+        if token.kind in ("string", "number", "param"):
+            # IN (1, 2, 3) and IN (4) normalize the same
+            if len(parts) >= 2 and parts[-1] == "," and parts[-2] == "?":
+                parts.pop()
+                continue
+            parts.append("?")
+        elif token.kind in ("word", "quoted"):
+            if following is not None and following.value == ".":
+                # Table or alias qualifier
+                continue
+            name = _identifier(token)
+            parts.append(aliases.get(name, name))
+        elif token.value == ".":
+            continue
+        else:
+            parts.append(_OPERATOR_ALIASES.get(token.value, token.value))
+    return " ".join(parts)
+
+
+def sql_fingerprint(solution):
+    return hashlib.blake2b(normalize_sql(solution).encode("utf-8"), digest_size=8).hexdigest()
+
+
+def shingles(text):
+    words = _WORD_RE.findall((text or "").lower())
+    if len(words) <= SHINGLE_SIZE:
+        return {" ".join(words)}
+    return {" ".join(words[i:i + SHINGLE_SIZE]) for i in range(len(words) - SHINGLE_SIZE + 1)}
+
+
+def minhash(text):
+    hashes = np.fromiter((_hash32(shingle) for shingle in shingles(text)), dtype=np.uint64)
+    return tuple(((_A * hashes + _B) % _PRIME).min(axis=1).tolist())
+
+
+def signature(question, solution):
+    return Signature(sql_fingerprint(solution), minhash(question))
+
+
+def similarity(first, second):
+    # Estimated Jaccard similarity of two question texts
+    return sum(1 for a, b in zip(first, second) if a == b) / NUM_PERMUTATIONS
+
+
+def band_buckets(values):
+    # One signed 64-bit bucket per band; similar texts share at least one
+    buckets = []
+    for band in range(BANDS):
+        rows = values[band * ROWS_PER_BAND:(band + 1) * ROWS_PER_BAND]
+        digest = hashlib.blake2b(struct.pack(f"<B{ROWS_PER_BAND}I", band, *rows), digest_size=8).digest()
+        buckets.append(int.from_bytes(digest, "little", signed=True))
+    return buckets
+
+
+def pack_minhash(values):
+    return struct.pack(_MINHASH_FORMAT, *values)
+
+
+def unpack_minhash(data):
+    return struct.unpack(_MINHASH_FORMAT, data)
+
+
+class SeenQuestions:
+    # In-memory duplicate check for the candidates of one generation run
+
+    def __init__(self, threshold=TEXT_SIMILARITY):
+        self.threshold = threshold
+        self.fingerprints = set()
+        self.buckets = defaultdict(list)
+
+    def is_duplicate(self, sig):
+        if sig.fingerprint in self.fingerprints:
+            return True
+        for bucket in band_buckets(sig.minhash):
+            for other in self.buckets.get(bucket, ()):
+                if similarity(sig.minhash, other) >= self.threshold:
+                    return True
+        return False
+
+    def add(self, sig):
+        self.fingerprints.add(sig.fingerprint)
+        for bucket in band_buckets(sig.minhash):
+            self.buckets[bucket].append(sig.minhash)
+
+
+def store_signatures(session, question_ids, signatures, schema_name=None):
+    if not question_ids:
+        return
+    # Core inserts: the ORM bulk path costs more than the database does here
+    session.execute(QuestionSignature.__table__.insert(), [
+        {"question_id": question_id, "schema_name": schema_name, "fingerprint": sig.fingerprint, "minhash": pack_minhash(sig.minhash)}
+        for question_id, sig in zip(question_ids, signatures)
+    ])
+    session.execute(QuestionBand.__table__.insert(), [
+        {"bucket": bucket, "question_id": question_id}
+        for question_id, sig in zip(question_ids, signatures)
+        for bucket in band_buckets(sig.minhash)
+    ])
+
+
+def delete_signatures(session, question_ids):
+    if question_ids:
+        session.execute(delete(QuestionBand).where(QuestionBand.question_id.in_(question_ids)))
+        session.execute(delete(QuestionSignature).where(QuestionSignature.question_id.in_(question_ids)))
+
+
+def find_stored_duplicates(session, signatures, schema_name=None, threshold=TEXT_SIMILARITY):
+    # One flag per signature: True when a stored question of the same schema is a
+    # duplicate. Two indexed lookups for the whole batch, however large the bank is.
+    if not signatures:
+        return []
+    scope = [QuestionSignature.schema_name == schema_name] if schema_name is not None else []
+
+    fingerprints = set(session.execute(
+        select(QuestionSignature.fingerprint)
+        .where(QuestionSignature.fingerprint.in_({sig.fingerprint for sig in signatures}), *scope)
+    ).scalars())
+
+    buckets = {sig: band_buckets(sig.minhash) for sig in signatures if sig.fingerprint not in fingerprints}
+    similar = defaultdict(list)
+    all_buckets = {bucket for sig_buckets in buckets.values() for bucket in sig_buckets}
+    if all_buckets:
+        rows = session.execute(
+            select(QuestionBand.bucket, QuestionSignature.minhash)
+            .join(QuestionSignature, QuestionSignature.question_id == QuestionBand.question_id)
+            .where(QuestionBand.bucket.in_(all_buckets), *scope)
+        )
+        for bucket, data in rows:
+            similar[bucket].append(unpack_minhash(data))
+
+    duplicates = []
+    for sig in signatures:
+        if sig.fingerprint in fingerprints:
+            duplicates.append(True)
+            continue
+        duplicates.append(any(
+            similarity(sig.minhash, other) >= threshold
+            for bucket in buckets[sig] for other in similar.get(bucket, ())
+        ))
+    return duplicates
@@ -0,0 +1,156 @@
+import argparse
+import contextvars
+import logging
+import os
+import statistics
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import openai
+
+# Hedged model requests: when a request is still running after the usual
+# latency (a high quantile of recent ones), a duplicate is sent and whichever
+# answers first is used. The slow tail of the API then costs a little extra
+# traffic instead of holding up a whole generation run.
+
+# MODEL_HEDGE_REQUESTS=1 turns hedging on
+HEDGE_REQUESTS = os.environ.get("MODEL_HEDGE_REQUESTS") == "1"
+# Quantile of recent latencies after which a duplicate is sent
+HEDGE_QUANTILE = 0.9
+# Latencies remembered, and how many are needed before hedging starts
+LATENCY_WINDOW = 200
+MIN_SAMPLES = 20
+# Never hedge sooner than this, so fast bursts don't double the traffic
+MIN_HEDGE_DELAY = 1.0
+# Duplicates in flight at once across the process
+MAX_EXTRA_IN_FLIGHT = int(os.environ.get("MODEL_HEDGE_MAX_EXTRA", "2"))
+
+
+class Hedger:
+    def __init__(self, quantile=HEDGE_QUANTILE, max_extra=MAX_EXTRA_IN_FLIGHT, min_samples=MIN_SAMPLES,
+                 min_delay=MIN_HEDGE_DELAY, window=LATENCY_WINDOW, max_workers=32):
+        self.quantile = quantile
+        self.max_extra = max_extra
+        self.min_samples = min_samples
+        self.min_delay = min_delay
+        self._latencies = deque(maxlen=window)
+        self._extra = 0
+        self._lock = threading.Lock()
+        # Attempts run here so the caller can stop waiting for them; a losing
+        # attempt finishes in the background and its answer is dropped
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="hedge")
+        self.stats = {"requests": 0, "hedged": 0, "hedge_wins": 0, "capped": 0, "deadline_exceeded": 0}
+
+    def threshold(self):
+        with self._lock:
+            if not self._latencies or len(self._latencies) < self.min_samples:
+                return None
+            latencies = sorted(self._latencies)
+        return max(self.min_delay, latencies[min(len(latencies) - 1, int(self.quantile * len(latencies)))])
+
+    def _submit(self, attempt):
+        # Each attempt runs in a copy of the caller's context, so its tokens and
+        # retries are reported to the caller's metrics span
+        return self._pool.submit(contextvars.copy_context().run, attempt)
+
+    def _extra_attempt(self, attempt):
+        try:
+            return attempt()
+        finally:
+            with self._lock:
+                self._extra -= 1
+
+    def run(self, attempt, timeout):
+        # attempt() makes the request; raises openai.error.Timeout after timeout seconds
+        started = time.monotonic()
+        deadline = started + timeout
+        with self._lock:
+            self.stats["requests"] += 1
+        primary = self._submit(attempt)
+        pending = {primary}
+        threshold = self.threshold()
+        if threshold is not None and threshold < timeout:
+            done, _ = wait(pending, timeout=threshold)
+            if not done:
+                with self._lock:
+                    hedge = self._extra < self.max_extra
+                    if hedge:
+                        self._extra += 1
+                        self.stats["hedged"] += 1
+                    else:
+                        self.stats["capped"] += 1
+                if hedge:
+                    pending.add(self._submit(lambda: self._extra_attempt(attempt)))
+
+        error = None
+        while pending:
+            done, pending = wait(pending, timeout=max(0.0, deadline - time.monotonic()), return_when=FIRST_COMPLETED)
+            if not done:
+                with self._lock:
+                    self.stats["deadline_exceeded"] += 1
+                raise openai.error.Timeout(f"Model request took longer than {timeout:.0f}s")
+            for future in done:
+                if future.exception() is None:
+                    latency = time.monotonic() - started
+                    with self._lock:
+                        self._latencies.append(latency)
+                        if future is not primary:
+                            self.stats["hedge_wins"] += 1
+                    return future.result()
+                error = future.exception()
+        # Every attempt failed: the first error is as good as any
+        raise error
+
+    def summary(self):
+        with self._lock:
+            return {**self.stats, "samples": len(self._latencies), "extra_in_flight": self._extra}
+
+
+def main(argv=None):
+    # Sends requests to model_stub with injected latency spikes, with and without
+    # hedging, and compares the latency distributions
+    parser = argparse.ArgumentParser(description="Compare request latencies with and without hedging against a local model stub.")
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--latency", type=float, default=0.05)
+    parser.add_argument("--jitter", type=float, default=0.02)
+    parser.add_argument("--spike-rate", type=float, default=0.05, help="fraction of calls that stall")
+    parser.add_argument("--spike-latency", type=float, default=2.0, help="seconds a stalled call takes")
+    parser.add_argument("--timeout", type=float, default=5.0, help="deadline per request")
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.WARNING, format="%(asctime)s %(message)s")
+
+    import model_stub
+
+    def measure(hedger):
+        stub = model_stub.install(model_stub.StubChatCompletion(
+            args.latency, args.jitter, seed=1, spike_rate=args.spike_rate, spike_latency=args.spike_latency
+        ))
+
+        def attempt():
+            return openai.ChatCompletion.create(
+                model="gpt-4", messages=[{"role": "user", "content": "Validate SELECT 1"}], max_tokens=10,
+                request_timeout=args.timeout
+            )
+
+        def timed_request(_):
+            started = time.monotonic()
+            hedger.run(attempt, args.timeout) if hedger else attempt()
+            return time.monotonic() - started
+
+        with ThreadPoolExecutor(args.concurrency) as pool:
+            latencies = sorted(pool.map(timed_request, range(args.requests)))
+        quantiles = statistics.quantiles(latencies, n=100)
+        return {"p50": round(quantiles[49], 3), "p95": round(quantiles[94], 3), "p99": round(quantiles[98], 3),
+                "max": round(latencies[-1], 3), "calls": stub.calls}
+
+    print("no hedging", measure(None))
+    hedger = Hedger(min_samples=10, min_delay=args.latency)
+    print("hedging   ", measure(hedger))
+    print(hedger.summary())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,361 @@
+import argparse
+import json
+import logging
+import os
+import socket
+import threading
+import time
+
+from sqlalchemy import select, update
+
+from agents import SchemaAgent, build_generation_agent
+from models import GenerationJob
+from practice_db import get_database_image
+from sql_validation import SQLSandbox
+from storage import session_scope
+
+logger = logging.getLogger(__name__)
+
+# Worker threads per process; 0 makes the app only submit jobs, e.g. when
+# `python jobs.py` runs the workers in a process of their own
+JOB_WORKERS = int(os.environ.get("JOB_WORKERS", "2"))
+# Seconds an idle worker waits before looking for queued jobs again
+POLL_INTERVAL = 1.0
+# Running jobs report a heartbeat this often, and pick up cancel requests with it
+HEARTBEAT_INTERVAL = 5.0
+# A running job without a heartbeat for this long lost its worker and is queued again
+STALE_AFTER = 60.0
+# Attempts before a job that keeps failing is marked as failed
+MAX_ATTEMPTS = 3
+# Generated questions are written in small batches, at least this often
+FLUSH_SIZE = 5
+FLUSH_INTERVAL = 1.0
+
+# Seconds between job status refreshes on the Generate page
+STATUS_POLL_INTERVAL = 3.0
+
+ACTIVE_STATUSES = ("queued", "running")
+
+_SUMMARY_COLUMNS = [
+    column for column in GenerationJob.__table__.columns
+    if column.name not in ("schema_sql", "sample_data")
+]
+
+
+class JobQueue:
+    # Generation jobs stored in the generation_jobs table and run by worker threads.
+    # Jobs outlive Streamlit reruns, page switches and closed browsers, and any
+    # process running a JobQueue on the same database helps with the queued work.
+
+    def __init__(self, Session, workers=JOB_WORKERS, name=None, flush_size=FLUSH_SIZE, flush_interval=FLUSH_INTERVAL):
+        self.Session = Session
+        self.workers = workers
+        # Questions are saved and progress recorded after this many, or this often
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self.name = name or f"{socket.gethostname()}:{os.getpid()}"
+        self.schema_agent = SchemaAgent(Session)
+        self._stop = threading.Event()
+        self._threads = []
+        # Cancel events of the jobs running in this process, by job id
+        self._running = {}
+        self._lock = threading.Lock()
+
+    def submit(self, owner, schema_name, difficulty, statements, num_questions, fresh=False, schema_sql=None, sample_data=None):
+        # schema_sql and sample_data are only needed for schemas that aren't saved
+        with session_scope(self.Session) as session:
+            job = GenerationJob(
+                status="queued",
+                owner=owner,
+                schema_name=schema_name,
+                schema_sql=schema_sql,
+                sample_data=json.dumps(sample_data) if schema_sql is not None else None,
+                difficulty=difficulty,
+                statements=json.dumps(list(statements)),
+                num_questions=num_questions,
+                fresh=fresh,
+                completed=0,
+                attempts=0,
+                cancel_requested=False,
+                created_at=time.time()
+            )
+            session.add(job)
+            session.flush()
+            return job.id
+
+    def cancel(self, job_id):
+        # Queued jobs are cancelled at once; running ones stop at their next heartbeat
+        # and keep the questions they already stored
+        with session_scope(self.Session) as session:
+            session.execute(
+                update(GenerationJob)
+                .where(GenerationJob.id == job_id, GenerationJob.status == "queued")
+                .values(status="cancelled", finished_at=time.time())
+            )
+            session.execute(
+                update(GenerationJob)
+                .where(GenerationJob.id == job_id, GenerationJob.status == "running")
+                .values(cancel_requested=True)
+            )
+
+    def list_jobs(self, owner, limit=20):
+        # Newest first, without the stored schema and sample data
+        with session_scope(self.Session) as session:
+            rows = session.execute(
+                select(*_SUMMARY_COLUMNS)
+                .where(GenerationJob.owner == owner)
+                .order_by(GenerationJob.id.desc())
+                .limit(limit)
+            ).mappings().all()
+            return [dict(row) for row in rows]
+
+    def get_job(self, job_id):
+        with session_scope(self.Session) as session:
+            job = session.get(GenerationJob, job_id)
+            return _job_dict(job) if job is not None else None
+
+    def get_schema(self, job):
+        if job["schema_sql"] is not None:
+            return job["schema_sql"], json.loads(job["sample_data"] or "{}")
+        return self.schema_agent.get_schema_and_data(job["schema_name"])
+
+    def start(self):
+        if self._threads or self.workers <= 0:
+            return
+        self.requeue_stale()
+        self._threads.append(threading.Thread(target=self._heartbeat_loop, name="job-heartbeat", daemon=True))
+        for i in range(self.workers):
+            self._threads.append(threading.Thread(target=self._worker_loop, name=f"job-worker-{i}", daemon=True))
+        for thread in self._threads:
+            thread.start()
+
+    def stop(self, timeout=None):
+        self._stop.set()
+        with self._lock:
+            for cancel in self._running.values():
+                cancel.set()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+    def claim(self):
+        # Jobs of owners with nothing running go first, so one instructor's long
+        # queue doesn't hold up everyone else; otherwise the oldest queued job.
+        # The conditional UPDATE makes sure only one worker gets a job.
+        busy_owners = select(GenerationJob.owner).where(GenerationJob.status == "running")
+        queries = (
+            select(GenerationJob.id).where(GenerationJob.status == "queued", GenerationJob.owner.notin_(busy_owners)),
+            select(GenerationJob.id).where(GenerationJob.status == "queued"),
+        )
+        while True:
+            job_id = None
+            with session_scope(self.Session) as session:
+                for query in queries:
+                    job_id = session.execute(query.order_by(GenerationJob.id).limit(1)).scalar()
+                    if job_id is not None:
+                        break
+            if job_id is None:
+                return None
+            now = time.time()
+            with session_scope(self.Session) as session:
+                claimed = session.execute(
+                    update(GenerationJob)
+                    .where(GenerationJob.id == job_id, GenerationJob.status == "queued")
+                    .values(status="running", worker=self.name, started_at=now, heartbeat_at=now,
+                            attempts=GenerationJob.attempts + 1)
+                ).rowcount
+                if claimed:
+                    return _job_dict(session.get(GenerationJob, job_id))
+            # Another worker was faster; look again
+
+    def run_next(self):
+        # Claims and runs one job in the calling thread; False when nothing was queued
+        job = self.claim()
+        if job is None:
+            return False
+        self.run_job(job)
+        return True
+
+    def run_job(self, job):
+        job_id = job["id"]
+        cancel = threading.Event()
+        with self._lock:
+            self._running[job_id] = cancel
+        try:
+            completed = self.generate(job, cancel)
+        except Exception as e:
+            logger.exception("Job %d failed on attempt %d", job_id, job["attempts"])
+            if job["attempts"] < MAX_ATTEMPTS:
+                self.update_job(job_id, status="queued", worker=None, error=str(e))
+            else:
+                self.update_job(job_id, status="failed", error=str(e), finished_at=time.time())
+            return
+        finally:
+            with self._lock:
+                self._running.pop(job_id, None)
+
+        if cancel.is_set() and self._stop.is_set():
+            # The queue is shutting down: another worker finishes the job later
+            self.update_job(job_id, status="queued", worker=None)
+        elif cancel.is_set():
+            self.update_job(job_id, status="cancelled", finished_at=time.time())
+        else:
+            error = None if completed >= job["num_questions"] else f"Generated {completed} of {job['num_questions']} questions"
+            self.update_job(job_id, status="done", error=error, finished_at=time.time())
+        logger.info("Job %d finished with %d of %d questions", job_id, completed, job["num_questions"])
+
+    def generate(self, job, cancel):
+        schema, sample_data = self.get_schema(job)
+        if schema is None:
+            raise ValueError(f"Schema {job['schema_name']!r} not found")
+        # Requests are scheduled under the owner's name, sharing turns with their session
+        agent = build_generation_agent(self.Session, use_cache=not job["fresh"], client=job["owner"])
+        sandbox = SQLSandbox(get_database_image(schema, sample_data))
+
+        # A retried job keeps what earlier attempts stored and only makes up the rest;
+        # the duplicate check against the bank keeps it from repeating them
+        completed = len(agent.question_bank.job_questions(job["id"]))
+        remaining = job["num_questions"] - completed
+        if remaining <= 0:
+            return completed
+
+        # Questions of saved schemas join their pool; custom schemas have no name to pool by
+        pool_statements = json.loads(job["statements"]) if job["schema_sql"] is None else None
+        buffer = []
+        last_flush = time.monotonic()
+
+        def flush():
+            nonlocal completed, buffer, last_flush
+            if buffer:
+                # In slot order within each flush; flushes follow completion order
+                buffer.sort()
+                agent.question_bank.save_questions(
+                    [question for _, question, _ in buffer], [solution for _, _, solution in buffer],
+                    schema_name=job["schema_name"], difficulty=job["difficulty"], job_id=job["id"], statements=pool_statements
+                )
+                completed += len(buffer)
+                self.update_job(job["id"], completed=completed)
+            buffer = []
+            last_flush = time.monotonic()
+
+        stream = agent.stream_questions(schema, sample_data, job["difficulty"], json.loads(job["statements"]), remaining, sandbox=sandbox, schema_name=job["schema_name"], stop=cancel)
+        try:
+            for generated in stream:
+                buffer.append(generated)
+                if len(buffer) >= self.flush_size or time.monotonic() - last_flush >= self.flush_interval:
+                    flush()
+        finally:
+            stream.close()
+            flush()
+        return completed
+
+    def update_job(self, job_id, **values):
+        with session_scope(self.Session) as session:
+            session.execute(update(GenerationJob).where(GenerationJob.id == job_id).values(**values))
+
+    def requeue_stale(self):
+        # Jobs whose worker stopped sending heartbeats are retried, or failed after MAX_ATTEMPTS
+        stale = (GenerationJob.status == "running") & (GenerationJob.heartbeat_at < time.time() - STALE_AFTER)
+        with session_scope(self.Session) as session:
+            session.execute(
+                update(GenerationJob)
+                .where(stale, GenerationJob.attempts >= MAX_ATTEMPTS)
+                .values(status="failed", error="Worker stopped responding", finished_at=time.time())
+            )
+            requeued = session.execute(
+                update(GenerationJob).where(stale).values(status="queued", worker=None)
+            ).rowcount
+        if requeued:
+            logger.warning("Requeued %d job(s) that lost their worker", requeued)
+
+    def heartbeat(self):
+        with self._lock:
+            running = dict(self._running)
+        if running:
+            with session_scope(self.Session) as session:
+                session.execute(
+                    update(GenerationJob)
+                    .where(GenerationJob.id.in_(running))
+                    .values(heartbeat_at=time.time())
+                )
+                cancelled = session.execute(
+                    select(GenerationJob.id).where(GenerationJob.id.in_(running), GenerationJob.cancel_requested)
+                ).scalars().all()
+            for job_id in cancelled:
+                running[job_id].set()
+        self.requeue_stale()
+
+    def _worker_loop(self):
+        while not self._stop.is_set():
+            try:
+                job = self.claim()
+            except Exception:
+                logger.exception("Could not claim a job")
+                job = None
+            if job is None:
+                self._stop.wait(POLL_INTERVAL)
+                continue
+            self.run_job(job)
+
+    def _heartbeat_loop(self):
+        while not self._stop.wait(HEARTBEAT_INTERVAL):
+            try:
+                self.heartbeat()
+            except Exception:
+                logger.exception("Job heartbeat failed")
+
+
+def _job_dict(job):
+    return {column.name: getattr(job, column.name) for column in GenerationJob.__table__.columns}
+
+
+def main(argv=None):
+    # Runs job workers outside the Streamlit app, against the same database
+    parser = argparse.ArgumentParser(description="Run background question generation workers.")
+    parser.add_argument("--workers", type=int, default=max(JOB_WORKERS, 1))
+    parser.add_argument("--stub", action="store_true", help="answer model requests locally instead of calling the API")
+    parser.add_argument("--drain", action="store_true", help="exit once no jobs are queued or running")
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(threadName)s %(message)s")
+
+    from sqlalchemy.orm import sessionmaker
+
+    import metrics
+    from agents import QuestionBankAgent
+    from model_client import set_response_cache
+    from models import migrate_database
+    from response_cache import ResponseCache
+    from storage import create_storage_engine
+
+    if args.stub:
+        import model_stub
+        model_stub.install()
+    engine = create_storage_engine()
+    migrate_database(engine)
+    set_response_cache(ResponseCache(engine))
+    Session = sessionmaker(bind=engine)
+    recorder = metrics.MetricsRecorder(Session).start()
+    metrics.set_recorder(recorder)
+    QuestionBankAgent(Session).index_signatures()
+
+    queue = JobQueue(Session, workers=args.workers)
+    queue.start()
+    try:
+        while True:
+            time.sleep(POLL_INTERVAL)
+            if args.drain:
+                with session_scope(Session) as session:
+                    active = session.execute(
+                        select(GenerationJob.id).where(GenerationJob.status.in_(ACTIVE_STATUSES)).limit(1)
+                    ).first()
+                if active is None:
+                    break
+    except KeyboardInterrupt:
+        pass
+    finally:
+        queue.stop()
+        recorder.stop()
+
+
+if __name__ == "__main__":
+    main()
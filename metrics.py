@@ -0,0 +1,392 @@
+import functools
+import inspect
+import json
+import logging
+import os
+import random
+import threading
+import time
+from collections import deque
+from contextvars import ContextVar
+
+from sqlalchemy import delete, select
+
+from models import MetricSpan
+from storage import session_scope
+
+logger = logging.getLogger(__name__)
+
+# Per-operation timing and token metrics. Agent methods are wrapped in spans;
+# model_client reports token usage and cache hits to the span the call runs in.
+# Finished spans are queued in memory and written in bulk by a background
+# thread, so a span costs a few microseconds on the calling thread.
+
+# Fraction of spans recorded, e.g. 0.1 keeps one in ten at random
+SAMPLE_RATE = float(os.environ.get("METRICS_SAMPLE_RATE", "1.0"))
+# Queued spans are written this often, or as soon as FLUSH_SIZE are waiting
+FLUSH_INTERVAL = 2.0
+FLUSH_SIZE = 500
+# Spans are dropped rather than queued without bound when the database falls behind
+MAX_PENDING = 20000
+# Spans older than this are deleted, checked at most once an hour
+RETENTION = 30 * 24 * 3600
+PRUNE_INTERVAL = 3600
+
+# USD per 1000 (prompt, completion) tokens
+PRICES = {"gpt-4": (0.03, 0.06)}
+DEFAULT_PRICE = PRICES["gpt-4"]
+
+# generation_retries are extra generation rounds, api_retries model requests
+# retried after an error such as a rate limit
+_COUNTERS = ("prompt_tokens", "completion_tokens", "api_calls", "cache_hits", "generation_retries", "api_retries")
+
+# Recorder of the process; without one every span is a no-op
+recorder = None
+
+# Span that model calls and annotations on this thread are reported to
+_current = ContextVar("metrics_span", default=None)
+# Stands in for spans that weren't sampled, so what happens inside them isn't
+# counted towards an enclosing span
+_UNSAMPLED = object()
+
+
+def set_recorder(new_recorder):
+    global recorder
+    recorder = new_recorder
+
+
+def price(model, prompt_tokens, completion_tokens):
+    prompt_price, completion_price = PRICES.get(model, DEFAULT_PRICE)
+    return (prompt_tokens * prompt_price + completion_tokens * completion_price) / 1000
+
+
+class Span:
+    __slots__ = ("name", "started_at", "start", "duration", "ok", "cost", "attributes") + _COUNTERS
+
+    def __init__(self, name, attributes=None):
+        self.name = name
+        self.started_at = time.time()
+        self.start = time.perf_counter()
+        self.duration = 0.0
+        self.ok = True
+        self.cost = 0.0
+        self.attributes = attributes or {}
+        for counter in _COUNTERS:
+            setattr(self, counter, 0)
+
+    def finish(self, ok=True):
+        self.duration = time.perf_counter() - self.start
+        self.ok = ok
+
+    def row(self, sample_rate):
+        return {
+            "name": self.name,
+            "started_at": self.started_at,
+            "duration": self.duration,
+            "ok": self.ok,
+            "sample_rate": sample_rate,
+            "cost": self.cost,
+            "attributes": json.dumps(self.attributes) if self.attributes else None,
+            **{counter: getattr(self, counter) for counter in _COUNTERS},
+        }
+
+
+def _start(name, attributes=None):
+    # The new span, _UNSAMPLED, or None when nothing is being recorded
+    current = recorder
+    if current is None:
+        return None
+    if current.sample_rate < 1.0 and random.random() >= current.sample_rate:
+        return _UNSAMPLED
+    return Span(name, attributes)
+
+
+def _finish(span, ok=True):
+    if span is not _UNSAMPLED:
+        span.finish(ok)
+        current = recorder
+        if current is not None:
+            current.record(span)
+
+
+class span:
+    # with metrics.span("stage", key=value): ...
+
+    def __init__(self, name, **attributes):
+        self.name = name
+        self.attributes = attributes
+        self._span = None
+        self._token = None
+
+    def __enter__(self):
+        self._span = _start(self.name, self.attributes)
+        if self._span is not None:
+            self._token = _current.set(self._span)
+        return self._span if self._span is not _UNSAMPLED else None
+
+    def __exit__(self, exc_type, exc, tb):
+        if self._span is not None:
+            _current.reset(self._token)
+            # Streamlit's reruns and stops aren't Exceptions and don't count as failures
+            _finish(self._span, ok=exc_type is None or not issubclass(exc_type, Exception))
+        return False
+
+
+def timed(name):
+    # Decorator recording a span per call. Boolean results, such as validation
+    # verdicts, are kept as the "result" attribute; generators are timed from
+    # their first item until they are exhausted or closed, with an item count.
+    def decorate(func):
+        if inspect.isgeneratorfunction(func):
+            return _timed_generator(func, name)
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            current = _start(name)
+            if current is None:
+                return func(*args, **kwargs)
+            token = _current.set(current)
+            try:
+                result = func(*args, **kwargs)
+            except Exception:
+                _current.reset(token)
+                _finish(current, ok=False)
+                raise
+            except BaseException:
+                _current.reset(token)
+                _finish(current)
+                raise
+            _current.reset(token)
+            if isinstance(result, bool) and current is not _UNSAMPLED:
+                current.attributes["result"] = result
+            _finish(current)
+            return result
+        return wrapper
+    return decorate
+
+
+def _timed_generator(func, name):
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        generator = func(*args, **kwargs)
+        current = _start(name)
+        if current is None:
+            yield from generator
+            return
+        items = 0
+        ok = True
+        try:
+            while True:
+                # The span is current only while the generator's own code runs,
+                # not while the consumer handles an item
+                token = _current.set(current)
+                try:
+                    item = next(generator)
+                except StopIteration:
+                    break
+                finally:
+                    _current.reset(token)
+                items += 1
+                yield item
+        except Exception:
+            ok = False
+            raise
+        finally:
+            generator.close()
+            if current is not _UNSAMPLED:
+                current.attributes["items"] = items
+            _finish(current, ok)
+    return wrapper
+
+
+def instrument(cls=None, exclude=()):
+    # Class decorator wrapping every public method in a span named Class.method;
+    # @instrument or @instrument(exclude=("cheap_helper",))
+    def decorate(cls):
+        for attr, value in list(vars(cls).items()):
+            if attr.startswith("_") or attr in exclude or not inspect.isfunction(value):
+                continue
+            setattr(cls, attr, timed(f"{cls.__name__}.{attr}")(value))
+        return cls
+    return decorate(cls) if cls is not None else decorate
+
+
+def annotate(**values):
+    # Sets attributes on the current span
+    current = _current.get()
+    if current is not None and current is not _UNSAMPLED:
+        current.attributes.update(values)
+
+
+def increment(counter, amount=1):
+    # Adds to a counter column of the current span, or to an attribute
+    current = _current.get()
+    if current is None or current is _UNSAMPLED:
+        return
+    if counter in _COUNTERS:
+        setattr(current, counter, getattr(current, counter) + amount)
+    else:
+        current.attributes[counter] = current.attributes.get(counter, 0) + amount
+
+
+def add_usage(model, prompt_tokens, completion_tokens):
+    # One API call and its tokens, reported by model_client
+    current = _current.get()
+    if current is None or current is _UNSAMPLED:
+        return
+    current.api_calls += 1
+    current.prompt_tokens += prompt_tokens
+    current.completion_tokens += completion_tokens
+    current.cost += price(model, prompt_tokens, completion_tokens)
+
+
+def event(name, **attributes):
+    # A span without a duration, for things that happen rather than take time
+    current = _start(name, attributes)
+    if current is not None:
+        _finish(current)
+
+
+class MetricsRecorder:
+    def __init__(self, Session, sample_rate=SAMPLE_RATE, flush_interval=FLUSH_INTERVAL):
+        self.Session = Session
+        self.sample_rate = min(max(sample_rate, 0.0), 1.0)
+        self.flush_interval = flush_interval
+        self.dropped = 0
+        # deque appends and pops are thread-safe, so recording takes no lock
+        self._pending = deque()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        self._last_prune = 0.0
+
+    def record(self, span):
+        if len(self._pending) >= MAX_PENDING:
+            self.dropped += 1
+            return
+        self._pending.append(span.row(self.sample_rate))
+        if len(self._pending) >= FLUSH_SIZE:
+            self._wake.set()
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._writer_loop, name="metrics-writer", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self, timeout=None):
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+        self.flush()
+
+    def flush(self):
+        rows = []
+        while self._pending and len(rows) < 5000:
+            rows.append(self._pending.popleft())
+        if rows:
+            with session_scope(self.Session) as session:
+                session.execute(MetricSpan.__table__.insert(), rows)
+        now = time.time()
+        if now - self._last_prune >= PRUNE_INTERVAL:
+            self._last_prune = now
+            with session_scope(self.Session) as session:
+                session.execute(delete(MetricSpan).where(MetricSpan.started_at < now - RETENTION))
+        return len(rows)
+
+    def _writer_loop(self):
+        while not self._stop.is_set():
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            try:
+                while self.flush() >= 5000:
+                    pass
+            except Exception:
+                logger.exception("Could not write metrics")
+
+
+# Reports for the Performance page. pandas is imported on use, so job workers
+# that only record spans don't load it.
+
+def load_spans(Session, since, limit=200000):
+    import pandas as pd
+
+    columns = [column for column in MetricSpan.__table__.columns if column.name != "id"]
+    with session_scope(Session) as session:
+        rows = session.execute(
+            select(*columns)
+            .where(MetricSpan.started_at >= since)
+            .order_by(MetricSpan.started_at.desc())
+            .limit(limit)
+        ).all()
+    spans = pd.DataFrame(rows, columns=[column.name for column in columns])
+    spans["time"] = pd.to_datetime(spans["started_at"], unit="s")
+    # Each recorded span stands for 1 / sample_rate spans
+    spans["weight"] = 1.0 / spans["sample_rate"]
+    return spans
+
+
+def _attribute(spans, name, key):
+    # One attribute of the spans of an operation, as a float column (NaN where missing)
+    rows = spans[spans["name"] == name]
+    values = rows["attributes"].map(lambda data: json.loads(data).get(key) if data else None)
+    return rows.assign(value=values.astype(float))
+
+
+def latency_summary(spans):
+    grouped = spans.groupby("name")
+    summary = grouped["duration"].quantile([0.5, 0.95]).unstack()
+    summary.columns = ["p50 (s)", "p95 (s)"]
+    summary.insert(0, "calls", grouped["weight"].sum().round().astype(int))
+    summary["errors"] = (~spans["ok"]).groupby(spans["name"]).mean()
+    summary["cache hit rate"] = grouped["cache_hits"].sum() / (grouped["cache_hits"].sum() + grouped["api_calls"].sum())
+    summary["tokens / call"] = (grouped["prompt_tokens"].sum() + grouped["completion_tokens"].sum()) / grouped.size()
+    summary["cost (USD)"] = (spans["cost"] * spans["weight"]).groupby(spans["name"]).sum()
+    return summary.sort_values("p95 (s)", ascending=False)
+
+
+def generation_summary(spans):
+    # Totals over the spans: questions produced, cost per question and the share of
+    # candidates rejected by validation, by the level check and by the duplicate check
+    produced = _attribute(spans, "GenerationAgent.iter_validated_questions", "items")
+    verdicts = _attribute(spans, "ValidationAgent.validate_sql", "result")
+    candidates = _attribute(spans, "GenerationAgent.new_candidates", "candidates")
+    duplicates = _attribute(spans, "GenerationAgent.new_candidates", "duplicates")
+    generated = _attribute(spans, "GenerationAgent.on_level_candidates", "candidates")
+    off_level = _attribute(spans, "GenerationAgent.on_level_candidates", "off_level")
+    questions = (produced["value"] * produced["weight"]).sum()
+    cost = (spans["cost"] * spans["weight"]).sum()
+    offered = (candidates["value"] * candidates["weight"]).sum()
+    checked = (generated["value"] * generated["weight"]).sum()
+    return {
+        "questions": int(round(questions)),
+        "cost": cost,
+        "cost_per_question": cost / questions if questions else None,
+        "rejection_rate": 1 - verdicts["value"].mean() if len(verdicts) else None,
+        "duplicate_rate": (duplicates["value"] * duplicates["weight"]).sum() / offered if offered else None,
+        "off_level_rate": (off_level["value"] * off_level["weight"]).sum() / checked if checked else None,
+        "generation_retries": int(round((spans["generation_retries"] * spans["weight"]).sum())),
+        "api_retries": int(round((spans["api_retries"] * spans["weight"]).sum())),
+        "cache_hits": int(round((spans["cache_hits"] * spans["weight"]).sum())),
+        "api_calls": int(round((spans["api_calls"] * spans["weight"]).sum())),
+    }
+
+
+def timeline(spans, freq, stage):
+    # Per time bucket: latency percentiles of one stage, rejection rates and cost per question
+    import pandas as pd
+
+    buckets = spans.set_index("time")
+    stage_durations = buckets[buckets["name"] == stage]["duration"].resample(freq)
+    verdicts = _attribute(spans, "ValidationAgent.validate_sql", "result").set_index("time")["value"]
+    produced = _attribute(spans, "GenerationAgent.iter_validated_questions", "items").set_index("time")
+    questions = (produced["value"] * produced["weight"]).resample(freq).sum()
+    cost = (buckets["cost"] * buckets["weight"]).resample(freq).sum()
+    return pd.DataFrame({
+        "p50": stage_durations.quantile(0.5),
+        "p95": stage_durations.quantile(0.95),
+        "rejection rate": 1 - verdicts.resample(freq).mean(),
+        "cost per question": cost / questions.where(questions > 0),
+    })
@@ -0,0 +1,127 @@
+import logging
+import os
+import threading
+import time
+
+import openai
+
+import metrics
+from hedging import HEDGE_REQUESTS, Hedger
+from prompt_builder import count_tokens
+from rate_limiter import RequestScheduler
+from response_cache import make_cache_key
+
+logger = logging.getLogger(__name__)
+
+# Upper bound on ChatCompletion requests in flight across the whole process,
+# no matter how many questions or candidates are being worked on at once
+MAX_CONCURRENT_REQUESTS = int(os.environ.get("MAX_CONCURRENT_REQUESTS", "8"))
+
+# Hard limit in seconds on each chat_completion call, retries and hedges included
+REQUEST_TIMEOUT = float(os.environ.get("MODEL_REQUEST_TIMEOUT", "120"))
+
+# Every request of the process goes through one scheduler: concurrency, request and
+# token budgets, turns shared fairly between clients, retries and the circuit breaker
+scheduler = RequestScheduler(MAX_CONCURRENT_REQUESTS)
+
+# Duplicates slow requests when set; see hedging.py
+hedger = Hedger() if HEDGE_REQUESTS else None
+
+# MODEL_STUB=1 answers every request locally instead of calling the API
+if os.environ.get("MODEL_STUB") == "1":
+    import model_stub
+    model_stub.install()
+
+# Optional ResponseCache shared by every agent in the process
+response_cache = None
+
+# Running totals of the token usage reported by the API
+token_usage = {"requests": 0, "prompt_tokens": 0, "completion_tokens": 0}
+_usage_lock = threading.Lock()
+
+
+def set_max_concurrency(limit):
+    global MAX_CONCURRENT_REQUESTS
+    MAX_CONCURRENT_REQUESTS = max(1, int(limit))
+    scheduler.set_max_concurrent(MAX_CONCURRENT_REQUESTS)
+
+
+def set_scheduler(new_scheduler):
+    global scheduler
+    scheduler = new_scheduler
+
+
+def set_hedger(new_hedger):
+    global hedger
+    hedger = new_hedger
+
+
+def set_response_cache(cache):
+    global response_cache
+    response_cache = cache
+
+
+def chat_completion(model, messages, max_tokens, variant=0, use_cache=True, client=None):
+    # Errors are raised to the caller so each request can fail on its own.
+    # variant tells apart requests that share a prompt but should get
+    # different answers, e.g. the candidates for each question in a batch.
+    # use_cache=False bypasses the lookup but still stores the fresh answer.
+    # client names who is asking, e.g. a browser session or a job's owner;
+    # the scheduler takes turns between clients.
+    cache = response_cache
+    key = None
+    if cache is not None:
+        key = make_cache_key(model, messages, {"max_tokens": max_tokens, "variant": variant})
+        cached = cache.get(key) if use_cache else None
+        if cached is not None:
+            metrics.increment("cache_hits")
+            return cached
+
+    content = _create(model, messages, max_tokens, client)
+    if cache is not None:
+        cache.put(key, model, content)
+    return content
+
+
+def _create(model, messages, max_tokens, client=None):
+    # The reservation assumes the whole completion budget is used; the scheduler
+    # gives back what the response's usage shows wasn't
+    estimate = sum(count_tokens(message["content"], model) for message in messages) + max_tokens
+    deadline = time.monotonic() + REQUEST_TIMEOUT
+
+    def attempt():
+        # A hedged duplicate is an attempt of its own, with the same deadline
+        response = scheduler.call(
+            client,
+            estimate,
+            lambda: openai.ChatCompletion.create(
+                model=model,
+                messages=messages,
+                max_tokens=max_tokens,
+                request_timeout=max(1.0, deadline - time.monotonic())
+            ),
+            lambda response: (response.get('usage') or {}).get('total_tokens', estimate),
+            timeout=deadline - time.monotonic()
+        )
+        record_usage(model, response.get('usage') or {}, max_tokens)
+        return response
+
+    current_hedger = hedger
+    response = current_hedger.run(attempt, REQUEST_TIMEOUT) if current_hedger is not None else attempt()
+    return response['choices'][0]['message']['content'].strip()
+
+
+def record_usage(model, usage, max_tokens):
+    prompt_tokens = usage.get('prompt_tokens', 0)
+    completion_tokens = usage.get('completion_tokens', 0)
+    with _usage_lock:
+        token_usage["requests"] += 1
+        token_usage["prompt_tokens"] += prompt_tokens
+        token_usage["completion_tokens"] += completion_tokens
+    metrics.add_usage(model, prompt_tokens, completion_tokens)
+    logger.info("%s call: %d prompt tokens, %d/%d completion tokens", model, prompt_tokens, completion_tokens, max_tokens)
+
+
+def get_token_usage():
+    with _usage_lock:
+        return dict(token_usage)
@@ -0,0 +1,154 @@
+import itertools
+import json
+import random
+import re
+import threading
+import time
+
+import openai
+
+# Local stand-in for openai.ChatCompletion.create, so generation, the job queue
+# and scripts run without network access or an API key.
+# MODEL_STUB=1 installs it when model_client is imported.
+
+_ARRAY_RE = re.compile(r"JSON array of (\d+)")
+_TABLE_RE = re.compile(r"CREATE TABLE\s+[\"`\[]?(\w+)[\"`\]]?\s*\((.*)\)", re.IGNORECASE)
+_CONSTRAINT_WORDS = {"PRIMARY", "FOREIGN", "UNIQUE", "CHECK", "CONSTRAINT"}
+
+# Response shapes for question requests:
+#   array      what the prompt asks for
+#   object     a single JSON object even when an array was asked for
+#   fenced     the array inside a ```json fence
+#   truncated  the array cut off inside its last item, as at max_tokens
+#   text       "question Solution: sql" prose instead of JSON
+SHAPES = ("array", "object", "fenced", "truncated", "text")
+
+
+def _columns(definitions):
+    columns = []
+    depth = 0
+    part = ""
+    for char in definitions + ",":
+        depth += char == "("
+        depth -= char == ")"
+        if char == "," and depth == 0:
+            words = part.split()
+            if words and words[0].upper() not in _CONSTRAINT_WORDS:
+                columns.append(words[0].strip('"`[]'))
+            part = ""
+        else:
+            part += char
+    return columns
+
+
+def _conditions(instruction, columns):
+    # An ordinary WHERE clause (WHERE is always allowed) of the kind the prompt's
+    # instruction asks for, so solutions fit the requested level
+    first, last = columns[0], columns[-1]
+    if "advanced" in instruction:
+        return f" WHERE {first} LIKE '%a%'", f" whose {first} contains an 'a'"
+    if "multiple" in instruction or "complex" in instruction:
+        return f" WHERE {first} IS NOT NULL AND {last} <> ''", f" with a {first} and a non-empty {last}"
+    if "condition" in instruction:
+        return f" WHERE {first} IS NOT NULL", f" with a {first}"
+    return "", ""
+
+
+class StubChatCompletion:
+    # Questions select a different set of columns of a table in the prompt's
+    # schema each time, so they are distinct and pass the sandbox check
+    # whatever statements were selected
+
+    def __init__(self, latency=0.0, jitter=0.0, error_rate=0.0, shape="array", seed=None, retry_after=None,
+                 spike_rate=0.0, spike_latency=0.0):
+        if shape not in SHAPES:
+            raise ValueError(f"Unknown response shape {shape!r}; expected one of {', '.join(SHAPES)}")
+        # Each call sleeps latency plus up to jitter seconds, then fails with
+        # probability error_rate the way the API does when it is overloaded
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        # Seconds sent in the Retry-After header of the rate limit errors, if any
+        self.retry_after = retry_after
+        # With probability spike_rate a call stalls for spike_latency seconds instead
+        self.spike_rate = spike_rate
+        self.spike_latency = spike_latency
+        self.shape = shape
+        self.calls = 0
+        self.errors = 0
+        self._random = random.Random(seed)
+        self._numbers = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def __call__(self, model=None, messages=(), max_tokens=None, request_timeout=None, **kwargs):
+        with self._lock:
+            self.calls += 1
+            delay = self.latency + self._random.uniform(0, self.jitter)
+            if self._random.random() < self.spike_rate:
+                delay = self.spike_latency
+            failed = self._random.random() < self.error_rate
+            if failed:
+                self.errors += 1
+        if request_timeout is not None and delay > request_timeout:
+            # What the client library does when the server doesn't answer in time
+            time.sleep(request_timeout)
+            raise openai.error.Timeout("Stub request timed out")
+        if delay:
+            time.sleep(delay)
+        if failed:
+            headers = {"retry-after": str(self.retry_after)} if self.retry_after is not None else None
+            raise openai.error.RateLimitError("Stub rate limit", http_status=429, headers=headers)
+
+        prompt = messages[-1]["content"] if messages else ""
+        if prompt.startswith("Validate"):
+            content = "Valid"
+        else:
+            match = _ARRAY_RE.search(prompt)
+            count = int(match.group(1)) if match else 1
+            items = [self.make_question(prompt) for _ in range(count)]
+            content = self.render(items, as_array=match is not None)
+
+        prompt_tokens = sum(len(message["content"]) for message in messages) // 4
+        completion_tokens = len(content) // 4
+        return {
+            "choices": [{"message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+            "usage": {
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": completion_tokens,
+                "total_tokens": prompt_tokens + completion_tokens,
+            },
+        }
+
+    def render(self, items, as_array=True):
+        if self.shape == "object" or not as_array:
+            return json.dumps(items[0])
+        if self.shape == "text":
+            return f"{items[0]['question']}\nSolution: {items[0]['solution']}"
+        content = json.dumps(items, indent=2)
+        if self.shape == "fenced":
+            return f"```json\n{content}\n```"
+        if self.shape == "truncated":
+            return content[:content.rfind('"solution"')]
+        return content
+
+    def make_question(self, prompt):
+        with self._lock:
+            number = next(self._numbers)
+        tables = [(match.group(1), _columns(match.group(2))) for match in _TABLE_RE.finditer(prompt)]
+        tables = [(table, columns) for table, columns in tables if columns] or [("sqlite_master", ["name", "type"])]
+        table, columns = tables[number % len(tables)]
+        # The bits of the number pick the columns
+        subset = number // len(tables) % (2 ** len(columns) - 1) + 1
+        selected = [column for i, column in enumerate(columns) if subset >> i & 1]
+        where, described = _conditions(prompt.split("\n\n", 1)[0].lower(), selected)
+        return {
+            "question": f"List the {' and '.join(selected)} of every row in {table}{described}.",
+            "solution": f"SELECT {', '.join(selected)} FROM {table}{where}",
+        }
+
+
+def install(stub=None):
+    # Replaces openai.ChatCompletion.create process-wide; returns the stub
+    stub = stub or StubChatCompletion()
+    openai.ChatCompletion.create = stub
+    return stub
@@ -0,0 +1,178 @@
+from sqlalchemy import inspect, BigInteger, Boolean, Column, Float, Index, Integer, LargeBinary, String, Text, text
+from sqlalchemy.orm import declarative_base
+
+# Models live in their own module so Streamlit reruns of SQL.py don't
+# redefine them; migrate_database runs once per process from SQL.py
+
+# Database setup
+Base = declarative_base()
+
+class Schema(Base):
+    __tablename__ = 'schemas'
+    id = Column(Integer, primary_key=True)
+    name = Column(String(100), nullable=False)
+    schema_sql = Column(Text, nullable=False)
+    sample_data = Column(Text, nullable=False)
+
+class Question(Base):
+    __tablename__ = 'questions'
+    id = Column(Integer, primary_key=True)
+    text = Column(Text, nullable=False)
+    solution = Column(Text, nullable=False)
+    schema_name = Column(String(100))
+    difficulty = Column(String(20))
+    # Background job that generated the question, if any
+    job_id = Column(Integer)
+    # Local estimate of the solution's complexity, see sql_complexity
+    complexity_score = Column(Integer)
+    complexity_level = Column(String(20))
+    # Selected statements, as sql_validation.statements_key; with schema_name and
+    # difficulty the pool the question belongs to
+    statements = Column(String(200))
+    # Assessments the question was handed out to
+    served = Column(Integer, nullable=False, default=0)
+    __table_args__ = (
+        # History filters page through ids within a schema or difficulty
+        Index('ix_questions_schema_name_id', 'schema_name', 'id'),
+        Index('ix_questions_difficulty_id', 'difficulty', 'id'),
+        Index('ix_questions_job_id_id', 'job_id', 'id'),
+        # Pools are drawn least served first
+        Index('ix_questions_pool', 'schema_name', 'difficulty', 'statements', 'served', 'id'),
+    )
+
+class QuestionUsage(Base):
+    # Which assessment got which pooled question, so none gets the same one twice
+    __tablename__ = 'question_usage'
+    assessment = Column(String(200), primary_key=True)
+    question_id = Column(Integer, primary_key=True, autoincrement=False)
+    used_at = Column(Float, nullable=False)
+    __table_args__ = (
+        Index('ix_question_usage_question_id', 'question_id'),
+    )
+
+class QuestionSignature(Base):
+    # Near-duplicate signatures of stored questions, maintained by QuestionBankAgent
+    __tablename__ = 'question_signatures'
+    question_id = Column(Integer, primary_key=True)
+    schema_name = Column(String(100))
+    # Hash of the normalized solution SQL
+    fingerprint = Column(String(16), nullable=False)
+    # MinHash of the question text, packed as little-endian 32-bit values
+    minhash = Column(LargeBinary, nullable=False)
+    __table_args__ = (
+        Index('ix_question_signatures_fingerprint', 'fingerprint'),
+    )
+
+class QuestionBand(Base):
+    # LSH buckets of the MinHash signatures: questions with similar text share a bucket
+    __tablename__ = 'question_bands'
+    bucket = Column(BigInteger, primary_key=True, autoincrement=False)
+    question_id = Column(Integer, primary_key=True, autoincrement=False)
+    __table_args__ = (
+        Index('ix_question_bands_question_id', 'question_id'),
+    )
+
+class GenerationJob(Base):
+    __tablename__ = 'generation_jobs'
+    id = Column(Integer, primary_key=True)
+    # queued -> running -> done / failed / cancelled
+    status = Column(String(20), nullable=False, default='queued')
+    owner = Column(String(64), nullable=False)
+    schema_name = Column(String(100), nullable=False)
+    # Only set for custom schemas; saved schemas are loaded by name
+    schema_sql = Column(Text)
+    sample_data = Column(Text)
+    difficulty = Column(String(20), nullable=False)
+    statements = Column(Text, nullable=False)
+    num_questions = Column(Integer, nullable=False)
+    fresh = Column(Boolean, nullable=False, default=False)
+    completed = Column(Integer, nullable=False, default=0)
+    attempts = Column(Integer, nullable=False, default=0)
+    cancel_requested = Column(Boolean, nullable=False, default=False)
+    worker = Column(String(100))
+    error = Column(Text)
+    # Unix timestamps, as in the response cache
+    created_at = Column(Float, nullable=False)
+    started_at = Column(Float)
+    heartbeat_at = Column(Float)
+    finished_at = Column(Float)
+    __table_args__ = (
+        # Workers claim the oldest queued job; the UI lists an owner's newest jobs
+        Index('ix_generation_jobs_status_id', 'status', 'id'),
+        Index('ix_generation_jobs_owner_id', 'owner', 'id'),
+    )
+
+class MetricSpan(Base):
+    # Timed agent operations, written in bulk by metrics.MetricsRecorder
+    __tablename__ = 'metrics'
+    id = Column(Integer, primary_key=True)
+    # Class.method of the agent, e.g. ValidationAgent.validate_sql
+    name = Column(String(100), nullable=False)
+    started_at = Column(Float, nullable=False)
+    duration = Column(Float, nullable=False)
+    ok = Column(Boolean, nullable=False)
+    # Fraction of spans recorded when this one was; sums are scaled back up by it
+    sample_rate = Column(Float, nullable=False)
+    prompt_tokens = Column(Integer, nullable=False, default=0)
+    completion_tokens = Column(Integer, nullable=False, default=0)
+    # USD, from the token counts and metrics.PRICES
+    cost = Column(Float, nullable=False, default=0.0)
+    api_calls = Column(Integer, nullable=False, default=0)
+    cache_hits = Column(Integer, nullable=False, default=0)
+    # Extra generation rounds, and model requests retried after an error
+    generation_retries = Column(Integer, nullable=False, default=0)
+    api_retries = Column(Integer, nullable=False, default=0)
+    # JSON object of anything else the operation reported, e.g. validation results
+    attributes = Column(Text)
+    __table_args__ = (
+        Index('ix_metrics_started_at', 'started_at'),
+        Index('ix_metrics_name_started_at', 'name', 'started_at'),
+    )
+
+# Columns added to existing tables after they were first created
+COLUMN_MIGRATIONS = {
+    'questions': [("schema_name", "VARCHAR(100)"), ("difficulty", "VARCHAR(20)"), ("job_id", "INTEGER"),
+                  ("complexity_score", "INTEGER"), ("complexity_level", "VARCHAR(20)"),
+                  ("statements", "VARCHAR(200)"), ("served", "INTEGER NOT NULL DEFAULT 0")],
+}
+
+def migrate_database(engine):
+    # create_all only creates missing tables, so new columns and indexes are added here
+    Base.metadata.create_all(engine)
+    inspector = inspect(engine)
+    with engine.begin() as conn:
+        for table_name, columns in COLUMN_MIGRATIONS.items():
+            existing = {column['name'] for column in inspector.get_columns(table_name)}
+            for column_name, column_type in columns:
+                if column_name not in existing:
+                    conn.execute(text(f"ALTER TABLE {table_name} ADD COLUMN {column_name} {column_type}"))
+        for table in Base.metadata.sorted_tables:
+            for index in table.indexes:
+                index.create(conn, checkfirst=True)
+        if engine.dialect.name == 'sqlite':
+            create_question_search_index(conn)
+
+def create_question_search_index(conn):
+    # FTS5 index over question text and solution, kept in sync by triggers
+    exists = conn.execute(text("SELECT 1 FROM sqlite_master WHERE name = 'questions_fts'")).first()
+    conn.execute(text(
+        "CREATE VIRTUAL TABLE IF NOT EXISTS questions_fts USING fts5("
+        "text, solution, content='questions', content_rowid='id')"
+    ))
+    conn.execute(text(
+        "CREATE TRIGGER IF NOT EXISTS questions_fts_insert AFTER INSERT ON questions BEGIN "
+        "INSERT INTO questions_fts(rowid, text, solution) VALUES (new.id, new.text, new.solution); END"
+    ))
+    conn.execute(text(
+        "CREATE TRIGGER IF NOT EXISTS questions_fts_delete AFTER DELETE ON questions BEGIN "
+        "INSERT INTO questions_fts(questions_fts, rowid, text, solution) VALUES ('delete', old.id, old.text, old.solution); END"
+    ))
+    # Only edits of the indexed columns touch the index, not e.g. the served counter
+    conn.execute(text(
+        "CREATE TRIGGER IF NOT EXISTS questions_fts_update AFTER UPDATE OF text, solution ON questions BEGIN "
+        "INSERT INTO questions_fts(questions_fts, rowid, text, solution) VALUES ('delete', old.id, old.text, old.solution); "
+        "INSERT INTO questions_fts(rowid, text, solution) VALUES (new.id, new.text, new.solution); END"
+    ))
+    if not exists:
+        # Index the questions that were stored before the search index existed
+        conn.execute(text("INSERT INTO questions_fts(questions_fts) VALUES ('rebuild')"))
@@ -0,0 +1,84 @@
+import hashlib
+import json
+import sqlite3
+import threading
+from collections import OrderedDict
+
+# Built database images, shared by every session in the process
+MAX_CACHED_IMAGES = 16
+
+_images = OrderedDict()
+_images_lock = threading.Lock()
+
+
+def split_sql_statements(script):
+    # Semicolons inside string literals, identifiers or triggers do not end a
+    # statement; sqlite3.complete_statement knows when one really is complete
+    statements = []
+    buffer = ""
+    for piece in script.split(";"):
+        buffer += piece + ";"
+        if sqlite3.complete_statement(buffer):
+            if buffer.strip(" \t\r\n;"):
+                statements.append(buffer[:-1].strip() + ";")
+            buffer = ""
+    if buffer.strip(" \t\r\n;"):
+        statements.append(buffer.strip().rstrip(";"))
+    return statements
+
+
+def quote_identifier(name):
+    return '"' + str(name).replace('"', '""') + '"'
+
+
+def database_key(schema_sql, sample_data):
+    payload = json.dumps([schema_sql, sample_data], sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def build_database_image(schema_sql, sample_data):
+    conn = sqlite3.connect(":memory:", isolation_level=None)
+    try:
+        for statement in split_sql_statements(schema_sql):
+            conn.execute(statement)
+
+        for table_name, rows in sample_data.items():
+            # Rows can list different columns, so insert each column layout separately
+            layouts = OrderedDict()
+            for record in rows:
+                layouts.setdefault(tuple(record.keys()), []).append(tuple(record.values()))
+
+            conn.execute("BEGIN")
+            try:
+                for columns, values in layouts.items():
+                    column_list = ', '.join(quote_identifier(column) for column in columns)
+                    placeholders = ', '.join('?' for _ in columns)
+                    conn.executemany(
+                        f"INSERT OR REPLACE INTO {quote_identifier(table_name)} ({column_list}) VALUES ({placeholders})",
+                        values
+                    )
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+
+        return conn.serialize()
+    finally:
+        conn.close()
+
+
+def get_database_image(schema_sql, sample_data):
+    # Identical schema and sample data reuse the image built the first time
+    key = database_key(schema_sql, sample_data)
+    with _images_lock:
+        image = _images.get(key)
+        if image is not None:
+            _images.move_to_end(key)
+            return image
+
+    image = build_database_image(schema_sql, sample_data)
+    with _images_lock:
+        _images[key] = image
+        while len(_images) > MAX_CACHED_IMAGES:
+            _images.popitem(last=False)
+    return image
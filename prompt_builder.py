@@ -0,0 +1,119 @@
+import json
+import os
+import re
+from functools import lru_cache
+
+from practice_db import split_sql_statements
+
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+# Token budget for the whole generation prompt, schema and data included
+PROMPT_TOKEN_BUDGET = int(os.environ.get("PROMPT_TOKEN_BUDGET", "1500"))
+# Most sample rows shown per table; fewer are shown when the budget is tight
+MAX_SAMPLE_ROWS = 3
+# Columns with at most this many distinct values have them all listed
+MAX_LISTED_VALUES = 6
+
+# Completion tokens for one {"question", "solution"} object; harder levels have longer SQL
+COMPLETION_TOKENS = {"Level 1": 200, "Level 2": 250, "Level 3": 300, "Level 4": 350, "Level 5": 400}
+
+_COMMENT_RE = re.compile(r"--[^\n]*|/\*.*?\*/", re.DOTALL)
+
+
+@lru_cache(maxsize=8)
+def _encoding(model):
+    try:
+        return tiktoken.encoding_for_model(model)
+    except KeyError:
+        return tiktoken.get_encoding("cl100k_base")
+
+
+def count_tokens(text, model="gpt-4"):
+    if tiktoken is not None:
+        return len(_encoding(model).encode(text))
+    # Without tiktoken, ~4 characters per token is close enough for English and SQL
+    return max(1, len(text) // 4)
+
+
+def completion_token_budget(difficulty, num_questions=1):
+    return COMPLETION_TOKENS.get(difficulty, 300) * num_questions
+
+
+def compact_schema(schema_sql):
+    # One line per statement, without comments, IF NOT EXISTS or extra whitespace
+    statements = []
+    for statement in split_sql_statements(_COMMENT_RE.sub(" ", schema_sql or "")):
+        statement = re.sub(r"\s+", " ", statement)
+        statement = re.sub(r"\s*IF NOT EXISTS", "", statement, flags=re.IGNORECASE)
+        statement = re.sub(r"\(\s+", "(", re.sub(r"\s+\)", ")", statement))
+        statements.append(statement.strip())
+    return "\n".join(statements)
+
+
+def sample_rows(rows, limit):
+    # Evenly spaced rows, always including the first and the last
+    if limit <= 0 or not rows:
+        return []
+    if len(rows) <= limit:
+        return list(rows)
+    if limit == 1:
+        return [rows[0]]
+    step = (len(rows) - 1) / (limit - 1)
+    return [rows[round(i * step)] for i in range(limit)]
+
+
+def _format_value(value):
+    text = str(value)
+    return text if len(text) <= 30 else text[:27] + "..."
+
+
+def column_stats(rows):
+    columns = []
+    for record in rows:
+        for column in record:
+            if column not in columns:
+                columns.append(column)
+
+    stats = []
+    for column in columns:
+        values = [record.get(column) for record in rows]
+        present = [value for value in values if value is not None]
+        distinct = {json.dumps(value, sort_keys=True, default=str) for value in present}
+        parts = [f"{len(distinct)} distinct"]
+        numeric = present and all(isinstance(value, (int, float)) and not isinstance(value, bool) for value in present)
+        if numeric:
+            parts.insert(0, f"{min(present)}-{max(present)}")
+        elif present and len(distinct) <= MAX_LISTED_VALUES:
+            parts.append("values " + ", ".join(sorted(_format_value(json.loads(value)) for value in distinct)))
+        elif present:
+            parts.append("e.g. " + ", ".join(_format_value(value) for value in present[:2]))
+        if len(present) < len(values):
+            parts.append(f"{len(values) - len(present)} null")
+        stats.append(f"{column}: " + ", ".join(parts))
+    return stats
+
+
+def describe_sample_data(sample_data, rows_per_table=MAX_SAMPLE_ROWS, with_stats=True):
+    sections = []
+    for table_name, rows in (sample_data or {}).items():
+        lines = [f"Table {table_name} ({len(rows)} rows)"]
+        if with_stats and rows:
+            lines.extend(f"  {stat}" for stat in column_stats(rows))
+        for record in sample_rows(rows, rows_per_table):
+            lines.append("  " + json.dumps(record, separators=(",", ":"), default=str))
+        sections.append("\n".join(lines))
+    return "\n".join(sections)
+
+
+def fit_sample_data(sample_data, budget, model="gpt-4"):
+    # Fewer sample rows first, then no column statistics, until the description fits
+    description = ""
+    for with_stats in (True, False):
+        for rows_per_table in range(MAX_SAMPLE_ROWS, -1, -1):
+            description = describe_sample_data(sample_data, rows_per_table, with_stats)
+            if count_tokens(description, model) <= budget:
+                return description
+    return description
@@ -0,0 +1,176 @@
+import argparse
+import json
+import logging
+import os
+import time
+
+from sqlalchemy import and_, case, exists, func, insert, select, update
+from sqlalchemy.exc import IntegrityError
+
+from agents import PLACEHOLDER_SOLUTION
+from models import GenerationJob, Question, QuestionUsage
+from sql_validation import statements_key
+from storage import session_scope
+
+logger = logging.getLogger(__name__)
+
+# Questions already in the bank are reused: each (schema, difficulty, statements)
+# combination is a pool of stored, validated questions. A request takes what it
+# can from the pool at once, least handed out first and never one its assessment
+# had before, and only the shortfall is generated. Pools that run low are topped
+# up by background jobs, so popular combinations are ready before anyone asks.
+
+# A pool with fewer never-served questions than this is refilled...
+POOL_LOW_WATER = int(os.environ.get("QUESTION_POOL_LOW_WATER", "20"))
+# ...up to this many
+POOL_TARGET = int(os.environ.get("QUESTION_POOL_TARGET", "50"))
+# Owner of the refill jobs; the job queue takes turns between owners, so
+# refills don't hold up anyone's own jobs
+POOL_OWNER = "question-pool"
+# Draws retried when another session of the same assessment took the same questions
+DRAW_ATTEMPTS = 3
+
+
+class QuestionPool:
+    def __init__(self, Session, job_queue=None, low_water=POOL_LOW_WATER, target=POOL_TARGET):
+        self.Session = Session
+        # Without a job queue pools are only drawn from, never refilled
+        self.job_queue = job_queue
+        self.low_water = low_water
+        self.target = target
+
+    def pool_filter(self, schema_name, difficulty, statements):
+        return and_(
+            Question.schema_name == schema_name,
+            Question.difficulty == difficulty,
+            Question.statements == statements_key(statements),
+            # Stand-ins for failed generations aren't questions
+            Question.solution != PLACEHOLDER_SOLUTION,
+        )
+
+    def draw(self, schema_name, difficulty, statements, num, assessment):
+        # Up to num (id, text, solution) rows, recorded as used by the assessment
+        rows = []
+        for attempt in range(DRAW_ATTEMPTS):
+            try:
+                rows = self._draw(schema_name, difficulty, statements, num, assessment)
+                break
+            except IntegrityError:
+                logger.info("Pool draw for %s collided with another draw; retrying", assessment)
+        self.refill(schema_name, difficulty, statements)
+        return rows
+
+    def _draw(self, schema_name, difficulty, statements, num, assessment):
+        used = exists().where(QuestionUsage.question_id == Question.id, QuestionUsage.assessment == assessment)
+        with session_scope(self.Session) as session:
+            rows = session.execute(
+                select(Question.id, Question.text, Question.solution)
+                .where(self.pool_filter(schema_name, difficulty, statements), ~used)
+                .order_by(Question.served, Question.id)
+                .limit(num)
+            ).all()
+            self._record(session, assessment, [row.id for row in rows])
+        return rows
+
+    def record_usage(self, assessment, question_ids):
+        # For questions generated for the assessment rather than drawn
+        with session_scope(self.Session) as session:
+            self._record(session, assessment, question_ids)
+
+    def _record(self, session, assessment, question_ids):
+        if not question_ids:
+            return
+        now = time.time()
+        session.execute(insert(QuestionUsage), [
+            {"assessment": assessment, "question_id": question_id, "used_at": now} for question_id in question_ids
+        ])
+        session.execute(update(Question).where(Question.id.in_(question_ids)).values(served=Question.served + 1))
+
+    def available(self, schema_name, difficulty, statements):
+        # Questions nobody got yet
+        with session_scope(self.Session) as session:
+            return session.execute(
+                select(func.count()).select_from(Question)
+                .where(self.pool_filter(schema_name, difficulty, statements), Question.served == 0)
+            ).scalar()
+
+    def refill(self, schema_name, difficulty, statements):
+        # Queues a job topping the pool up to target once it is below the low-water
+        # mark, unless one is queued or running already; returns its id
+        if self.job_queue is None or schema_name is None:
+            return None
+        available = self.available(schema_name, difficulty, statements)
+        if available >= self.low_water or self.refilling(schema_name, difficulty, statements):
+            return None
+        job_id = self.job_queue.submit(POOL_OWNER, schema_name, difficulty, statements, self.target - available, fresh=True)
+        logger.info("Refilling pool %s / %s / %s with %d question(s) (job %d)",
+                    schema_name, difficulty, statements_key(statements), self.target - available, job_id)
+        return job_id
+
+    def refilling(self, schema_name, difficulty, statements):
+        from jobs import ACTIVE_STATUSES
+
+        key = statements_key(statements)
+        with session_scope(self.Session) as session:
+            jobs = session.execute(
+                select(GenerationJob.statements)
+                .where(GenerationJob.owner == POOL_OWNER, GenerationJob.status.in_(ACTIVE_STATUSES),
+                       GenerationJob.schema_name == schema_name, GenerationJob.difficulty == difficulty)
+            ).scalars().all()
+        return any(statements_key(json.loads(stored)) == key for stored in jobs)
+
+    def levels(self):
+        # Every pool with its size and how many of its questions were never served
+        with session_scope(self.Session) as session:
+            return session.execute(
+                select(
+                    Question.schema_name, Question.difficulty, Question.statements,
+                    func.count().label("questions"),
+                    func.sum(case((Question.served == 0, 1), else_=0)).label("available"),
+                )
+                .where(Question.statements.isnot(None), Question.solution != PLACEHOLDER_SOLUTION)
+                .group_by(Question.schema_name, Question.difficulty, Question.statements)
+                .order_by(Question.schema_name, Question.difficulty, Question.statements)
+            ).all()
+
+    def refill_all(self):
+        # Refills every known pool below the low-water mark; returns the job ids
+        job_ids = []
+        for pool in self.levels():
+            if pool.schema_name is None:
+                continue
+            job_id = self.refill(pool.schema_name, pool.difficulty, pool.statements.split(","))
+            if job_id is not None:
+                job_ids.append(job_id)
+        return job_ids
+
+
+def main(argv=None):
+    # Lists the pools; with --refill also queues jobs for the ones running low,
+    # which `python jobs.py` or the app's job workers then run
+    parser = argparse.ArgumentParser(description="Show question pools and top up the ones running low.")
+    parser.add_argument("--refill", action="store_true", help="queue refill jobs for pools below the low-water mark")
+    parser.add_argument("--low-water", type=int, default=POOL_LOW_WATER)
+    parser.add_argument("--target", type=int, default=POOL_TARGET)
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(message)s")
+
+    from sqlalchemy.orm import sessionmaker
+
+    from jobs import JobQueue
+    from models import migrate_database
+    from storage import create_storage_engine
+
+    engine = create_storage_engine()
+    migrate_database(engine)
+    Session = sessionmaker(bind=engine)
+    pool = QuestionPool(Session, JobQueue(Session, workers=0), args.low_water, args.target)
+    for level in pool.levels():
+        print(f"{level.schema_name or '-':24} {level.difficulty or '-':8} {level.statements:40} {level.available:6} of {level.questions} unused")
+    if args.refill:
+        job_ids = pool.refill_all()
+        print(f"Queued {len(job_ids)} refill job(s)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,336 @@
+import argparse
+import logging
+import os
+import random
+import threading
+import time
+from collections import deque
+
+import openai
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# Process-wide scheduling of model requests. Every call waits for a turn: at most
+# max_concurrent in flight, within the requests/min and tokens/min budgets, and
+# with sessions served round-robin so one large generation can't starve the rest.
+# Rate limit and server errors are retried with backoff; after too many failures
+# in a row the circuit opens and calls fail at once until the API recovers.
+
+# Budgets of the API key; 0 turns a limit off
+REQUESTS_PER_MINUTE = int(os.environ.get("MODEL_REQUESTS_PER_MINUTE", "500"))
+TOKENS_PER_MINUTE = int(os.environ.get("MODEL_TOKENS_PER_MINUTE", "300000"))
+# Retries of a failed request, waiting BACKOFF_BASE * 2**attempt seconds at most
+# (full jitter), or what the API's retry-after header asks for
+MAX_RETRIES = int(os.environ.get("MODEL_MAX_RETRIES", "5"))
+BACKOFF_BASE = 1.0
+BACKOFF_MAX = 30.0
+# Failed attempts in a row that open the circuit, and seconds before one trial request is let through
+BREAKER_THRESHOLD = 8
+BREAKER_COOLDOWN = 30.0
+# Longest a waiting caller sleeps before checking its turn again
+MAX_WAIT = 1.0
+
+_RETRYABLE = tuple(
+    getattr(openai.error, name) for name in
+    ("RateLimitError", "ServiceUnavailableError", "APIConnectionError", "Timeout", "TryAgain")
+    if hasattr(openai.error, name)
+)
+
+
+class CircuitOpenError(Exception):
+    pass
+
+
+def is_retryable(error):
+    if isinstance(error, _RETRYABLE):
+        return True
+    status = getattr(error, "http_status", None)
+    return isinstance(error, openai.error.APIError) and status is not None and status >= 500
+
+
+def retry_after(error):
+    # Seconds from the error's Retry-After header, if it has a usable one
+    headers = getattr(error, "headers", None) or {}
+    for name in ("retry-after", "Retry-After"):
+        value = headers.get(name)
+        if value is not None:
+            try:
+                return max(0.0, float(value))
+            except (TypeError, ValueError):
+                return None
+    return None
+
+
+class TokenBucket:
+    # Refills continuously at per_minute / 60 per second up to one minute's worth
+
+    def __init__(self, per_minute, now):
+        self.per_minute = per_minute
+        self.level = float(per_minute)
+        self.updated = now
+
+    def refill(self, now):
+        if self.per_minute > 0:
+            self.level = min(self.per_minute, self.level + (now - self.updated) * self.per_minute / 60)
+        self.updated = now
+
+    def wait_time(self, amount):
+        # Requests larger than the whole bucket only wait for a full one
+        if self.per_minute <= 0:
+            return 0.0
+        missing = min(amount, self.per_minute) - self.level
+        return max(0.0, missing * 60 / self.per_minute)
+
+    def take(self, amount):
+        if self.per_minute > 0:
+            self.level -= min(amount, self.per_minute)
+
+    def give(self, amount):
+        if self.per_minute > 0:
+            self.level = min(self.per_minute, self.level + amount)
+
+
+class RequestScheduler:
+    def __init__(self, max_concurrent, requests_per_minute=REQUESTS_PER_MINUTE, tokens_per_minute=TOKENS_PER_MINUTE,
+                 max_retries=MAX_RETRIES, breaker_threshold=BREAKER_THRESHOLD, breaker_cooldown=BREAKER_COOLDOWN,
+                 clock=time.monotonic, sleep=time.sleep):
+        self.max_concurrent = max(1, int(max_concurrent))
+        self.max_retries = max_retries
+        self.breaker_threshold = breaker_threshold
+        self.breaker_cooldown = breaker_cooldown
+        self.clock = clock
+        self.sleep = sleep
+        now = clock()
+        self.requests = TokenBucket(requests_per_minute, now)
+        self.tokens = TokenBucket(tokens_per_minute, now)
+        self._cond = threading.Condition()
+        # Waiting calls per client, and the clients in the order they get their next turn
+        self._queues = {}
+        self._turns = deque()
+        self.in_flight = 0
+        # Nobody is let through before this, after the API asked to retry later
+        self.paused_until = 0.0
+        self.failures = 0
+        self.opened_at = None
+        self._trial = False
+        self.stats = {"calls": 0, "retries": 0, "rate_limited": 0, "rejected": 0, "timed_out": 0, "breaker_opened": 0, "wait_time": 0.0}
+
+    def set_max_concurrent(self, limit):
+        with self._cond:
+            self.max_concurrent = max(1, int(limit))
+            self._cond.notify_all()
+
+    def call(self, client, tokens, request, used_tokens=None, timeout=None):
+        # Runs request() when it is the client's turn and retries transient errors.
+        # tokens is the estimate reserved from the budget; used_tokens(response)
+        # returns what was actually used, and the difference is given back.
+        # With a timeout, neither waiting for a turn nor retrying goes past it.
+        deadline = self.clock() + timeout if timeout is not None else None
+        attempt = 0
+        while True:
+            trial = self.acquire(client, tokens, deadline)
+            try:
+                response = request()
+            except Exception as e:
+                # A failed attempt still counts against the budgets
+                self.release(tokens, tokens)
+                if not is_retryable(e):
+                    # The API answered, so it is up, e.g. an invalid request
+                    self.succeeded()
+                    raise
+                delay = self.failed(e, attempt)
+                if attempt >= self.max_retries or (deadline is not None and self.clock() + delay >= deadline):
+                    raise
+                error = e
+            else:
+                self.release(tokens, used_tokens(response) if used_tokens else tokens)
+                self.succeeded()
+                return response
+            finally:
+                # succeeded() and failed() settle the trial; anything else
+                # (e.g. an interrupt) must not leave it pending for good
+                if trial:
+                    self._end_trial()
+            attempt += 1
+            with self._cond:
+                self.stats["retries"] += 1
+            metrics.increment("api_retries")
+            logger.warning("Model request failed (%s); retry %d in %.1fs", error, attempt, delay)
+            self.sleep(delay)
+
+    def acquire(self, client, tokens, deadline=None):
+        # Returns True when this call is the half-open trial request
+        started = self.clock()
+        waiter = {"tokens": tokens, "granted": False}
+        with self._cond:
+            trial = self._check_breaker(started)
+            queue = self._queues.get(client)
+            if queue is None:
+                queue = self._queues[client] = deque()
+                self._turns.append(client)
+            queue.append(waiter)
+            try:
+                while True:
+                    now = self.clock()
+                    wait = self._dispatch(now)
+                    if waiter["granted"]:
+                        break
+                    wait = min(wait, MAX_WAIT) if wait is not None else MAX_WAIT
+                    if deadline is not None:
+                        if now >= deadline:
+                            self.stats["timed_out"] += 1
+                            raise openai.error.Timeout("Timed out waiting for a model request slot")
+                        wait = min(wait, deadline - now)
+                    self._cond.wait(wait)
+            finally:
+                if not waiter["granted"]:
+                    self._remove(client, waiter)
+                    if trial:
+                        # The trial never went out; the next call gets to try
+                        self._trial = False
+            self.stats["calls"] += 1
+            self.stats["wait_time"] += self.clock() - started
+            return trial
+
+    def _dispatch(self, now):
+        # Grants turns while capacity lasts; returns how long until the next one could go
+        self.requests.refill(now)
+        self.tokens.refill(now)
+        while self._turns:
+            if self.in_flight >= self.max_concurrent:
+                return None
+            if now < self.paused_until:
+                return self.paused_until - now
+            client = self._turns[0]
+            waiter = self._queues[client][0]
+            wait = max(self.requests.wait_time(1), self.tokens.wait_time(waiter["tokens"]))
+            if wait > 0:
+                return wait
+            self.requests.take(1)
+            self.tokens.take(waiter["tokens"])
+            self.in_flight += 1
+            waiter["granted"] = True
+            # The client goes to the back of the line, or leaves it when it has nothing left
+            self._turns.popleft()
+            self._queues[client].popleft()
+            if self._queues[client]:
+                self._turns.append(client)
+            else:
+                del self._queues[client]
+            self._cond.notify_all()
+        return None
+
+    def _remove(self, client, waiter):
+        queue = self._queues.get(client)
+        if queue is None:
+            return
+        queue.remove(waiter)
+        if not queue:
+            del self._queues[client]
+            self._turns.remove(client)
+        self._cond.notify_all()
+
+    def release(self, reserved, used):
+        with self._cond:
+            self.in_flight -= 1
+            if used < reserved:
+                self.tokens.give(reserved - used)
+            self._cond.notify_all()
+
+    def _check_breaker(self, now):
+        # Open: fail at once. After the cooldown one trial request goes through;
+        # its success closes the circuit, its failure opens it again.
+        if self.opened_at is None:
+            return False
+        if now - self.opened_at >= self.breaker_cooldown and not self._trial:
+            self._trial = True
+            return True
+        self.stats["rejected"] += 1
+        raise CircuitOpenError(f"Model API unavailable after {self.failures} failed requests in a row; retrying in a moment")
+
+    def succeeded(self):
+        with self._cond:
+            if self.opened_at is not None:
+                logger.info("Model API recovered; circuit closed")
+            self.failures = 0
+            self.opened_at = None
+            self._trial = False
+
+    def _end_trial(self):
+        with self._cond:
+            self._trial = False
+
+    def failed(self, error, attempt):
+        # Records a transient failure and returns the delay before retrying
+        now = self.clock()
+        after = retry_after(error)
+        with self._cond:
+            self.failures += 1
+            if isinstance(error, openai.error.RateLimitError):
+                self.stats["rate_limited"] += 1
+            if after is not None:
+                # The limit is the API key's, so every caller waits
+                self.paused_until = max(self.paused_until, now + after)
+            if self._trial or (self.opened_at is None and self.failures >= self.breaker_threshold):
+                self.stats["breaker_opened"] += 1
+                logger.error("Circuit opened after %d failed model requests in a row", self.failures)
+                self.opened_at = now
+                self._trial = False
+        if after is not None:
+            return after + random.uniform(0, min(1.0, after / 10 + 0.1))
+        return random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt))
+
+    def state(self):
+        with self._cond:
+            return {
+                "in_flight": self.in_flight,
+                "waiting": sum(len(queue) for queue in self._queues.values()),
+                "clients": len(self._queues),
+                "circuit": "closed" if self.opened_at is None else "half-open" if self._trial else "open",
+                **self.stats,
+            }
+
+
+def main(argv=None):
+    # Exercises the scheduler against model_stub: concurrent clients, injected
+    # rate limit errors with Retry-After, and the resulting waits and retries
+    parser = argparse.ArgumentParser(description="Run concurrent clients through the rate limiter against a local model stub.")
+    parser.add_argument("--clients", type=int, default=3)
+    parser.add_argument("--requests", type=int, default=20, help="requests per client")
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--rpm", type=int, default=600)
+    parser.add_argument("--tpm", type=int, default=0)
+    parser.add_argument("--latency", type=float, default=0.05)
+    parser.add_argument("--error-rate", type=float, default=0.1)
+    parser.add_argument("--retry-after", type=float, help="Retry-After seconds sent with the stub's rate limit errors")
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(threadName)s %(message)s")
+
+    import model_stub
+
+    stub = model_stub.install(model_stub.StubChatCompletion(args.latency, error_rate=args.error_rate, retry_after=args.retry_after, seed=1))
+    scheduler = RequestScheduler(args.concurrency, args.rpm, args.tpm, breaker_threshold=args.requests * args.clients)
+    finished = {}
+    started = time.monotonic()
+
+    def run_client(name):
+        for _ in range(args.requests):
+            scheduler.call(name, 100, lambda: openai.ChatCompletion.create(
+                model="gpt-4", messages=[{"role": "user", "content": "Validate SELECT 1"}], max_tokens=10
+            ))
+        finished[name] = time.monotonic() - started
+
+    threads = [threading.Thread(target=run_client, args=(f"client-{i}",), name=f"client-{i}") for i in range(args.clients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    print(f"{stub.calls} stub calls, {stub.errors} injected errors")
+    print({name: round(seconds, 2) for name, seconds in sorted(finished.items())})
+    print(scheduler.state())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+
+from sqlalchemy import Column, Float, MetaData, String, Table, Text, delete, func, select
+
+metadata = MetaData()
+
+response_cache_table = Table(
+    'response_cache', metadata,
+    Column('key', String(64), primary_key=True),
+    Column('model', String(100), nullable=False),
+    Column('response', Text, nullable=False),
+    Column('created_at', Float, nullable=False, index=True),
+    Column('last_used_at', Float, nullable=False, index=True),
+)
+
+
+def make_cache_key(model, messages, params):
+    payload = json.dumps({"model": model, "messages": messages, "params": params}, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    # Model responses keyed by a hash of model, messages and parameters.
+    # An in-process LRU sits in front of the response_cache table.
+
+    def __init__(self, engine, ttl=7 * 24 * 3600, max_entries=10000, memory_entries=512):
+        self.engine = engine
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.memory_entries = memory_entries
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._writes = 0
+        self.hits = 0
+        self.misses = 0
+        metadata.create_all(engine)
+
+    def get(self, key):
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None and now - entry[1] <= self.ttl:
+                self._memory.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+
+        with self.engine.begin() as conn:
+            row = conn.execute(
+                select(response_cache_table.c.response, response_cache_table.c.created_at)
+                .where(response_cache_table.c.key == key)
+            ).first()
+            if row is not None and now - row.created_at > self.ttl:
+                conn.execute(delete(response_cache_table).where(response_cache_table.c.key == key))
+                row = None
+            if row is not None:
+                conn.execute(
+                    response_cache_table.update()
+                    .where(response_cache_table.c.key == key)
+                    .values(last_used_at=now)
+                )
+
+        with self._lock:
+            if row is None:
+                self._memory.pop(key, None)
+                self.misses += 1
+                return None
+            self._remember(key, row.response, row.created_at)
+            self.hits += 1
+        return row.response
+
+    def put(self, key, model, response):
+        now = time.time()
+        with self.engine.begin() as conn:
+            conn.execute(delete(response_cache_table).where(response_cache_table.c.key == key))
+            conn.execute(response_cache_table.insert().values(
+                key=key, model=model, response=response, created_at=now, last_used_at=now
+            ))
+        with self._lock:
+            self._remember(key, response, now)
+            self._writes += 1
+            prune = self._writes % 100 == 0
+        if prune:
+            self.evict()
+
+    def _remember(self, key, response, created_at):
+        self._memory[key] = (response, created_at)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_entries:
+            self._memory.popitem(last=False)
+
+    def evict(self):
+        # Drop expired entries, then the least recently used ones above max_entries
+        table = response_cache_table
+        with self.engine.begin() as conn:
+            conn.execute(delete(table).where(table.c.created_at < time.time() - self.ttl))
+            count = conn.execute(select(func.count()).select_from(table)).scalar()
+            if count > self.max_entries:
+                oldest = select(table.c.key).order_by(table.c.last_used_at).limit(count - self.max_entries)
+                conn.execute(delete(table).where(table.c.key.in_(oldest)))
+
+    def clear(self):
+        with self.engine.begin() as conn:
+            conn.execute(delete(response_cache_table))
+        with self._lock:
+            self._memory.clear()
+
+    def stats(self):
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "memory_entries": len(self._memory)}
@@ -0,0 +1,95 @@
+import json
+import threading
+from collections import OrderedDict, namedtuple
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+
+# Typed, Arrow-backed DataFrames of sample data tables for display. Tables are
+# converted the first time they are shown and kept for the life of the process,
+# so reruns only slice the page being looked at.
+
+# Sample data sets (schemas) whose tables are kept
+MAX_CACHED_SCHEMAS = 16
+PAGE_SIZES = (25, 50, 100, 250)
+
+SampleTable = namedtuple("SampleTable", ["frame", "summary"])
+
+
+def _column_array(values):
+    try:
+        return pa.array(values)
+    except (pa.ArrowInvalid, pa.ArrowTypeError, pa.ArrowNotImplementedError):
+        # Mixed types in one column, e.g. 1 and "1", are shown as text
+        return pa.array(
+            [None if value is None else json.dumps(value) if isinstance(value, (dict, list)) else str(value) for value in values],
+            pa.string()
+        )
+
+
+def table_frame(rows):
+    # Rows can list different columns; missing values become nulls
+    if not all(isinstance(row, dict) for row in rows):
+        raise ValueError("Sample data rows must be JSON objects")
+    columns = list(dict.fromkeys(column for row in rows for column in row))
+    arrays = [_column_array([row.get(column) for row in rows]) for column in columns]
+    return pa.table(arrays, names=columns)
+
+
+def column_summary(table):
+    summary = []
+    for name, column in zip(table.column_names, table.columns):
+        entry = {
+            "column": name,
+            "type": str(column.type),
+            "non-null": len(column) - column.null_count,
+            "distinct": pc.count_distinct(column).as_py(),
+            "min": None,
+            "max": None,
+        }
+        try:
+            bounds = pc.min_max(column)
+            entry["min"] = bounds["min"].as_py()
+            entry["max"] = bounds["max"].as_py()
+        except (pa.ArrowNotImplementedError, pa.ArrowInvalid, pa.ArrowTypeError):
+            pass
+        summary.append(entry)
+    # min and max mix types across columns, so they are displayed as text
+    frame = pd.DataFrame(summary)
+    for bound in ("min", "max"):
+        frame[bound] = frame[bound].map(lambda value: "" if value is None else str(value))
+    return frame
+
+
+class SampleFrameCache:
+    # Keyed by the identity of the sample data object: saved schemas come from the
+    # shared parsed-schema cache and custom ones from the session, so reruns pass the
+    # same object again, and a re-saved schema comes with a new one. Each entry holds
+    # a reference to its object, so an id is never reused while it is cached.
+
+    def __init__(self, max_schemas=MAX_CACHED_SCHEMAS):
+        self.max_schemas = max_schemas
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, sample_data, table_name):
+        key = id(sample_data)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] is not sample_data:
+                entry = (sample_data, {})
+                self._entries[key] = entry
+                while len(self._entries) > self.max_schemas:
+                    self._entries.popitem(last=False)
+            self._entries.move_to_end(key)
+            table = entry[1].get(table_name)
+        if table is None:
+            arrow_table = table_frame(sample_data[table_name])
+            table = SampleTable(arrow_table.to_pandas(types_mapper=pd.ArrowDtype), column_summary(arrow_table))
+            with self._lock:
+                entry[1][table_name] = table
+        return table
+
+
+sample_frames = SampleFrameCache()
@@ -0,0 +1,53 @@
+import base64
+import json
+import threading
+import zlib
+
+# Sample data larger than this is stored zlib-compressed when compression is on
+COMPRESS_THRESHOLD = 64 * 1024
+COMPRESSED_PREFIX = "zlib:"
+
+
+def pack_sample_data(sample_json, compress=False):
+    # sample_json is the JSON text saved in Schema.sample_data
+    if compress and len(sample_json) > COMPRESS_THRESHOLD:
+        packed = zlib.compress(sample_json.encode("utf-8"), 6)
+        return COMPRESSED_PREFIX + base64.b64encode(packed).decode("ascii")
+    return sample_json
+
+
+def unpack_sample_data(stored):
+    # Plain JSON always starts with '{' or '[', so the prefix can't be confused with it
+    if stored.startswith(COMPRESSED_PREFIX):
+        stored = zlib.decompress(base64.b64decode(stored[len(COMPRESSED_PREFIX):])).decode("utf-8")
+    return json.loads(stored)
+
+
+class ParsedSchemaCache:
+    # Parsed (schema_sql, sample_data) pairs by schema name. It lives in an imported
+    # module, so it survives Streamlit reruns and is shared by every session.
+    # Cached sample data is shared: callers must not modify it.
+
+    def __init__(self):
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def get(self, name, load):
+        with self._lock:
+            if name in self._entries:
+                return self._entries[name]
+        entry = load(name)
+        if entry is not None:
+            with self._lock:
+                self._entries[name] = entry
+        return entry
+
+    def invalidate(self, name=None):
+        with self._lock:
+            if name is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(name, None)
+
+
+parsed_schemas = ParsedSchemaCache()
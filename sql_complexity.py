@@ -0,0 +1,270 @@
+import argparse
+import time
+from collections import Counter, namedtuple
+
+from sql_validation import SQLValidationError, check_allowed_clauses, clean_sql, split_statements, tokenize_sql
+
+# Local estimate of how hard a SQL solution is, so generated questions can be held
+# to the requested level without asking the model. One pass over the tokens from
+# sql_validation gives a profile of the query, the profile a score, the score a level.
+
+Profile = namedtuple("Profile", [
+    "tables",       # table references in FROM and JOIN, derived tables included
+    "joins",        # JOINs plus comma joins
+    "predicates",   # conditions in WHERE and HAVING
+    "logical",      # AND / OR between conditions
+    "like",         # LIKE, GLOB and REGEXP
+    "in_lists",     # IN (...)
+    "between",
+    "aggregates",   # aggregate function calls
+    "group_keys",
+    "having",
+    "subqueries",
+    "nesting",      # deepest level of nested SELECTs
+    "order_keys",
+])
+
+# Points per feature, calibrated against the level descriptions in
+# QuestionGenerationAgent.generate_sql_prompt. Scores count what a query has
+# beyond the plainest query of its prompt (see BASE_QUERIES), so a bare join is
+# Level 1 whether or not joins were asked for; AND/OR and a second sort key or
+# table move it up a level or two, and LIKE, IN and BETWEEN are what Level 4-5 asks for
+WEIGHTS = {
+    "joins": 2,
+    "predicates": 1,
+    "logical": 1,
+    "like": 3,
+    "in_lists": 3,
+    "between": 3,
+    "aggregates": 1,
+    "group_keys": 1,
+    "having": 1,
+    "nesting": 3,
+    "order_keys": 3,
+}
+# Most points a single feature contributes, so e.g. a long SELECT list of SUMs
+# doesn't outweigh a join
+FEATURE_CAP = 6
+
+# The plainest query of each prompt, in the order generate_sql_prompt picks the
+# prompt from the selected statements; with HAVING selected, GROUP BY's has one
+BASE_QUERIES = [
+    ("WHERE", "SELECT a FROM t WHERE a = 1"),
+    ("JOIN", "SELECT a FROM t JOIN u ON u.id = t.id"),
+    ("HAVING", "SELECT a, COUNT(*) FROM t GROUP BY a HAVING COUNT(*) > 1"),
+    ("GROUP BY", "SELECT a, COUNT(*) FROM t GROUP BY a"),
+    ("ORDER BY", "SELECT a FROM t ORDER BY a"),
+]
+
+# Highest score of each level; anything above the last is Level 5
+LEVEL_CUTOFFS = [("Level 1", 0), ("Level 2", 1), ("Level 3", 2), ("Level 4", 4)]
+LEVELS = [level for level, _ in LEVEL_CUTOFFS] + ["Level 5"]
+# Candidates whose estimated level is further than this from the requested one,
+# below or above, are rejected
+LEVEL_TOLERANCE = 1
+
+_COMPARISONS = {"=", "==", "<>", "!=", "<", ">", "<=", ">="}
+_PATTERN_WORDS = {"LIKE", "GLOB", "REGEXP", "MATCH"}
+_AGGREGATES = {"COUNT", "SUM", "AVG", "MIN", "MAX", "TOTAL", "GROUP_CONCAT", "STRING_AGG"}
+_CLAUSE_STARTS = {
+    "SELECT": "SELECT", "FROM": "FROM", "WHERE": "WHERE", "ON": "ON", "HAVING": "HAVING",
+    "LIMIT": "LIMIT", "OFFSET": "LIMIT", "UNION": None, "INTERSECT": None, "EXCEPT": None,
+}
+
+
+def analyze_tokens(tokens):
+    counts = dict.fromkeys(Profile._fields, 0)
+    # One entry per open parenthesis: [clause, whether the clause started at this level]
+    # Parentheses inherit the clause around them, e.g. WHERE (a = 1 OR b = 2)
+    stack = [[None, True]]
+    # Per parenthesis: whether it holds a subquery
+    subquery_parens = []
+    nesting = 0
+    expect_table = False
+    after_between = False
+
+    for i, token in enumerate(tokens):
+        value = token.value
+        following = tokens[i + 1].value if i + 1 < len(tokens) else None
+        clause, own = stack[-1]
+
+        if value == "(":
+            is_subquery = following in ("SELECT", "WITH")
+            subquery_parens.append(is_subquery)
+            if is_subquery:
+                counts["subqueries"] += 1
+                nesting = max(nesting, sum(subquery_parens))
+            if expect_table:
+                # Derived table
+                counts["tables"] += 1
+                expect_table = False
+            stack.append([clause, False])
+            continue
+        if value == ")":
+            subquery_parens.pop()
+            stack.pop()
+            continue
+
+        if expect_table and token.kind in ("word", "quoted") and value not in _CLAUSE_STARTS:
+            counts["tables"] += 1
+            expect_table = False
+            continue
+
+        if token.kind == "word":
+            if value in _CLAUSE_STARTS:
+                stack[-1] = [_CLAUSE_STARTS[value], True]
+                expect_table = value == "FROM"
+                continue
+            if value in ("GROUP", "ORDER") and following == "BY":
+                stack[-1] = [value, True]
+                counts["group_keys" if value == "GROUP" else "order_keys"] += 1
+                continue
+            if value == "JOIN":
+                counts["joins"] += 1
+                expect_table = True
+                stack[-1] = ["FROM", True]
+                continue
+            if value in _AGGREGATES and following == "(":
+                counts["aggregates"] += 1
+                continue
+            if clause in ("WHERE", "HAVING", "ON"):
+                if value in _PATTERN_WORDS:
+                    counts["like"] += 1
+                elif value == "IN" and following == "(":
+                    counts["in_lists"] += 1
+                elif value == "BETWEEN":
+                    counts["between"] += 1
+                    after_between = True
+                elif value == "AND" and after_between:
+                    # The AND of BETWEEN x AND y
+                    after_between = False
+                    continue
+                elif value in ("AND", "OR"):
+                    if clause != "ON":
+                        counts["logical"] += 1
+                    continue
+                if clause != "ON" and (value in _PATTERN_WORDS or value in ("IN", "BETWEEN", "IS", "EXISTS")):
+                    counts["predicates"] += 1
+            continue
+
+        if token.kind == "op":
+            if value == "," and own:
+                if clause == "FROM":
+                    counts["joins"] += 1
+                    expect_table = True
+                elif clause == "GROUP":
+                    counts["group_keys"] += 1
+                elif clause == "ORDER":
+                    counts["order_keys"] += 1
+            elif value in _COMPARISONS and clause in ("WHERE", "HAVING"):
+                counts["predicates"] += 1
+
+    counts["having"] = int(any(token.value == "HAVING" for token in tokens))
+    counts["nesting"] = nesting
+    return Profile(**counts)
+
+
+def analyze_sql(sql):
+    # Raises SQLValidationError for text that doesn't tokenize or isn't one statement
+    statements = split_statements(tokenize_sql(clean_sql(sql)))
+    if len(statements) != 1:
+        raise SQLValidationError("Expected exactly one SQL statement")
+    return analyze_tokens(statements[0])
+
+
+_BASE_PROFILES = {statement: analyze_sql(sql) for statement, sql in BASE_QUERIES}
+
+
+def score(profile, statements=None):
+    # Points of the profile; with the selected statements, only those beyond the
+    # plainest query of their prompt
+    points = _points(profile)
+    base = _base_profile(statements)
+    if base is not None:
+        points -= _points(Profile(*map(min, profile, base)))
+    return points
+
+
+def _points(profile):
+    return sum(min(FEATURE_CAP, getattr(profile, feature) * weight) for feature, weight in WEIGHTS.items())
+
+
+def _base_profile(statements):
+    if not statements:
+        return None
+    selected = {statement.strip().upper() for statement in statements}
+    for statement, _ in BASE_QUERIES:
+        if statement in selected and (statement != "HAVING" or "GROUP BY" in selected):
+            return _BASE_PROFILES[statement]
+    return None
+
+
+def estimate_level(points):
+    for level, cutoff in LEVEL_CUTOFFS:
+        if points <= cutoff:
+            return level
+    return LEVELS[-1]
+
+
+def level_distance(level, requested):
+    if level not in LEVELS or requested not in LEVELS:
+        return 0
+    return abs(LEVELS.index(level) - LEVELS.index(requested))
+
+
+def fits_request(sql, difficulty, statements):
+    # (fits, score, estimated level): only the selected statements, and a level
+    # within LEVEL_TOLERANCE of the requested one
+    try:
+        tokens = check_allowed_clauses(sql, statements)
+    except SQLValidationError:
+        return False, None, None
+    points = score(analyze_tokens(tokens), statements)
+    level = estimate_level(points)
+    return level_distance(level, difficulty) <= LEVEL_TOLERANCE, points, level
+
+
+def rate_solutions(solutions, statements=None):
+    # (score, level) per solution; (None, None) for solutions that don't parse.
+    # statements holds the selected statements of each solution, if known
+    ratings = []
+    for solution, selected in zip(solutions, statements or [None] * len(solutions)):
+        try:
+            points = score(analyze_sql(solution), selected)
+        except SQLValidationError:
+            ratings.append((None, None))
+            continue
+        ratings.append((points, estimate_level(points)))
+    return ratings
+
+
+def main(argv=None):
+    # Re-scores every stored question and reports how the requested difficulty
+    # compares with the estimated level
+    parser = argparse.ArgumentParser(description="Score the complexity of the stored questions' solutions.")
+    parser.add_argument("--batch-size", type=int, default=2000)
+    args = parser.parse_args(argv)
+
+    from sqlalchemy.orm import sessionmaker
+
+    from agents import QuestionBankAgent
+    from models import migrate_database
+    from storage import create_storage_engine
+
+    engine = create_storage_engine()
+    migrate_database(engine)
+    bank = QuestionBankAgent(sessionmaker(bind=engine))
+    started = time.perf_counter()
+    scored = bank.rescore_complexity(args.batch_size)
+    elapsed = time.perf_counter() - started
+    print(f"Scored {scored} question(s) in {elapsed:.2f}s ({scored / max(elapsed, 1e-9):.0f} per second)")
+
+    matrix = Counter(bank.complexity_levels())
+    print(f"{'requested':12} " + " ".join(f"{level:>8}" for level in LEVELS + ['unparsed']))
+    for difficulty in sorted({difficulty for difficulty, _ in matrix}, key=lambda value: value or ""):
+        row = [matrix[(difficulty, level)] for level in LEVELS + [None]]
+        print(f"{difficulty or '-':12} " + " ".join(f"{count:8}" for count in row))
+
+
+if __name__ == "__main__":
+    main()
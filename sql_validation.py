@@ -0,0 +1,157 @@
+import re
+import sqlite3
+import threading
+import time
+from collections import namedtuple
+
+Token = namedtuple("Token", ["kind", "value", "depth"])
+
+_TOKEN_RE = re.compile(r"""
+    (?P<space>\s+)
+  | (?P<comment>--[^\n]*|/\*.*?(?:\*/|$))
+  | (?P<string>'(?:[^']|'')*(?:'|$))
+  | (?P<quoted>"(?:[^"]|"")*(?:"|$)|`(?:[^`]|``)*(?:`|$)|\[[^\]]*(?:\]|$))
+  | (?P<number>(?:\d+(?:\.\d*)?|\.\d+)(?:[eE][+-]?\d+)?)
+  | (?P<param>[?:@$]\w*)
+  | (?P<word>[A-Za-z_][A-Za-z0-9_$]*)
+  | (?P<op><=|>=|<>|!=|==|\|\||<<|>>|[-+*/%<>=~&|(),.;])
+""", re.VERBOSE | re.DOTALL)
+
+_CODE_FENCE_RE = re.compile(r"^\s*```[A-Za-z]*|```\s*$")
+
+# Clauses that are only accepted when the user selected them
+RESTRICTED_CLAUSES = ["JOIN", "ORDER BY", "GROUP BY", "HAVING", "SUBQUERIES", "UNION"]
+
+
+class SQLValidationError(Exception):
+    pass
+
+
+def clean_sql(sql):
+    # Model output often wraps the solution in a ```sql fence
+    return _CODE_FENCE_RE.sub("", sql or "").strip()
+
+
+def tokenize_sql(sql):
+    # Keywords are upper-cased word tokens; string literals, quoted identifiers
+    # and comments are kept out of the way so `joined_at` or 'join' never reads as JOIN
+    tokens = []
+    depth = 0
+    position = 0
+    while position < len(sql):
+        match = _TOKEN_RE.match(sql, position)
+        if match is None:
+            raise SQLValidationError(f"Unexpected character {sql[position]!r} at position {position}")
+        position = match.end()
+        kind = match.lastgroup
+        value = match.group()
+        if kind in ("space", "comment"):
+            continue
+        if kind == "word":
+            value = value.upper()
+        if value == ")":
+            depth -= 1
+            if depth < 0:
+                raise SQLValidationError("Unbalanced parentheses")
+        tokens.append(Token(kind, value, depth))
+        if value == "(":
+            depth += 1
+    if depth != 0:
+        raise SQLValidationError("Unbalanced parentheses")
+    return tokens
+
+
+def split_statements(tokens):
+    statements = [[]]
+    for token in tokens:
+        if token.value == ";":
+            statements.append([])
+        else:
+            statements[-1].append(token)
+    return [statement for statement in statements if statement]
+
+
+def statement_clauses(tokens):
+    clauses = set()
+    words = [token for token in tokens if token.kind == "word"]
+    for i, token in enumerate(words):
+        following = words[i + 1].value if i + 1 < len(words) else None
+        if token.value == "JOIN":
+            clauses.add("JOIN")
+        elif token.value in ("GROUP", "ORDER") and following == "BY":
+            clauses.add(f"{token.value} BY")
+        elif token.value == "HAVING":
+            clauses.add("HAVING")
+        elif token.value in ("UNION", "INTERSECT", "EXCEPT"):
+            clauses.add("UNION")
+        elif token.value == "SELECT" and token.depth > 0:
+            clauses.add("SUBQUERIES")
+    return clauses
+
+
+def statements_key(statements):
+    # The same selection of statements in any order or case gives the same key
+    return ",".join(sorted({statement.strip().upper() for statement in statements}))
+
+
+def check_allowed_clauses(sql, allowed_statements):
+    # Returns the single statement's tokens, or raises SQLValidationError
+    statements = split_statements(tokenize_sql(clean_sql(sql)))
+    if len(statements) != 1:
+        raise SQLValidationError("Expected exactly one SQL statement")
+    tokens = statements[0]
+    if tokens[0].value not in ("SELECT", "WITH"):
+        raise SQLValidationError("Only SELECT queries are accepted")
+
+    allowed = {statement.upper() for statement in allowed_statements}
+    for clause in sorted(statement_clauses(tokens)):
+        if clause in RESTRICTED_CLAUSES and clause not in allowed:
+            raise SQLValidationError(f"{clause} is not in the selected statements")
+    return tokens
+
+
+class SQLSandbox:
+    # Runs queries against a private in-memory copy of a practice database.
+    # Every thread gets its own read-only copy, so validations can run in parallel.
+
+    # Authorizer actions a read-only SELECT needs
+    _ALLOWED_ACTIONS = {sqlite3.SQLITE_SELECT, sqlite3.SQLITE_READ, sqlite3.SQLITE_FUNCTION, sqlite3.SQLITE_RECURSIVE}
+
+    def __init__(self, image, timeout=2.0, row_cap=1000):
+        # image is a serialized database, as returned by Connection.serialize()
+        self.image = image
+        self.timeout = timeout
+        self.row_cap = row_cap
+        self._local = threading.local()
+
+    def _connection(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(":memory:")
+            conn.deserialize(self.image)
+            conn.execute("PRAGMA query_only = ON")
+            conn.set_authorizer(self._authorize)
+            self._local.conn = conn
+        return conn
+
+    def _authorize(self, action, *args):
+        return sqlite3.SQLITE_OK if action in self._ALLOWED_ACTIONS else sqlite3.SQLITE_DENY
+
+    def run(self, sql):
+        # Returns (columns, rows, truncated); raises SQLValidationError on failure
+        conn = self._connection()
+        deadline = time.monotonic() + self.timeout
+        conn.set_progress_handler(lambda: time.monotonic() > deadline, 1000)
+        try:
+            cursor = conn.execute(clean_sql(sql))
+            rows = cursor.fetchmany(self.row_cap + 1)
+            columns = [column[0] for column in cursor.description or []]
+            cursor.close()
+        except sqlite3.Error as e:
+            if time.monotonic() > deadline:
+                raise SQLValidationError(f"Query exceeded the {self.timeout}s time limit") from e
+            raise SQLValidationError(str(e)) from e
+        finally:
+            conn.set_progress_handler(None, 0)
+        truncated = len(rows) > self.row_cap
+        return columns, rows[:self.row_cap], truncated
@@ -0,0 +1,677 @@
+import argparse
+import json
+import logging
+import os
+import random
+import sqlite3
+import tempfile
+import time
+from collections import namedtuple
+
+import numpy as np
+
+from practice_db import quote_identifier, split_sql_statements
+from schema_import import SAMPLE_ROWS, json_value
+
+logger = logging.getLogger(__name__)
+
+# Practice databases of realistic size, generated from a saved schema's DDL.
+# SQLite itself parses the DDL, and its PRAGMAs give the column types, primary
+# keys, foreign keys and UNIQUE constraints. Every key column holds a value
+# computed from the row number, so a foreign key only has to pick a parent row
+# number to reference an existing row: no table order matters and no parent
+# keys are kept in memory. Rows are generated in NumPy batches and written with
+# executemany, one transaction per batch, so memory stays at one batch whatever
+# the table size. The prompt-sized sample is then drawn from the large database.
+#
+# Config file (JSON), everything optional:
+#   {
+#     "rows": 100000,                        rows in each table not listed below
+#     "tables": {"orders": 1000000},
+#     "nulls": 0.02,                         share of NULLs in nullable columns
+#     "columns": {                           "table.column", or "column" in any table
+#       "orders.amount": {"distribution": "lognormal", "mean": 4, "sigma": 0.8},
+#       "orders.customer_id": {"distribution": "zipf", "a": 1.2},
+#       "status": {"distribution": "choice", "values": ["open", "shipped"], "weights": [1, 4]}
+#     }
+#   }
+#
+# Distributions: uniform (low, high; start, end for dates), normal (mean, std),
+# lognormal (mean, sigma), exponential (scale), poisson (lam), zipf (a, values),
+# choice (values, weights) and sequence (start, step). Dates drawn from anything
+# but uniform and choice are days after start. Foreign keys take uniform or zipf,
+# over parent rows.
+
+# Rows per table when neither the config nor the command line says otherwise
+DEFAULT_ROWS = 100000
+# Rows generated and inserted per transaction; memory use is about one batch
+BATCH_ROWS = 50000
+# Keys looked up per query while sampling a generated database
+SAMPLE_CHUNK = 500
+# Where generated databases are kept; the app's go in its sessions subdirectory
+PRACTICE_DB_DIR = os.environ.get("PRACTICE_DB_DIR", "practice_databases")
+# Seconds an app session's database is kept after it was last written
+PRACTICE_DB_TTL = float(os.environ.get("PRACTICE_DB_TTL", str(24 * 3600)))
+
+# Dates and timestamps fall in this range unless a column says otherwise
+DATE_START = "2015-01-01"
+DATE_END = "2024-12-31"
+
+# Values of columns without a configured distribution, by kind
+DEFAULT_DISTRIBUTIONS = {
+    "integer": {"distribution": "uniform", "low": 1, "high": 1000},
+    # Prices and amounts: mostly small, a long tail of large ones
+    "real": {"distribution": "lognormal", "mean": 3.5, "sigma": 1.0},
+    # A few common values and many rare ones, so GROUP BY has groups of every size
+    "text": {"distribution": "zipf", "a": 1.3, "values": 100},
+    "date": {"distribution": "uniform"},
+    "datetime": {"distribution": "uniform"},
+    "time": {"distribution": "uniform"},
+    "boolean": {"distribution": "choice", "values": [0, 1]},
+    "blob": {"distribution": "zipf", "a": 1.3, "values": 100},
+}
+DEFAULT_FOREIGN_KEY_DISTRIBUTION = {"distribution": "uniform"}
+# Integer columns whose name contains one of these words
+NAMED_DISTRIBUTIONS = {
+    "year": {"distribution": "uniform", "low": 2000, "high": 2024},
+    "age": {"distribution": "normal", "mean": 38, "std": 12},
+    "quantity": {"distribution": "poisson", "lam": 3},
+}
+
+# Spreads the digits of composite keys; see TablePlan.unit_index
+DIGIT_SHIFT = 7919
+SHIFT_MODULUS = 1 << 31
+
+Column = namedtuple("Column", ["name", "kind", "not_null"])
+ForeignKey = namedtuple("ForeignKey", ["parent", "columns", "parent_columns"])
+GenerationResult = namedtuple("GenerationResult", ["path", "rows", "seconds"])
+
+
+def column_kind(declared_type):
+    # SQLite's affinity rules, telling dates, times and booleans apart
+    declared = (declared_type or "").upper()
+    if "INT" in declared:
+        return "integer"
+    if "BOOL" in declared:
+        return "boolean"
+    if "DATE" in declared and "TIME" not in declared:
+        return "date"
+    if "TIMESTAMP" in declared or "DATETIME" in declared:
+        return "datetime"
+    if "TIME" in declared:
+        return "time"
+    if any(word in declared for word in ("CHAR", "CLOB", "TEXT")):
+        return "text"
+    if "BLOB" in declared:
+        return "blob"
+    if any(word in declared for word in ("REAL", "FLOA", "DOUB", "DEC", "NUM", "MONEY")):
+        return "real"
+    return "text"
+
+
+class TablePlan:
+    # How each column of one table gets its values. Columns are grouped into
+    # units: a foreign key's columns together, any other column alone. Units in a
+    # primary key or UNIQUE constraint are derived from the row number, the others
+    # are drawn at random.
+
+    def __init__(self, name, columns, primary_key, unique, foreign_keys):
+        self.name = name
+        self.columns = columns
+        self.kinds = {column.name: column.kind for column in columns}
+        self.not_null = {column.name for column in columns if column.not_null}
+        self.foreign_keys = foreign_keys
+        self.rows = 0
+        self.plans = None
+        self.unit_of = {}
+        for foreign_key in foreign_keys:
+            for column in foreign_key.columns:
+                self.unit_of.setdefault(column, foreign_key)
+        for column in columns:
+            self.unit_of.setdefault(column.name, column.name)
+        # Key units: unit -> None for "the row number itself", or (radixes, position)
+        # for one digit of the row number in a mixed radix over a composite key
+        self.keyed = {}
+        self.key_sets = [key for key in [primary_key] + unique if key]
+
+    def plan_keys(self, plans):
+        # Needs every table's row count, as a foreign key unit can only take as
+        # many distinct values as its parent has rows; returns whether this
+        # table's row count had to shrink
+        self.plans = plans
+        self.keyed = {}
+        capacity = None
+        for key in self.key_sets:
+            units = list(dict.fromkeys(self.unit_of[column] for column in key))
+            if any(unit in self.keyed and self.keyed[unit] is None for unit in units):
+                # Holds the row number in some column, so it is unique already
+                continue
+            radixes = [self.unit_size(unit) for unit in units]
+            if len(units) == 1:
+                self.keyed[units[0]] = None
+            else:
+                for position, unit in enumerate(units):
+                    self.keyed.setdefault(unit, (radixes, position))
+            if None not in radixes:
+                limit = int(np.prod(radixes, dtype=np.float64))
+                capacity = limit if capacity is None else min(capacity, limit)
+        if capacity is not None and self.rows > capacity:
+            logger.warning("%s can only have %d distinct keys; generating %d rows instead of %d",
+                           self.name, capacity, capacity, self.rows)
+            self.rows = capacity
+            return True
+        return False
+
+    def unit_size(self, unit):
+        if isinstance(unit, ForeignKey) and unit.parent != self.name and unit.parent in self.plans:
+            return self.plans[unit.parent].rows
+        # Unlimited; a self-reference in a key means at most one parent per row
+        return None
+
+    def nullable(self, foreign_key):
+        return not any(column in self.not_null for column in foreign_key.columns)
+
+    def is_key(self, column):
+        return column in self.unit_of and self.unit_of[column] in self.keyed
+
+    def unit_index(self, unit, index):
+        # Row numbers of the unit's values for rows at index: of the parent row
+        # for a foreign key, of the value itself otherwise
+        spec = self.keyed[unit]
+        if spec is None:
+            return index
+        # Composite keys: the row number as mixed-radix digits, one per limited
+        # unit, with unlimited units taking what is left over. Each digit is
+        # shifted by the ones before it, so e.g. enrollments don't fill course 1
+        # for every student before starting on course 2; for a given set of
+        # earlier digits the shift is fixed, so the digits stay distinct.
+        radixes, position = spec
+        remaining = index
+        shift = 0
+        for current, radix in enumerate(radixes):
+            if radix is None:
+                continue
+            digit = (remaining + shift) % radix
+            if current == position:
+                return digit
+            remaining = remaining // radix
+            shift = (shift * 31 + digit * DIGIT_SHIFT) % SHIFT_MODULUS
+        return remaining
+
+    def key_values(self, column, index):
+        # The values this table's rows at index hold in a key column
+        unit = self.unit_of[column]
+        if unit not in self.keyed:
+            raise ValueError(f"{self.name}.{column} is not a primary key or UNIQUE column")
+        unit_index = self.unit_index(unit, index)
+        if isinstance(unit, ForeignKey):
+            parent_column = unit.parent_columns[unit.columns.index(column)]
+            return self.plans[unit.parent].key_values(parent_column, unit_index)
+        return encode_values(column, self.kinds[column], unit_index)
+
+
+def read_schema(schema_sql):
+    # Table plans by name, in the order the DDL creates the tables
+    conn = sqlite3.connect(":memory:")
+    try:
+        for statement in split_sql_statements(schema_sql):
+            conn.execute(statement)
+        names = [row[0] for row in conn.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'table' AND name NOT LIKE 'sqlite_%' ORDER BY rowid"
+        )]
+        plans = {}
+        for name in names:
+            table = quote_identifier(name)
+            info = conn.execute(f"PRAGMA table_info({table})").fetchall()
+            columns = [Column(row[1], column_kind(row[2]), bool(row[3]) or bool(row[5])) for row in info]
+            primary_key = [row[1] for row in sorted(info, key=lambda row: row[5]) if row[5]]
+
+            unique = []
+            for index in conn.execute(f"PRAGMA index_list({table})").fetchall():
+                if index[2] and index[3] != "pk" and not index[4]:
+                    key = [row[2] for row in conn.execute(f"PRAGMA index_info({quote_identifier(index[1])})")]
+                    # Indexes on expressions have no column name to generate for
+                    if None not in key:
+                        unique.append(key)
+
+            constraints = {}
+            for row in conn.execute(f"PRAGMA foreign_key_list({table})").fetchall():
+                constraints.setdefault(row[0], []).append(row)
+            foreign_keys = []
+            for rows in constraints.values():
+                rows.sort(key=lambda row: row[1])
+                parent = rows[0][2]
+                parent_columns = [row[4] for row in rows]
+                if None in parent_columns:
+                    # REFERENCES parent without columns means the parent's primary key
+                    parent_info = conn.execute(f"PRAGMA table_info({quote_identifier(parent)})").fetchall()
+                    parent_columns = [row[1] for row in sorted(parent_info, key=lambda row: row[5]) if row[5]]
+                foreign_keys.append(ForeignKey(parent, tuple(row[3] for row in rows), tuple(parent_columns)))
+            plans[name] = TablePlan(name, columns, primary_key, unique, foreign_keys)
+        return plans
+    finally:
+        conn.close()
+
+
+def _label(column):
+    return column.replace("_", " ").strip().title() or "Value"
+
+
+def encode_values(column, kind, numbers):
+    # Distinct numbers give distinct values of the column's kind
+    if kind == "integer" or kind == "boolean":
+        return numbers + 1
+    if kind == "real":
+        return (numbers + 1).astype(np.float64)
+    if kind == "date":
+        return np.datetime_as_string(np.datetime64(DATE_START, "D") + numbers, unit="D")
+    if kind == "datetime":
+        return np.char.replace(np.datetime_as_string(np.datetime64(DATE_START, "s") + numbers * 60, unit="s"), "T", " ")
+    if kind == "time":
+        timestamps = np.datetime_as_string(np.datetime64(DATE_START, "s") + numbers % 86400, unit="s")
+        return np.char.partition(timestamps, "T")[:, 2]
+    return text_values(column, numbers + 1)
+
+
+def text_values(column, numbers):
+    strings = numbers.astype(str)
+    lowered = column.lower()
+    if "mail" in lowered:
+        return np.char.add(np.char.add("user", strings), "@example.com")
+    if "phone" in lowered:
+        return np.char.add("555-", np.char.zfill(strings, 7))
+    if "code" in lowered or "sku" in lowered:
+        return np.char.add(lowered[:3].upper() + "-", np.char.zfill(strings, 6))
+    return np.char.add(_label(column) + " ", strings)
+
+
+def default_distribution(column):
+    if column.kind == "integer":
+        for word, spec in NAMED_DISTRIBUTIONS.items():
+            if word in column.name.lower():
+                return spec
+    return DEFAULT_DISTRIBUTIONS[column.kind]
+
+
+def _days(date):
+    return np.datetime64(date, "D").astype(np.int64)
+
+
+def draw_values(rng, column, kind, spec, count):
+    distribution = spec.get("distribution", "uniform")
+    if distribution == "choice":
+        values = np.array(spec["values"], dtype=object)
+        weights = spec.get("weights")
+        if weights is not None:
+            weights = np.asarray(weights, dtype=np.float64)
+            weights = weights / weights.sum()
+        return values[rng.choice(len(values), count, p=weights)]
+
+    if kind in ("date", "datetime", "time") and distribution == "uniform":
+        if kind == "time":
+            seconds = rng.integers(0, 86400, count)
+            return encode_values(column, "time", seconds)
+        low, high = _days(spec.get("start", DATE_START)), _days(spec.get("end", DATE_END))
+        if kind == "date":
+            return np.datetime_as_string((rng.integers(low, high + 1, count)).astype("datetime64[D]"), unit="D")
+        seconds = rng.integers(low * 86400, (high + 1) * 86400, count)
+        return np.char.replace(np.datetime_as_string(seconds.astype("datetime64[s]"), unit="s"), "T", " ")
+
+    if distribution == "uniform":
+        low, high = spec.get("low", 0), spec.get("high", 1)
+        numbers = rng.integers(low, high + 1, count) if kind != "real" else rng.uniform(low, high, count)
+    elif distribution == "normal":
+        numbers = rng.normal(spec.get("mean", 0.0), spec.get("std", 1.0), count)
+    elif distribution == "lognormal":
+        numbers = rng.lognormal(spec.get("mean", 0.0), spec.get("sigma", 1.0), count)
+    elif distribution == "exponential":
+        numbers = rng.exponential(spec.get("scale", 1.0), count)
+    elif distribution == "poisson":
+        numbers = rng.poisson(spec.get("lam", 1.0), count)
+    elif distribution == "zipf":
+        # Ranks 1, 2, 3... folded into the first `values` ones; rank 1 is the most common
+        numbers = (rng.zipf(spec.get("a", 1.3), count) - 1) % spec.get("values", 100) + 1
+    elif distribution == "sequence":
+        numbers = spec.get("start", 1) + spec.get("step", 1) * np.arange(count)
+    else:
+        raise ValueError(f"Unknown distribution {distribution!r} for {column}")
+
+    if kind in ("integer", "boolean"):
+        return np.rint(numbers).astype(np.int64)
+    if kind == "real":
+        return np.round(numbers.astype(np.float64), 2)
+    if kind in ("date", "datetime", "time"):
+        days = _days(spec.get("start", DATE_START)) + np.rint(numbers).astype(np.int64)
+        return encode_values(column, kind, days - _days(DATE_START))
+    # Drawn text repeats a lot: each distinct value is formatted once
+    distinct, positions = np.unique(np.rint(numbers).astype(np.int64), return_inverse=True)
+    return text_values(column, distinct)[positions]
+
+
+def draw_parent_rows(rng, spec, parent_rows, count):
+    if spec.get("distribution", "uniform") == "zipf":
+        # Parent row 0 is referenced most, like a best-selling product
+        return (rng.zipf(spec.get("a", 1.3), count) - 1) % parent_rows
+    return rng.integers(0, parent_rows, count)
+
+
+class DataGenerator:
+    def __init__(self, schema_sql, config=None, seed=None, batch_rows=BATCH_ROWS):
+        self.config = config or {}
+        self.plans = read_schema(schema_sql)
+        if not self.plans:
+            raise ValueError("The schema creates no tables")
+        self.schema_sql = schema_sql
+        self.rng = np.random.default_rng(seed)
+        self.batch_rows = batch_rows
+        tables = self.config.get("tables", {})
+        for name, plan in self.plans.items():
+            plan.rows = int(tables.get(name, self.config.get("rows", DEFAULT_ROWS)))
+        # A table capped by its keys can cap the tables whose keys reference it
+        for _ in self.plans:
+            if not [plan for plan in self.plans.values() if plan.plan_keys(self.plans)]:
+                break
+        for plan in self.plans.values():
+            for foreign_key in plan.foreign_keys:
+                parent = self.plans.get(foreign_key.parent)
+                if parent is None or not all(parent.is_key(column) for column in foreign_key.parent_columns):
+                    logger.warning("%s references %s, which has no such key; the reference is left NULL",
+                                   plan.name, foreign_key.parent)
+
+    def column_spec(self, table, column, default):
+        columns = self.config.get("columns", {})
+        return columns.get(f"{table}.{column}") or columns.get(column) or default
+
+    def batch(self, plan, start, stop):
+        # Column arrays for rows start..stop of the table, in column order
+        index = np.arange(start, stop, dtype=np.int64)
+        count = stop - start
+        nulls = self.config.get("nulls", 0.0)
+        values = {}
+        for foreign_key in plan.foreign_keys:
+            if foreign_key in plan.keyed:
+                continue
+            parent = self.plans.get(foreign_key.parent)
+            if parent is None or parent.rows == 0 or not all(parent.is_key(column) for column in foreign_key.parent_columns):
+                for column in foreign_key.columns:
+                    values.setdefault(column, np.full(count, None, dtype=object))
+                continue
+            spec = self.column_spec(plan.name, foreign_key.columns[0], DEFAULT_FOREIGN_KEY_DISTRIBUTION)
+            if parent is plan:
+                # Each row references an earlier one, so self-references form trees
+                rows = np.floor(self.rng.random(count) * index).astype(np.int64)
+                # The first row has no earlier one: it is a root, or its own parent
+                missing = (index == 0) & plan.nullable(foreign_key)
+            else:
+                rows = draw_parent_rows(self.rng, spec, parent.rows, count)
+                missing = np.zeros(count, dtype=bool)
+            share = spec.get("nulls", nulls)
+            if share and plan.nullable(foreign_key):
+                missing |= self.rng.random(count) < share
+            for column, parent_column in zip(foreign_key.columns, foreign_key.parent_columns):
+                column_values = parent.key_values(parent_column, rows).astype(object)
+                column_values[missing] = None
+                values.setdefault(column, column_values)
+
+        for column in plan.columns:
+            if column.name in values:
+                continue
+            unit = plan.unit_of[column.name]
+            if unit in plan.keyed:
+                values[column.name] = plan.key_values(column.name, index)
+                continue
+            spec = self.column_spec(plan.name, column.name, default_distribution(column))
+            column_values = draw_values(self.rng, column.name, column.kind, spec, count)
+            share = spec.get("nulls", nulls)
+            if share and not column.not_null:
+                column_values = column_values.astype(object)
+                column_values[self.rng.random(count) < share] = None
+            values[column.name] = column_values
+        return [values[column.name] for column in plan.columns]
+
+    def write(self, path, progress=None):
+        # Builds the database in a file of its own next to path and moves it into
+        # place when complete, so writers of the same path never share a file;
+        # progress(table, rows_done, rows_total) is called after every batch
+        started = time.monotonic()
+        fd, temporary = tempfile.mkstemp(prefix=f"{os.path.basename(path)}.", suffix=".tmp",
+                                         dir=os.path.dirname(os.path.abspath(path)))
+        os.close(fd)
+        conn = sqlite3.connect(temporary, isolation_level=None)
+        inserted = {}
+        try:
+            # Nothing to recover on a crash: the half-written file is discarded
+            conn.execute("PRAGMA journal_mode = OFF")
+            conn.execute("PRAGMA synchronous = OFF")
+            conn.execute("PRAGMA foreign_keys = OFF")
+            for statement in split_sql_statements(self.schema_sql):
+                conn.execute(statement)
+            for plan in self.plans.values():
+                column_list = ", ".join(quote_identifier(column.name) for column in plan.columns)
+                placeholders = ", ".join("?" for _ in plan.columns)
+                # CHECK constraints aren't known to the generator; rows breaking one are skipped
+                insert = f"INSERT OR IGNORE INTO {quote_identifier(plan.name)} ({column_list}) VALUES ({placeholders})"
+                before = conn.total_changes
+                for start in range(0, plan.rows, self.batch_rows):
+                    stop = min(start + self.batch_rows, plan.rows)
+                    columns = [array.tolist() for array in self.batch(plan, start, stop)]
+                    conn.execute("BEGIN")
+                    conn.executemany(insert, zip(*columns))
+                    conn.execute("COMMIT")
+                    if progress:
+                        progress(plan.name, stop, plan.rows)
+                inserted[plan.name] = conn.total_changes - before
+                logger.info("Generated %d row(s) of %s", inserted[plan.name], plan.name)
+            conn.execute("ANALYZE")
+        except BaseException:
+            conn.close()
+            os.remove(temporary)
+            raise
+        conn.close()
+        os.replace(temporary, path)
+        return GenerationResult(path, inserted, time.monotonic() - started)
+
+
+def generate_database(schema_sql, path, config=None, seed=None, batch_rows=BATCH_ROWS, progress=None):
+    return DataGenerator(schema_sql, config, seed, batch_rows).write(path, progress)
+
+
+def children_first(plans):
+    # Tables referencing others come before the tables they reference; tables in
+    # a cycle are taken in DDL order
+    remaining = list(plans)
+    order = []
+    while remaining:
+        ready = [name for name in remaining if not any(
+            foreign_key.parent != name and foreign_key.parent in remaining
+            for foreign_key in plans[name].foreign_keys
+        )] or remaining[:1]
+        order.extend(ready)
+        remaining = [name for name in remaining if name not in ready]
+    return order[::-1]
+
+
+def _select_in(conn, table, columns, key_columns, keys):
+    # Rows whose key columns hold one of keys, a chunk of keys per query
+    keys = list(keys)
+    target = key_columns[0] if len(key_columns) == 1 else f"({', '.join(key_columns)})"
+    placeholder = "?" if len(key_columns) == 1 else f"({', '.join('?' for _ in key_columns)})"
+    for start in range(0, len(keys), SAMPLE_CHUNK):
+        chunk = keys[start:start + SAMPLE_CHUNK]
+        values = ", ".join(placeholder for _ in chunk)
+        # Row values compare against a VALUES list
+        values = values if len(key_columns) == 1 else f"VALUES {values}"
+        query = f"SELECT {columns} FROM {table} WHERE {target} IN ({values})"
+        yield from conn.execute(query, [value for key in chunk for value in key])
+
+
+def derive_sample(path, schema_sql, rows_per_table=SAMPLE_ROWS, seed=None):
+    # A prompt-sized sample of a generated database. Tables are sampled children
+    # first and each table's sample includes every row its children's samples
+    # reference, so joins in the sample find matches the way they do in the large
+    # database; rows are read by rowid or key, never by scanning a table.
+    plans = read_schema(schema_sql)
+    rng = random.Random(seed)
+    conn = sqlite3.connect(f"file:{os.path.abspath(path)}?mode=ro", uri=True)
+    samples = {}
+    wanted = {name: {} for name in plans}
+    try:
+        for name in children_first(plans):
+            plan = plans[name]
+            table = quote_identifier(name)
+            columns = ", ".join(quote_identifier(column.name) for column in plan.columns)
+            rows = {}
+            for key_columns, keys in wanted[name].items():
+                quoted = [quote_identifier(column) for column in key_columns]
+                for row in _select_in(conn, table, columns, quoted, keys):
+                    rows.setdefault(row, None)
+            missing = rows_per_table - len(rows)
+            if missing > 0:
+                try:
+                    last = conn.execute(f"SELECT max(rowid) FROM {table}").fetchone()[0] or 0
+                    rowids = rng.sample(range(1, last + 1), min(missing, last))
+                    random_rows = _select_in(conn, table, columns, ["rowid"], [(rowid,) for rowid in rowids])
+                except sqlite3.OperationalError:
+                    # WITHOUT ROWID tables
+                    random_rows = conn.execute(f"SELECT {columns} FROM {table} ORDER BY random() LIMIT {missing}")
+                for row in random_rows:
+                    rows.setdefault(row, None)
+            samples[name] = [dict(zip([column.name for column in plan.columns], row)) for row in rows]
+            for foreign_key in plan.foreign_keys:
+                keys = {tuple(row[column] for column in foreign_key.columns) for row in samples[name]}
+                wanted.setdefault(foreign_key.parent, {}).setdefault(foreign_key.parent_columns, set()).update(
+                    key for key in keys if None not in key
+                )
+    finally:
+        conn.close()
+    make_consistent(plans, samples)
+    return {name: [{column: json_value(value) for column, value in row.items()} for row in samples[name]] for name in plans}
+
+
+def make_consistent(plans, samples):
+    # Self-references and cycles can still point outside the sample: such
+    # references are set to NULL where the columns allow it, otherwise the row is
+    # dropped, until no reference is left dangling
+    changed = True
+    while changed:
+        changed = False
+        for name, plan in plans.items():
+            for foreign_key in plan.foreign_keys:
+                if foreign_key.parent not in samples:
+                    continue
+                keys = {tuple(row[column] for column in foreign_key.parent_columns) for row in samples[foreign_key.parent]}
+                nullable = plan.nullable(foreign_key)
+                kept = []
+                for row in samples[name]:
+                    key = tuple(row[column] for column in foreign_key.columns)
+                    if None in key or key in keys:
+                        kept.append(row)
+                    elif nullable:
+                        for column in foreign_key.columns:
+                            row[column] = None
+                        kept.append(row)
+                        changed = True
+                    else:
+                        changed = True
+                samples[name] = kept
+
+
+def database_name(schema_name):
+    safe = "".join(character if character.isalnum() else "-" for character in schema_name).strip("-").lower()
+    return f"{safe or 'schema'}.db"
+
+
+def database_path(schema_name):
+    return os.path.join(PRACTICE_DB_DIR, database_name(schema_name))
+
+
+def sessions_dir():
+    return os.path.join(PRACTICE_DB_DIR, "sessions")
+
+
+def new_database_path(schema_name):
+    # A new empty file for one app session's database, so sessions generating
+    # the same schema never write or serve each other's
+    directory = sessions_dir()
+    os.makedirs(directory, exist_ok=True)
+    stem, suffix = os.path.splitext(database_name(schema_name))
+    fd, path = tempfile.mkstemp(prefix=f"{stem}-", suffix=suffix, dir=directory)
+    os.close(fd)
+    return path
+
+
+def remove_stale_databases(ttl=None, now=None):
+    # Sessions end without saying so, so their databases, and what interrupted
+    # writes left behind, are removed once nothing wrote to them for ttl seconds;
+    # returns how many files were removed
+    ttl = PRACTICE_DB_TTL if ttl is None else ttl
+    now = time.time() if now is None else now
+    removed = 0
+    try:
+        entries = list(os.scandir(sessions_dir()))
+    except FileNotFoundError:
+        return 0
+    for entry in entries:
+        try:
+            if entry.is_file() and now - entry.stat().st_mtime > ttl:
+                os.remove(entry.path)
+                removed += 1
+        except FileNotFoundError:
+            # Removed by another process meanwhile
+            continue
+    if removed:
+        logger.info("Removed %d practice database(s) unused for %.0fs", removed, ttl)
+    return removed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generate a large practice database for a saved schema.")
+    parser.add_argument("name", help="saved schema to generate data for")
+    parser.add_argument("--out", help="database file to write (default: under PRACTICE_DB_DIR)")
+    parser.add_argument("--config", help="JSON file with row counts and column distributions")
+    parser.add_argument("--rows", type=int, help="rows in each table not given a count in the config")
+    parser.add_argument("--table-rows", nargs="+", default=[], metavar="TABLE=ROWS", help="rows in particular tables")
+    parser.add_argument("--batch-rows", type=int, default=BATCH_ROWS)
+    parser.add_argument("--seed", type=int)
+    parser.add_argument("--save-sample", action="store_true",
+                        help="replace the schema's sample data with a sample of the generated rows")
+    parser.add_argument("--sample-rows", type=int, default=SAMPLE_ROWS)
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(message)s")
+
+    from sqlalchemy.orm import sessionmaker
+
+    from agents import SchemaAgent
+    from models import migrate_database
+    from storage import create_storage_engine
+
+    config = {}
+    if args.config:
+        with open(args.config) as f:
+            config = json.load(f)
+    if args.rows is not None:
+        config["rows"] = args.rows
+    for entry in args.table_rows:
+        table, _, rows = entry.partition("=")
+        config.setdefault("tables", {})[table] = int(rows)
+
+    engine = create_storage_engine()
+    migrate_database(engine)
+    schema_agent = SchemaAgent(sessionmaker(bind=engine))
+    schema_sql, _ = schema_agent.get_schema_and_data(args.name)
+    if schema_sql is None:
+        parser.error(f"No saved schema named {args.name!r}")
+
+    path = args.out or database_path(args.name)
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    result = generate_database(schema_sql, path, config, args.seed, args.batch_rows)
+    total = sum(result.rows.values())
+    print(f"Wrote {total} row(s) in {len(result.rows)} table(s) to {path} in {result.seconds:.1f}s ({total / max(result.seconds, 1e-9):.0f} rows/s)")
+    if args.save_sample:
+        sample_data = derive_sample(path, schema_sql, args.sample_rows, args.seed)
+        schema_agent.update_sample_data(args.name, json.dumps(sample_data))
+        print(f"Saved a sample of {sum(len(rows) for rows in sample_data.values())} row(s) as the sample data of {args.name!r}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,53 @@
+import json
+import os
+import subprocess
+import sys
+
+from conftest import STUB_CONDITIONS
+
+from agents import QuestionBankAgent
+from batch import CHECKPOINT_FILE, file_stem
+
+BATCH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "batch.py")
+STATEMENTS = ["SELECT", "FROM", "WHERE"]
+
+
+def run_batch(tmp_path, engine):
+    env = {**os.environ, "DATABASE_URL": engine.url.render_as_string(hide_password=False)}
+    env.pop("MODEL_STUB", None)
+    result = subprocess.run(
+        [sys.executable, BATCH, "matrix.json", "--out", "out", "--stub", "--processes", "2", "--flush-size", "2"],
+        cwd=tmp_path, env=env, capture_output=True, text=True, timeout=120,
+    )
+    assert result.returncode == 0, result.stderr
+    with open(tmp_path / "out" / CHECKPOINT_FILE) as f:
+        return result.stdout, json.load(f)["jobs"]
+
+
+def test_stub_batch_exports_every_level_and_resumes(tmp_path, engine, Session, shop):
+    matrix = {"schemas": [shop], "difficulties": list(STUB_CONDITIONS), "statements": [STATEMENTS], "questions": 4}
+    (tmp_path / "matrix.json").write_text(json.dumps(matrix))
+
+    output, jobs = run_batch(tmp_path, engine)
+    assert "3 of 3 job(s) exported" in output
+    bank = QuestionBankAgent(Session)
+    for difficulty, condition in STUB_CONDITIONS.items():
+        key = f"{shop} | {difficulty} | {' '.join(STATEMENTS)}"
+        entry = jobs[key]
+        assert entry["exported"] and entry["error"] is None and entry["completed"] == 4
+        solutions = [row.solution for row in bank.job_questions(entry["job_id"])]
+        assert len(solutions) == 4
+        assert all(condition in solution for solution in solutions)
+        stem = tmp_path / "out" / file_stem(key)
+        xml = (stem.parent / f"{stem.name}.xml").read_text()
+        assert xml.count("<question type=") == 4 and condition.strip() in xml
+        assert (stem.parent / f"{stem.name}.md").exists()
+
+    # An export lost to an interruption is redone from the saved questions
+    level_3 = f"{shop} | Level 3 | {' '.join(STATEMENTS)}"
+    jobs[level_3]["exported"] = False
+    (tmp_path / "out" / CHECKPOINT_FILE).write_text(json.dumps({"jobs": jobs}))
+    output, resumed = run_batch(tmp_path, engine)
+    assert "3 of 3 job(s) exported" in output
+    assert {key: entry["job_id"] for key, entry in resumed.items()} == {key: entry["job_id"] for key, entry in jobs.items()}
+    assert len(bank.job_questions(jobs[level_3]["job_id"])) == 4
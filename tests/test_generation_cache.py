@@ -0,0 +1,82 @@
+import json
+
+from agents import BATCH_SIZE, PLACEHOLDER_QUESTION, GenerationAgent, QuestionBankAgent
+
+
+class ReplayingQuestionAgent:
+    # Stands in for a response cache: the same slot replays the same batch unless
+    # the cache is bypassed, which gets new questions
+    use_cache = True
+
+    def __init__(self):
+        self.calls = []
+
+    def generate_sql_prompt(self, schema, sample_data, difficulty, statements, num_questions):
+        return "prompt"
+
+    def completion_tokens(self, difficulty, size):
+        return 100
+
+    def get_batch(self, prompt, slot, max_tokens, use_cache=None):
+        cached = self.use_cache if use_cache is None else use_cache
+        self.calls.append((slot, cached))
+        prefix = "Cached" if cached else "Fresh"
+        return json.dumps([
+            {"question": f"{prefix} question about column {slot + i}", "solution": f"SELECT {prefix.lower()}_{slot + i} FROM t;"}
+            for i in range(BATCH_SIZE)
+        ])
+
+
+class AcceptingValidationAgent:
+    def parse_batch_response(self, response):
+        return [(item["question"], item["solution"]) for item in json.loads(response)]
+
+    def validate_sql(self, sql, statements, sandbox=None):
+        return True
+
+
+def test_banked_cached_batches_are_asked_again_past_the_cache(Session):
+    question_agent = ReplayingQuestionAgent()
+    bank = QuestionBankAgent(Session)
+    agent = GenerationAgent(question_agent, AcceptingValidationAgent(), bank)
+    agent.check_level = False
+
+    first, _ = agent.generate_questions_with_retries("schema", {}, "Level 1", ["SELECT"], BATCH_SIZE, schema_name="Shop")
+    assert all(question.startswith("Cached") for question in first)
+
+    # The same request again: the cached batch is all in the bank now
+    question_agent.calls.clear()
+    second, _ = agent.generate_questions_with_retries("schema", {}, "Level 1", ["SELECT"], BATCH_SIZE, schema_name="Shop")
+    assert PLACEHOLDER_QUESTION not in second
+    assert all(question.startswith("Fresh") for question in second)
+    # One replay and one fresh call for the same slot, no retry round
+    assert question_agent.calls == [(0, True), (0, False)]
+
+
+def test_no_extra_calls_when_the_cache_is_off(Session):
+    question_agent = ReplayingQuestionAgent()
+    question_agent.use_cache = False
+    agent = GenerationAgent(question_agent, AcceptingValidationAgent(), QuestionBankAgent(Session))
+    agent.check_level = False
+    agent.generate_questions_with_retries("schema", {}, "Level 1", ["SELECT"], BATCH_SIZE, schema_name="Shop")
+    assert question_agent.calls == [(0, False)]
+
+
+def test_asked_again_batch_only_fills_the_slots_left_free(Session):
+    question_agent = ReplayingQuestionAgent()
+    bank = QuestionBankAgent(Session)
+    # Two of the cached batch's questions were banked by an earlier run
+    bank.save_questions(
+        [f"Cached question about column {i}" for i in range(2)], [f"SELECT cached_{i} FROM t;" for i in range(2)],
+        schema_name="Shop",
+    )
+    agent = GenerationAgent(question_agent, AcceptingValidationAgent(), bank)
+    agent.check_level = False
+
+    generated = list(agent.iter_validated_questions("schema", {}, "Level 1", ["SELECT"], BATCH_SIZE, schema_name="Shop"))
+    slots = [slot for slot, _, _ in generated]
+    assert sorted(slots) == list(range(BATCH_SIZE))
+    questions = [question for _, question, _ in generated]
+    assert {question.split()[0] for question in questions} == {"Cached", "Fresh"}
+    # The fresh answer went to the slots of the banked questions
+    assert sorted(slot for slot, question, _ in generated if question.startswith("Fresh")) == [0, 1]
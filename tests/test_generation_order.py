@@ -0,0 +1,51 @@
+import json
+import time
+
+from agents import BATCH_SIZE, GenerationAgent, QuestionBankAgent
+
+
+class SlowFirstQuestionAgent:
+    # Earlier batches answer last, so completion order is the reverse of slot order
+    batches = 3
+
+    def generate_sql_prompt(self, schema, sample_data, difficulty, statements, num_questions):
+        return "prompt"
+
+    def completion_tokens(self, difficulty, size):
+        return 100
+
+    def get_batch(self, prompt, slot, max_tokens, use_cache=None):
+        time.sleep(0.05 * (self.batches - slot // BATCH_SIZE))
+        return json.dumps([
+            {"question": f"Question {slot + i}", "solution": f"SELECT c{slot + i} FROM t;"} for i in range(BATCH_SIZE)
+        ])
+
+
+class AcceptingValidationAgent:
+    def parse_batch_response(self, response):
+        return [(item["question"], item["solution"]) for item in json.loads(response)]
+
+    def validate_sql(self, sql, statements, sandbox=None):
+        return True
+
+
+def generation_agent(Session):
+    agent = GenerationAgent(SlowFirstQuestionAgent(), AcceptingValidationAgent(), QuestionBankAgent(Session))
+    agent.check_level = False
+    return agent
+
+
+def test_stream_yields_in_completion_order_with_slots(Session):
+    num = SlowFirstQuestionAgent.batches * BATCH_SIZE
+    streamed = list(generation_agent(Session).stream_questions("schema", {}, "Level 1", ["SELECT"], num))
+    slots = [slot for slot, _, _ in streamed]
+    assert sorted(slots) == list(range(num))
+    assert slots != sorted(slots)
+    assert all(question == f"Question {slot}" for slot, question, _ in streamed)
+
+
+def test_final_questions_are_in_slot_order(Session):
+    num = SlowFirstQuestionAgent.batches * BATCH_SIZE
+    questions, solutions = generation_agent(Session).generate_questions_with_retries("schema", {}, "Level 1", ["SELECT"], num)
+    assert questions == [f"Question {i}" for i in range(num)]
+    assert solutions == [f"SELECT c{i} FROM t;" for i in range(num)]
@@ -0,0 +1,74 @@
+import threading
+import time
+
+import openai
+import pytest
+from conftest import SHOP_SAMPLE, SHOP_SCHEMA, STUB_CONDITIONS
+
+import model_client
+from agents import QuestionGenerationAgent, ValidationAgent
+from hedging import Hedger
+
+STATEMENTS = ["SELECT", "FROM", "WHERE"]
+
+
+@pytest.fixture
+def hedger(stub, monkeypatch):
+    hedger = Hedger(min_samples=3, min_delay=0.05)
+    monkeypatch.setattr(model_client, "hedger", hedger)
+    return hedger
+
+
+def ask(difficulty, num_questions=2):
+    agent = QuestionGenerationAgent()
+    prompt = agent.generate_sql_prompt(SHOP_SCHEMA, SHOP_SAMPLE, difficulty, STATEMENTS, num_questions)
+    return ValidationAgent(api_fallback=False).parse_batch_response(agent.get_batch(prompt))
+
+
+def stall_first(stub, seconds):
+    # The first request hangs the way a slow replica does; the rest go to the stub
+    calls = []
+    lock = threading.Lock()
+
+    def create(**kwargs):
+        with lock:
+            first = not calls
+            calls.append(kwargs)
+        if first:
+            time.sleep(seconds)
+        return stub(**kwargs)
+
+    return create
+
+
+@pytest.mark.parametrize("difficulty,condition", STUB_CONDITIONS.items())
+def test_hedge_answers_a_stalled_request(hedger, stub, monkeypatch, difficulty, condition):
+    for _ in range(hedger.min_samples):
+        ask(difficulty)
+    monkeypatch.setattr(openai.ChatCompletion, "create", stall_first(stub, 2.0))
+
+    started = time.monotonic()
+    items = ask(difficulty)
+    assert time.monotonic() - started < 1.0
+    assert hedger.stats["hedged"] == 1 and hedger.stats["hedge_wins"] == 1
+    assert len(items) == 2
+    assert all(condition in solution for _, solution in items)
+
+
+def test_no_hedge_before_enough_samples(hedger, stub, monkeypatch):
+    monkeypatch.setattr(openai.ChatCompletion, "create", stall_first(stub, 0.2))
+    items = ask("Level 3")
+    assert hedger.stats["hedged"] == 0
+    assert all(STUB_CONDITIONS["Level 3"] in solution for _, solution in items)
+
+
+def test_deadline_covers_every_attempt(hedger, stub, monkeypatch):
+    for _ in range(hedger.min_samples):
+        ask("Level 1")
+    monkeypatch.setattr(model_client, "REQUEST_TIMEOUT", 0.3)
+    stub.latency = 1.0
+    started = time.monotonic()
+    with pytest.raises(openai.error.Timeout):
+        ask("Level 1")
+    assert time.monotonic() - started < 0.9
+    assert hedger.stats["hedged"] == 1 and hedger.stats["deadline_exceeded"] == 1
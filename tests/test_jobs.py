@@ -0,0 +1,48 @@
+import time
+
+import pytest
+from conftest import STUB_CONDITIONS
+
+from agents import QuestionBankAgent
+from jobs import JobQueue
+from sql_complexity import fits_request
+
+STATEMENTS = ["SELECT", "FROM", "WHERE"]
+
+
+@pytest.mark.parametrize("difficulty,condition", STUB_CONDITIONS.items())
+def test_queued_job_saves_questions_of_its_level(Session, shop, stub, difficulty, condition):
+    queue = JobQueue(Session, workers=0, flush_size=2)
+    job_id = queue.submit("alice", shop, difficulty, STATEMENTS, 5)
+    assert queue.run_next()
+    assert not queue.run_next()
+
+    job = queue.get_job(job_id)
+    assert job["status"] == "done" and job["error"] is None
+    assert job["completed"] == 5
+    rows = QuestionBankAgent(Session).job_questions(job_id)
+    assert len(rows) == 5
+    for row in rows:
+        assert condition in row.solution
+        assert fits_request(row.solution, difficulty, STATEMENTS)[0]
+    if difficulty == "Level 1":
+        assert not any(" AND " in row.solution for row in rows)
+
+
+def test_worker_threads_run_every_owners_jobs(Session, shop, stub):
+    queue = JobQueue(Session, workers=2)
+    job_ids = [queue.submit(owner, shop, difficulty, STATEMENTS, 3)
+               for owner, difficulty in [("alice", "Level 1"), ("alice", "Level 5"), ("bob", "Level 3")]]
+    queue.start()
+    try:
+        deadline = time.monotonic() + 30
+        while time.monotonic() < deadline and any(queue.get_job(job_id)["status"] != "done" for job_id in job_ids):
+            time.sleep(0.05)
+    finally:
+        queue.stop()
+
+    bank = QuestionBankAgent(Session)
+    for job_id in job_ids:
+        job = queue.get_job(job_id)
+        assert job["status"] == "done" and job["completed"] == 3
+        assert all(STUB_CONDITIONS[job["difficulty"]] in row.solution for row in bank.job_questions(job_id))
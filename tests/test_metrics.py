@@ -0,0 +1,36 @@
+import time
+
+import openai
+import pytest
+
+import metrics
+from rate_limiter import RequestScheduler
+
+
+@pytest.fixture
+def recorder(Session):
+    recorder = metrics.MetricsRecorder(Session)
+    metrics.set_recorder(recorder)
+    yield recorder
+    metrics.set_recorder(None)
+
+
+def test_generation_and_api_retries_are_counted_apart(Session, recorder):
+    scheduler = RequestScheduler(1, requests_per_minute=0, tokens_per_minute=0, sleep=lambda seconds: None)
+    responses = [openai.error.RateLimitError("slow down"), "ok"]
+
+    def request():
+        response = responses.pop(0)
+        if isinstance(response, Exception):
+            raise response
+        return response
+
+    with metrics.span("GenerationAgent.stream_questions"):
+        assert scheduler.call("alice", 1, request) == "ok"
+        metrics.increment("generation_retries")
+        metrics.increment("generation_retries")
+    recorder.flush()
+
+    summary = metrics.generation_summary(metrics.load_spans(Session, time.time() - 60))
+    assert summary["api_retries"] == 1
+    assert summary["generation_retries"] == 2
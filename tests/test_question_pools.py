@@ -0,0 +1,55 @@
+from agents import PLACEHOLDER_QUESTION, PLACEHOLDER_SOLUTION, QuestionBankAgent
+from jobs import JobQueue
+from question_pools import POOL_OWNER, QuestionPool
+
+STATEMENTS = ["SELECT", "FROM", "WHERE"]
+
+
+def save(Session, count, schema_name="Shop"):
+    QuestionBankAgent(Session).save_questions(
+        [f"Question {i}" for i in range(count)], [f"SELECT c{i} FROM t;" for i in range(count)],
+        schema_name=schema_name, difficulty="Level 1", statements=STATEMENTS,
+    )
+
+
+def test_an_assessment_never_draws_a_question_twice(Session):
+    save(Session, 5)
+    pool = QuestionPool(Session)
+    first = pool.draw("Shop", "Level 1", STATEMENTS, 3, "alice:quiz")
+    second = pool.draw("Shop", "Level 1", STATEMENTS, 3, "alice:quiz")
+    assert len(first) == 3 and len(second) == 2
+    assert not {row.id for row in first} & {row.id for row in second}
+    assert pool.draw("Shop", "Level 1", STATEMENTS, 3, "alice:quiz") == []
+
+
+def test_draws_prefer_the_least_served_questions(Session):
+    save(Session, 4)
+    pool = QuestionPool(Session)
+    first = pool.draw("Shop", "Level 1", STATEMENTS, 2, "alice:quiz")
+    second = pool.draw("Shop", "Level 1", STATEMENTS, 2, "bob:quiz")
+    assert not {row.id for row in first} & {row.id for row in second}
+    assert pool.available("Shop", "Level 1", STATEMENTS) == 0
+
+
+def test_placeholders_and_other_pools_are_not_drawn(Session):
+    save(Session, 2, schema_name="Library")
+    QuestionBankAgent(Session).save_questions(
+        [PLACEHOLDER_QUESTION], [PLACEHOLDER_SOLUTION],
+        schema_name="Shop", difficulty="Level 1", statements=STATEMENTS,
+    )
+    pool = QuestionPool(Session)
+    assert pool.draw("Shop", "Level 1", STATEMENTS, 5, "alice:quiz") == []
+    assert pool.available("Library", "Level 1", STATEMENTS) == 2
+
+
+def test_draw_below_low_water_queues_one_refill(Session):
+    save(Session, 3)
+    jobs = JobQueue(Session)
+    pool = QuestionPool(Session, jobs, low_water=2, target=10)
+    pool.draw("Shop", "Level 1", STATEMENTS, 1, "alice:quiz")
+    assert jobs.list_jobs(POOL_OWNER) == []
+    pool.draw("Shop", "Level 1", STATEMENTS, 1, "alice:quiz")
+    pool.draw("Shop", "Level 1", STATEMENTS, 1, "bob:quiz")
+    queued = jobs.list_jobs(POOL_OWNER)
+    assert len(queued) == 1
+    assert queued[0]["num_questions"] == 9
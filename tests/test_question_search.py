@@ -0,0 +1,50 @@
+from sqlalchemy import update
+
+from agents import QuestionBankAgent
+from models import Question
+from storage import session_scope
+
+
+def add_question(Session, question_text, solution="SELECT 1;"):
+    with session_scope(Session) as session:
+        question = Question(text=question_text, solution=solution, schema_name="Shop", difficulty="Level 1")
+        session.add(question)
+        session.flush()
+        return question.id
+
+
+def search_ids(Session, search):
+    return [row.id for row in QuestionBankAgent(Session).search(search)]
+
+
+def test_inserted_questions_are_searchable(Session):
+    question_id = add_question(Session, "List every customer from Berlin")
+    assert search_ids(Session, "berlin") == [question_id]
+
+
+def test_editing_text_reindexes_the_question(Session):
+    question_id = add_question(Session, "List every customer from Berlin")
+    with session_scope(Session) as session:
+        session.execute(update(Question).where(Question.id == question_id).values(text="List every order from Paris"))
+    assert search_ids(Session, "berlin") == []
+    assert search_ids(Session, "paris") == [question_id]
+
+
+def test_deleted_questions_leave_the_index(Session):
+    question_id = add_question(Session, "List every customer from Berlin")
+    with session_scope(Session) as session:
+        session.execute(Question.__table__.delete().where(Question.id == question_id))
+    assert search_ids(Session, "berlin") == []
+
+
+def test_updating_other_columns_leaves_the_index_alone(engine, Session):
+    question_id = add_question(Session, "List every customer from Berlin")
+    with engine.connect() as conn:
+        dbapi = conn.connection.driver_connection
+        before = dbapi.total_changes
+        conn.execute(update(Question).where(Question.id == question_id).values(served=Question.served + 1))
+        conn.commit()
+        # total_changes counts rows changed by triggers too
+        assert dbapi.total_changes - before == 1
+    assert search_ids(Session, "berlin") == [question_id]
+
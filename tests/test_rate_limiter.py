@@ -0,0 +1,107 @@
+import openai
+import pytest
+
+from rate_limiter import CircuitOpenError, RequestScheduler
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+def make_scheduler(clock, max_concurrent=2):
+    return RequestScheduler(max_concurrent, requests_per_minute=0, tokens_per_minute=0, max_retries=0,
+                            breaker_threshold=3, breaker_cooldown=30.0, clock=clock, sleep=clock.sleep)
+
+
+def unavailable():
+    raise openai.error.ServiceUnavailableError("down")
+
+
+def open_circuit(scheduler):
+    for _ in range(scheduler.breaker_threshold):
+        with pytest.raises(openai.error.ServiceUnavailableError):
+            scheduler.call("a", 1, unavailable)
+    assert scheduler.state()["circuit"] == "open"
+
+
+def test_circuit_opens_after_failures_in_a_row_and_rejects_calls():
+    clock = Clock()
+    scheduler = make_scheduler(clock)
+    open_circuit(scheduler)
+    with pytest.raises(CircuitOpenError):
+        scheduler.call("a", 1, lambda: "ok")
+    assert scheduler.state()["rejected"] == 1
+
+
+def test_trial_success_closes_the_circuit():
+    clock = Clock()
+    scheduler = make_scheduler(clock)
+    open_circuit(scheduler)
+    clock.now += 30
+    assert scheduler.call("a", 1, lambda: "ok") == "ok"
+    state = scheduler.state()
+    assert state["circuit"] == "closed"
+    assert scheduler.failures == 0
+
+
+def test_trial_failure_opens_the_circuit_again():
+    clock = Clock()
+    scheduler = make_scheduler(clock)
+    open_circuit(scheduler)
+    clock.now += 30
+    with pytest.raises(openai.error.ServiceUnavailableError):
+        scheduler.call("a", 1, unavailable)
+    assert scheduler.state()["circuit"] == "open"
+    with pytest.raises(CircuitOpenError):
+        scheduler.call("a", 1, lambda: "ok")
+    clock.now += 30
+    assert scheduler.call("a", 1, lambda: "ok") == "ok"
+
+
+def test_only_one_trial_at_a_time():
+    clock = Clock()
+    scheduler = make_scheduler(clock)
+    open_circuit(scheduler)
+    clock.now += 30
+    assert scheduler.acquire("a", 1) is True
+    assert scheduler.state()["circuit"] == "half-open"
+    with pytest.raises(CircuitOpenError):
+        scheduler.call("b", 1, lambda: "ok")
+
+
+def test_trial_that_times_out_waiting_for_a_slot_does_not_block_later_calls():
+    clock = Clock()
+    scheduler = make_scheduler(clock, max_concurrent=1)
+    # Holds the only slot so the trial has to wait
+    assert scheduler.acquire("a", 1) is False
+    for _ in range(scheduler.breaker_threshold):
+        scheduler.failed(openai.error.ServiceUnavailableError("down"), 0)
+    clock.now += 30
+    with pytest.raises(openai.error.Timeout):
+        scheduler.call("b", 1, lambda: "ok", timeout=0)
+    assert scheduler.state()["circuit"] == "open"
+    scheduler.release(1, 1)
+    assert scheduler.call("b", 1, lambda: "ok") == "ok"
+    assert scheduler.state()["circuit"] == "closed"
+
+
+def test_interrupted_trial_does_not_block_later_calls():
+    clock = Clock()
+    scheduler = make_scheduler(clock)
+    open_circuit(scheduler)
+    clock.now += 30
+
+    def interrupted():
+        raise KeyboardInterrupt
+
+    with pytest.raises(KeyboardInterrupt):
+        scheduler.call("a", 1, interrupted)
+    assert scheduler.call("a", 1, lambda: "ok") == "ok"
+    assert scheduler.state()["circuit"] == "closed"
@@ -0,0 +1,69 @@
+import sqlite3
+
+from sqlalchemy import text
+
+from practice_db import build_database_image
+from schema_import import import_schema, source_engine
+
+SHOP_SQL = """
+CREATE TABLE customers (id INTEGER PRIMARY KEY, name TEXT NOT NULL);
+CREATE TABLE products (sku TEXT PRIMARY KEY, price REAL);
+CREATE TABLE orders (id INTEGER PRIMARY KEY, customer_id INTEGER NOT NULL REFERENCES customers(id), placed TEXT);
+CREATE TABLE order_items (
+    order_id INTEGER NOT NULL REFERENCES orders(id),
+    sku TEXT NOT NULL REFERENCES products(sku),
+    quantity INTEGER,
+    PRIMARY KEY (order_id, sku)
+);
+CREATE TABLE employees (id INTEGER PRIMARY KEY, manager_id INTEGER REFERENCES employees(id));
+"""
+
+
+def fill_shop(execute):
+    execute("INSERT INTO customers VALUES " + ", ".join(f"({i}, 'Customer {i}')" for i in range(1, 2001)))
+    execute("INSERT INTO products VALUES " + ", ".join(f"('P{i}', {i}.5)" for i in range(1, 501)))
+    execute("INSERT INTO orders VALUES " + ", ".join(f"({i}, {i % 2000 + 1}, '2024-01-01')" for i in range(1, 5001)))
+    execute("INSERT INTO order_items VALUES " + ", ".join(f"({i // 2 + 1}, 'P{i % 500 + 1}', 1)" for i in range(0, 9998)))
+    execute("INSERT INTO employees VALUES " + ", ".join(f"({i}, {'NULL' if i == 1 else (i - 1) // 2 + 1})" for i in range(1, 301)))
+
+
+def assert_consistent(result, rows_per_table):
+    conn = sqlite3.connect(":memory:")
+    conn.deserialize(build_database_image(result.schema_sql, result.sample_data))
+    assert conn.execute("PRAGMA foreign_key_check").fetchall() == []
+    # Child tables are sampled in full, not cut down to the parents' sample
+    assert len(result.sample_data["order_items"]) == rows_per_table
+    assert len(result.sample_data["orders"]) >= rows_per_table
+    # Every sampled item finds its order, and every order its customer
+    joined = conn.execute(
+        "SELECT COUNT(*) FROM order_items JOIN orders ON orders.id = order_items.order_id "
+        "JOIN customers ON customers.id = orders.customer_id"
+    ).fetchone()[0]
+    assert joined == rows_per_table
+
+
+def test_sqlite_import_samples_children_and_backfills_parents(tmp_path):
+    path = tmp_path / "shop.db"
+    conn = sqlite3.connect(path)
+    conn.executescript(SHOP_SQL)
+    fill_shop(conn.execute)
+    conn.commit()
+    conn.close()
+
+    result = import_schema(str(path), rows_per_table=50, seed=1)
+    assert result.tables == 5
+    assert_consistent(result, 50)
+
+
+def test_postgres_import(pg_url):
+    engine = source_engine(pg_url)
+    with engine.begin() as conn:
+        conn.execute(text(SHOP_SQL.replace("INTEGER PRIMARY KEY", "SERIAL PRIMARY KEY")))
+        fill_shop(lambda sql: conn.execute(text(sql)))
+        # Up-to-date statistics, so the large tables are read through TABLESAMPLE
+        conn.execute(text("ANALYZE"))
+    engine.dispose()
+
+    result = import_schema(pg_url, rows_per_table=20, seed=1)
+    assert "CREATE TABLE order_items" in result.schema_sql
+    assert_consistent(result, 20)
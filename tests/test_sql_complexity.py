@@ -0,0 +1,95 @@
+import pytest
+
+from sql_complexity import analyze_sql, estimate_level, fits_request, score
+
+# One ordinary query per level description in QuestionGenerationAgent.generate_sql_prompt:
+# (statements, requested level, solution)
+CANONICAL = [
+    (["SELECT", "FROM", "WHERE"], "Level 1", "SELECT name FROM customers WHERE city = 'Paris';"),
+    (["SELECT", "FROM", "WHERE"], "Level 2", "SELECT name, email FROM customers WHERE age > 30;"),
+    (["SELECT", "FROM", "WHERE"], "Level 3", "SELECT name FROM customers WHERE city = 'Paris' AND age > 30;"),
+    (["SELECT", "FROM", "WHERE"], "Level 4", "SELECT name FROM customers WHERE name LIKE 'A%';"),
+    (["SELECT", "FROM", "WHERE"], "Level 4", "SELECT id FROM orders WHERE total BETWEEN 10 AND 50;"),
+    (["SELECT", "FROM", "WHERE"], "Level 5", "SELECT name FROM customers WHERE city IN ('Paris', 'Rome');"),
+    (["SELECT", "FROM", "WHERE"], "Level 5", "SELECT id FROM orders WHERE total BETWEEN 10 AND 50;"),
+    (["SELECT", "FROM", "WHERE"], "Level 5", "SELECT name FROM customers WHERE name LIKE 'A%';"),
+    (["SELECT", "FROM", "WHERE"], "Level 5",
+     "SELECT name FROM customers WHERE city IN ('Paris', 'Rome') AND name LIKE 'A%';"),
+    (["SELECT", "FROM", "JOIN"], "Level 1",
+     "SELECT c.name, o.total FROM customers c JOIN orders o ON o.customer_id = c.id;"),
+    (["SELECT", "FROM", "JOIN", "WHERE"], "Level 3",
+     "SELECT c.name, p.name FROM customers c JOIN orders o ON o.customer_id = c.id "
+     "JOIN products p ON p.id = o.product_id WHERE o.total > 100;"),
+    (["SELECT", "FROM", "JOIN", "WHERE"], "Level 5",
+     "SELECT c.name, o.total FROM customers c JOIN orders o ON o.customer_id = c.id WHERE c.name LIKE 'A%';"),
+    (["SELECT", "FROM", "GROUP BY"], "Level 1", "SELECT city, COUNT(*) FROM customers GROUP BY city;"),
+    (["SELECT", "FROM", "GROUP BY", "HAVING"], "Level 1",
+     "SELECT city, COUNT(*) FROM customers GROUP BY city HAVING COUNT(*) > 5;"),
+    (["SELECT", "FROM", "GROUP BY", "HAVING"], "Level 2",
+     "SELECT city, COUNT(*) FROM customers GROUP BY city HAVING COUNT(*) > 5;"),
+    (["SELECT", "FROM", "GROUP BY", "HAVING"], "Level 5",
+     "SELECT city, COUNT(*), AVG(age) FROM customers GROUP BY city HAVING COUNT(*) > 5 AND AVG(age) < 40;"),
+    (["SELECT", "FROM", "ORDER BY"], "Level 1", "SELECT name FROM customers ORDER BY name;"),
+    (["SELECT", "FROM", "ORDER BY"], "Level 3", "SELECT name, age FROM customers ORDER BY age DESC, name;"),
+    (["SELECT", "FROM", "ORDER BY"], "Level 5", "SELECT name, age FROM customers ORDER BY age DESC, name;"),
+]
+
+
+@pytest.mark.parametrize("statements,difficulty,solution", CANONICAL)
+def test_canonical_query_fits_its_level(statements, difficulty, solution):
+    fits, points, level = fits_request(solution, difficulty, statements)
+    assert fits, f"{solution} scored {points} ({level}) for {difficulty}"
+
+
+NESTED_JOINS = (
+    "SELECT c.name FROM customers c JOIN orders o ON o.customer_id = c.id "
+    "JOIN products p ON p.id = o.product_id JOIN suppliers s ON s.id = p.supplier_id "
+    "WHERE o.total > (SELECT AVG(total) FROM orders);"
+)
+
+
+def test_one_condition_on_one_table_is_rejected_at_level_3():
+    assert not fits_request("SELECT name FROM customers WHERE city = 'Paris';", "Level 3", ["SELECT", "FROM", "WHERE"])[0]
+
+
+def test_three_joins_and_a_subquery_are_rejected_at_level_1():
+    fits, _, level = fits_request(NESTED_JOINS, "Level 1", ["SELECT", "FROM", "JOIN", "WHERE", "SUBQUERIES"])
+    assert not fits and level == "Level 5"
+
+
+@pytest.mark.parametrize("difficulty,fits", [("Level 1", False), ("Level 2", False), ("Level 4", True), ("Level 5", True)])
+def test_overshoot_is_rejected(difficulty, fits):
+    solution = ("SELECT c.city, COUNT(*) FROM customers c JOIN orders o ON o.customer_id = c.id "
+                "WHERE c.name LIKE 'A%' AND o.total BETWEEN 10 AND 50 GROUP BY c.city HAVING COUNT(*) > 5 "
+                "ORDER BY COUNT(*) DESC, c.city;")
+    statements = ["SELECT", "FROM", "JOIN", "WHERE", "GROUP BY", "HAVING", "ORDER BY"]
+    assert fits_request(solution, difficulty, statements)[0] == fits
+
+
+@pytest.mark.parametrize("statements,solution", [
+    (["SELECT", "FROM", "WHERE"], "SELECT name FROM customers WHERE city = 'Paris';"),
+    (["SELECT", "FROM", "ORDER BY"], "SELECT name FROM customers ORDER BY name;"),
+    (["SELECT", "FROM", "GROUP BY"], "SELECT city, COUNT(*) FROM customers GROUP BY city;"),
+])
+def test_trivial_query_is_rejected_at_level_5(statements, solution):
+    assert not fits_request(solution, "Level 5", statements)[0]
+
+
+def test_unselected_statement_is_rejected():
+    assert fits_request("SELECT name FROM customers ORDER BY name;", "Level 1", ["SELECT", "FROM", "WHERE"]) == (False, None, None)
+
+
+def test_levels_rise_with_the_features_the_prompt_asks_for():
+    statements = ["SELECT", "FROM", "WHERE"]
+    simple = score(analyze_sql("SELECT name FROM customers WHERE city = 'Paris';"), statements)
+    logical = score(analyze_sql("SELECT name FROM customers WHERE city = 'Paris' AND age > 30;"), statements)
+    advanced = score(analyze_sql("SELECT name FROM customers WHERE city IN ('Paris', 'Rome') AND name LIKE 'A%';"), statements)
+    assert simple < logical < advanced
+    assert estimate_level(simple) == "Level 1"
+    assert estimate_level(advanced) == "Level 5"
+
+
+def test_scores_count_what_goes_beyond_the_plainest_query_of_the_prompt():
+    join = analyze_sql("SELECT c.name, o.total FROM customers c JOIN orders o ON o.customer_id = c.id;")
+    assert score(join, ["SELECT", "FROM", "JOIN"]) == 0
+    assert score(join) == score(join, ["SELECT", "FROM", "ORDER BY"]) > 0
@@ -0,0 +1,76 @@
+import threading
+
+from sqlalchemy import inspect, text
+from sqlalchemy.orm import sessionmaker
+
+from agents import QuestionBankAgent
+from jobs import JobQueue
+from models import COLUMN_MIGRATIONS, migrate_database
+from question_pools import QuestionPool
+from storage import check_storage, create_storage_engine
+
+STATEMENTS = ["SELECT", "FROM", "WHERE"]
+
+
+def test_check_storage(pg_url):
+    assert check_storage(pg_url) == 1
+
+
+def test_migration_adds_missing_columns(pg_url):
+    engine = create_storage_engine(pg_url)
+    with engine.begin() as conn:
+        # The questions table as it was before any column migrations
+        conn.execute(text("CREATE TABLE questions (id SERIAL PRIMARY KEY, text TEXT NOT NULL, solution TEXT NOT NULL)"))
+        conn.execute(text("INSERT INTO questions (text, solution) VALUES ('q', 'SELECT 1;')"))
+    migrate_database(engine)
+    migrate_database(engine)
+    columns = {column["name"] for column in inspect(engine).get_columns("questions")}
+    assert {name for name, _ in COLUMN_MIGRATIONS["questions"]} <= columns
+    with engine.connect() as conn:
+        assert conn.execute(text("SELECT served FROM questions")).scalar() == 0
+    engine.dispose()
+
+
+def test_saved_questions_keep_their_order_and_are_searchable(pg_engine):
+    bank = QuestionBankAgent(sessionmaker(bind=pg_engine))
+    ids = bank.save_questions(
+        ["List customers in Berlin", "Count all orders", "Average order amount"],
+        ["SELECT * FROM customers WHERE city = 'Berlin';", "SELECT COUNT(*) FROM orders;", "SELECT AVG(amount) FROM orders;"],
+        schema_name="Shop", difficulty="Level 1", statements=STATEMENTS,
+    )
+    assert ids == sorted(ids) and len(ids) == 3
+    # Without FTS5 the search falls back to a case-insensitive ILIKE
+    assert [row.id for row in bank.search("BERLIN")] == [ids[0]]
+    assert [row.id for row in bank.search("orders")] == [ids[2], ids[1]]
+
+
+def test_only_one_worker_claims_a_job(pg_engine):
+    Session = sessionmaker(bind=pg_engine)
+    job_id = JobQueue(Session, workers=0).submit("alice", "Shop", "Level 1", STATEMENTS, 5)
+    claimed = []
+    barrier = threading.Barrier(4)
+
+    def claim():
+        barrier.wait()
+        claimed.append(JobQueue(Session, workers=0).claim())
+
+    threads = [threading.Thread(target=claim) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert [job["id"] for job in claimed if job] == [job_id]
+
+
+def test_pool_draws_on_postgres(pg_engine):
+    Session = sessionmaker(bind=pg_engine)
+    QuestionBankAgent(Session).save_questions(
+        [f"Question {i}" for i in range(5)], [f"SELECT {i};" for i in range(5)],
+        schema_name="Shop", difficulty="Level 1", statements=STATEMENTS,
+    )
+    pool = QuestionPool(Session)
+    first = pool.draw("Shop", "Level 1", STATEMENTS, 3, "alice:quiz")
+    second = pool.draw("Shop", "Level 1", STATEMENTS, 3, "alice:quiz")
+    assert len(first) == 3 and len(second) == 2
+    assert not {row.id for row in first} & {row.id for row in second}
+    assert pool.available("Shop", "Level 1", STATEMENTS) == 0
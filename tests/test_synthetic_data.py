@@ -0,0 +1,54 @@
+import os
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import synthetic_data
+from synthetic_data import database_path, generate_database, new_database_path, remove_stale_databases
+
+SCHEMA = """
+CREATE TABLE customers (id INTEGER PRIMARY KEY, name TEXT NOT NULL);
+CREATE TABLE orders (id INTEGER PRIMARY KEY, customer_id INTEGER NOT NULL REFERENCES customers(id), total REAL);
+"""
+
+
+def test_concurrent_writers_of_one_path_never_share_a_file(tmp_path):
+    path = str(tmp_path / "shop.db")
+    with ThreadPoolExecutor(max_workers=4) as pool:
+        results = list(pool.map(lambda seed: generate_database(SCHEMA, path, {"rows": 5000}, seed, batch_rows=500), range(4)))
+    assert all(sum(result.rows.values()) == 10000 for result in results)
+    assert os.listdir(tmp_path) == ["shop.db"]
+    conn = sqlite3.connect(path)
+    assert conn.execute("SELECT COUNT(*) FROM orders").fetchone()[0] == 5000
+    assert conn.execute("PRAGMA foreign_key_check").fetchall() == []
+    conn.close()
+
+
+def test_each_session_gets_its_own_database_file(tmp_path, monkeypatch):
+    monkeypatch.setattr(synthetic_data, "PRACTICE_DB_DIR", str(tmp_path / "practice"))
+    first, second = new_database_path("Shop System"), new_database_path("Shop System")
+    assert first != second
+    assert os.path.basename(first).startswith("shop-system-") and first.endswith(".db")
+    generate_database(SCHEMA, first, {"rows": 100}, 1)
+    generate_database(SCHEMA, second, {"rows": 200}, 2)
+    assert sqlite3.connect(first).execute("SELECT COUNT(*) FROM customers").fetchone()[0] == 100
+    assert sqlite3.connect(second).execute("SELECT COUNT(*) FROM customers").fetchone()[0] == 200
+
+
+def test_stale_session_databases_are_removed(tmp_path, monkeypatch):
+    monkeypatch.setattr(synthetic_data, "PRACTICE_DB_DIR", str(tmp_path))
+    stale, fresh = new_database_path("Shop"), new_database_path("Shop")
+    leftover = stale + ".tmp"
+    open(leftover, "w").close()
+    saved = database_path("Shop")
+    open(saved, "w").close()
+    old = time.time() - 2 * 3600
+    for path in (stale, leftover, saved):
+        os.utime(path, (old, old))
+
+    assert remove_stale_databases(ttl=3600) == 2
+    assert os.path.exists(fresh)
+    assert not os.path.exists(stale) and not os.path.exists(leftover)
+    # Databases written from the command line are the user's to remove
+    assert os.path.exists(saved)
+    assert remove_stale_databases(ttl=3600) == 0
@@ -0,0 +1,129 @@
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from xml.sax.saxutils import escape, quoteattr
+
+from sql_validation import SQLSandbox, SQLValidationError
+
+# Seconds a single solution may run while computing its expected output
+QUERY_TIMEOUT = 5.0
+EXPECTED_ROW_CAP = 200
+# Solutions run at once; sqlite3 releases the GIL while a query runs
+EXPORT_WORKERS = 4
+
+
+def format_result(columns, rows, truncated=False):
+    # sqlite3 shell style: a header line, then one '|' separated line per row
+    def cell(value):
+        return "" if value is None else str(value)
+
+    lines = ["|".join(columns)]
+    lines.extend("|".join(cell(value) for value in row) for row in rows)
+    if truncated:
+        lines.append("...")
+    return "\n".join(lines)
+
+
+def _expected_output(sandbox, solution):
+    try:
+        return format_result(*sandbox.run(solution))
+    except SQLValidationError as e:
+        return f"-- Error running solution: {e}"
+
+
+def compute_expected_outputs(db_image, solutions, timeout=QUERY_TIMEOUT, row_cap=EXPECTED_ROW_CAP, max_workers=None):
+    # Yields one formatted output per solution, in order, as soon as it is ready.
+    # Threads, not processes: the app process runs job workers and other pools,
+    # and forking a multi-threaded process can deadlock. max_workers=0 runs them
+    # one after another in the calling thread.
+    solutions = [solution.replace('```', '').strip() for solution in solutions]
+    if not solutions:
+        return
+    # The sandbox gives every thread its own copy of the database
+    sandbox = SQLSandbox(db_image, timeout=timeout, row_cap=row_cap)
+    if max_workers == 0:
+        for solution in solutions:
+            yield _expected_output(sandbox, solution)
+        return
+    pool = ThreadPoolExecutor(max_workers=min(len(solutions), max_workers or EXPORT_WORKERS), thread_name_prefix="export")
+    try:
+        futures = [pool.submit(_expected_output, sandbox, solution) for solution in solutions]
+        for future in futures:
+            try:
+                # The sandbox enforces the timeout; this only guards against a stuck query
+                yield future.result(timeout=timeout + 30)
+            except FutureTimeoutError:
+                yield f"-- Error running solution: no result after {timeout}s"
+            except Exception as e:
+                yield f"-- Error running solution: {e}"
+    finally:
+        pool.shutdown(wait=False, cancel_futures=True)
+
+
+def _element(tag, text="", **attributes):
+    attrs = "".join(f" {name}={quoteattr(value)}" for name, value in attributes.items())
+    return f"<{tag}{attrs}>{escape(text)}</{tag}>"
+
+
+def _text_element(tag, text="", **attributes):
+    attrs = "".join(f" {name}={quoteattr(value)}" for name, value in attributes.items())
+    return f"<{tag}{attrs}><text>{escape(text)}</text></{tag}>"
+
+
+def _cdata(text):
+    return "<![CDATA[" + text.replace("]]>", "]]]]><![CDATA[>") + "]]>"
+
+
+def iter_quiz_xml(questions, solutions, expected_outputs=None):
+    # Writes the Moodle/CodeRunner quiz one question at a time instead of
+    # building the whole tree in memory first
+    yield '<?xml version="1.0" encoding="UTF-8"?>\n<quiz>\n'
+    expected_outputs = iter(expected_outputs) if expected_outputs is not None else None
+
+    for i, (question, solution_set) in enumerate(zip(questions, solutions), 1):
+        expected = next(expected_outputs) if expected_outputs is not None else "EXPECTED OUTPUT HERE"
+        cleaned_solution = solution_set.replace('```', '').strip()
+        # The question text is HTML: escape it once for HTML and wrap it in CDATA
+        question_html = f"<p>{escape(question)}</p>"
+
+        yield "".join([
+            '<question type="coderunner">\n',
+            _text_element("name", f"Question {i}"), "\n",
+            f'<questiontext format="html"><text>{_cdata(question_html)}</text></questiontext>\n',
+            _text_element("generalfeedback", "", format="html"), "\n",
+            _element("defaultgrade", "1.0000000"), "\n",
+            _element("penalty", "0.0000000"), "\n",
+            _element("hidden", "0"), "\n",
+            _element("answer", cleaned_solution), "\n",
+            "<testcases>\n",
+            '<testcase testtype="0" useasexample="1" hiderestiffail="0" mark="1.0000000">\n',
+            _text_element("testcode", "-- Testing with original db"), "\n",
+            _text_element("stdin", ""), "\n",
+            _text_element("expected", expected), "\n",
+            _text_element("extra", ""), "\n",
+            _text_element("display", "SHOW"), "\n",
+            "</testcase>\n</testcases>\n</question>\n",
+        ])
+
+    yield "</quiz>\n"
+
+
+def export_to_xml(f, questions, solutions, db_image=None, expected_outputs=None):
+    # Writes the quiz to the text file f. With a practice database, the solutions
+    # are run to fill in the expected output, unless the outputs were computed
+    # already; each question is written as soon as its result arrives, so the
+    # document is never held in memory whole
+    if expected_outputs is None and db_image is not None:
+        expected_outputs = compute_expected_outputs(db_image, solutions)
+    for chunk in iter_quiz_xml(questions, solutions, expected_outputs):
+        f.write(chunk)
+
+
+def export_to_markdown(questions, solutions, expected_outputs=None, title=None):
+    # The same questions as a Markdown handout, for review outside Moodle
+    expected_outputs = iter(expected_outputs) if expected_outputs is not None else None
+    parts = [f"# {title}\n\n"] if title else []
+    for i, (question, solution) in enumerate(zip(questions, solutions), 1):
+        parts.append(f"## Question {i}\n\n{question}\n\n```sql\n{solution.replace('```', '').strip()}\n```\n\n")
+        if expected_outputs is not None:
+            parts.append(f"Expected output:\n\n```\n{next(expected_outputs)}\n```\n\n")
+    return "".join(parts)